@@ -14,15 +14,125 @@
 # Copyright: 2023 IBM
 # Author: Samir A Mulani <samir@linux.vnet.ibm.com>
 
+import json
 import multiprocessing
 import os
 import re
+import statistics
+import threading
 import time
 from avocado import Test
 from avocado.utils import process, cpu, distro
 from avocado.utils.software_manager.manager import SoftwareManager
 
 
+class CpuUtilSampler(object):
+
+    """
+    Sample per-CPU utilization from /proc/stat deltas in a background
+    thread.
+
+    /proc/stat is kept open and re-read at every interval, each sample
+    holds the busy percentage of every CPU seen in two consecutive reads.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+
+    @staticmethod
+    def _read_times(stat_fd):
+        stat_fd.seek(0)
+        times = {}
+        for line in stat_fd.read().splitlines():
+            if not line.startswith('cpu') or line.startswith('cpu '):
+                continue
+            fields = line.split()
+            values = [int(val) for val in fields[1:]]
+            # idle + iowait are the idle columns, guest time is already
+            # accounted in user/nice
+            idle = values[3] + values[4]
+            total = sum(values[:8])
+            times[int(fields[0][3:])] = (total - idle, total)
+        return times
+
+    def _run(self):
+        with open('/proc/stat', 'r') as stat_fd:
+            prev = self._read_times(stat_fd)
+            while not self._stop.wait(self.interval):
+                cur = self._read_times(stat_fd)
+                util = {}
+                for cpu_id, (busy, total) in cur.items():
+                    if cpu_id not in prev:
+                        continue
+                    delta = total - prev[cpu_id][1]
+                    if delta <= 0:
+                        continue
+                    util[cpu_id] = 100.0 * (busy - prev[cpu_id][0]) / delta
+                self.samples.append((time.time() - self._start_time, util))
+                prev = cur
+
+    def start(self):
+        self.samples = []
+        self._stop.clear()
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def imbalance(util, busy_cpus):
+        """
+        Imbalance of one sample over the busy_cpus busiest CPUs.
+
+        With fewer workload threads than CPUs some CPUs are expected to be
+        idle, so only as many CPUs as there are threads are considered: a
+        balanced placement keeps all of them equally loaded.
+
+        :return: (coefficient of variation, max - min spread)
+        """
+        values = sorted(util.values(), reverse=True)[:busy_cpus]
+        if len(values) < 2:
+            return 0.0, 0.0
+        mean = statistics.mean(values)
+        cov = statistics.pstdev(values) / mean if mean else 0.0
+        return cov, max(values) - min(values)
+
+    def metrics(self, busy_cpus, max_cov, settle_samples):
+        """
+        Imbalance metrics of the collected time series.
+
+        Time to balance is the time of the first sample from which the
+        coefficient of variation stays within max_cov for settle_samples
+        consecutive samples, None if the load never settled.
+        """
+        series = [(stamp,) + self.imbalance(util, busy_cpus)
+                  for stamp, util in self.samples if util]
+        time_to_balance = None
+        streak = 0
+        for idx, (stamp, cov, _) in enumerate(series):
+            streak = streak + 1 if cov <= max_cov else 0
+            if streak == settle_samples:
+                time_to_balance = series[idx - settle_samples + 1][0]
+                break
+        covs = [cov for _, cov, _ in series] or [0.0]
+        spreads = [spread for _, _, spread in series] or [0.0]
+        return {'samples': len(series),
+                'mean_cov': statistics.mean(covs),
+                'max_cov': max(covs),
+                'mean_spread': statistics.mean(spreads),
+                'max_spread': max(spreads),
+                'time_to_balance': time_to_balance}
+
+
 class load_balancer(Test):
     """
     _test summary_
@@ -42,6 +152,7 @@ class load_balancer(Test):
     """
 
     def setUp(self):
+        self.sampler = None
         self.total_cpus = 0
         self.current_totalcpus = 0
         file_path = "/tmp/mpstat.log"
@@ -62,6 +173,16 @@ class load_balancer(Test):
         self.no_threads = self.params.get("no_threads", default=4)
         self.cpu_cycles = self.params.get("cpu_cycles", default=10000000)
         self.capacity = self.params.get("capacity", default=30)
+        self.analyzer = self.params.get("analyzer", default="sampler")
+        self.sample_interval = float(self.params.get("sample_interval",
+                                                     default=0.2))
+        self.sample_duration = float(self.params.get("sample_duration",
+                                                     default=10))
+        self.max_cov = float(self.params.get("max_cov", default=0.1))
+        self.settle_samples = int(self.params.get("settle_samples",
+                                                  default=5))
+        self.sampler = CpuUtilSampler(self.sample_interval)
+        self.balance_results = {}
         distro_name = self.detected_distro.name
         distro_ver = self.detected_distro.version
         distro_rel = self.detected_distro.release
@@ -157,14 +278,66 @@ class load_balancer(Test):
                         %s core's: %s utilization: %s", smt_mode, core,
                           utilization_bck)
 
+    def sampler_analyzer(self, on_cpu_count, smt_mode, core):
+        """
+        Sample per-CPU utilization for the whole sampling window right
+        after the SMT/core change and check how fast the load balancer
+        spreads the workload across the online CPUs.
+        """
+        self.sampler.start()
+        time.sleep(self.sample_duration)
+        self.sampler.stop()
+        busy_cpus = min(int(self.no_threads), on_cpu_count)
+        metrics = self.sampler.metrics(busy_cpus, self.max_cov,
+                                       self.settle_samples)
+        key = "cores=%s,smt=%s" % (core, smt_mode)
+        self.balance_results[key] = metrics
+        series_file = os.path.join(self.logdir, "mpstat",
+                                   "util_core[%s]_smt[%s].json" %
+                                   (core, smt_mode))
+        with open(series_file, "w") as f:
+            json.dump({'metrics': metrics,
+                       'series': [{'time': round(stamp, 3), 'util': util}
+                                  for stamp, util in self.sampler.samples]},
+                      f)
+        self.log.info("%s: cov mean %.3f max %.3f, spread mean %.1f max "
+                      "%.1f, time to balance %s", key, metrics['mean_cov'],
+                      metrics['max_cov'], metrics['mean_spread'],
+                      metrics['max_spread'], metrics['time_to_balance'])
+        return metrics['time_to_balance'] is not None
+
+    def report_balance(self):
+        """
+        Log the imbalance metrics per SMT mode and core count and fail if
+        the load never settled for any of them.
+        """
+        self.log.info("%-20s %8s %8s %10s %10s", "state", "mean_cov",
+                      "max_cov", "max_spread", "balance_s")
+        unbalanced = []
+        for key, metrics in self.balance_results.items():
+            ttb = metrics['time_to_balance']
+            self.log.info("%-20s %8.3f %8.3f %10.1f %10s", key,
+                          metrics['mean_cov'], metrics['max_cov'],
+                          metrics['max_spread'],
+                          "%.2f" % ttb if ttb is not None else "never")
+            if ttb is None:
+                unbalanced.append(key)
+        with open(os.path.join(self.logdir, "balance_summary.json"),
+                  "w") as f:
+            json.dump(self.balance_results, f, indent=4)
+        if unbalanced:
+            self.fail("Load-balancer did not converge within %ss for: %s"
+                      % (self.sample_duration, ", ".join(unbalanced)))
+
     def test(self):
         """
         In this function basically we are online and offline the
         cores and cpu's in sequence,
         1.Running the stress-ng workload.
         2.changing the SMT modes.
-        3.Validating the mpstat command output for CPU utilization
-        as per SMT mode.
+        3.Validating the CPU utilization as per SMT mode, either from
+        a continuous /proc/stat sampler (default) or from a single
+        mpstat snapshot (analyzer: mpstat).
         """
         mpstat_dir = self.logdir + "/mpstat"
         os.mkdir(mpstat_dir)
@@ -187,6 +360,13 @@ class load_balancer(Test):
                 cmd = "ppc64_cpu --smt={}".format(smt_mode)
                 self.log.info("smt mode %s", smt_mode)
                 process.run(cmd, shell=True)
+                on_cpu_count = int(multiprocessing.cpu_count())
+                self.log.info("After SMT mode %s no of \
+                        online cpu's %d", smt_mode, on_cpu_count)
+                self.current_totalcpus = int(multiprocessing.cpu_count())
+                if self.analyzer == "sampler":
+                    self.sampler_analyzer(on_cpu_count, smt_mode, core)
+                    continue
                 self.mpstat_log_file = mpstat_dir + \
                     "/mpstat_core["+str(core)+"]"+"_smt["+str(smt_mode)+"]"
                 cmd = "nohup mpstat -P ALL -u 1 &> %s &" % (
@@ -196,21 +376,21 @@ class load_balancer(Test):
                 lscpu_payload = "lscpu > /tmp/lscpu_" + \
                     str(core) + "_" + str(smt_mode)
                 process.run(lscpu_payload, shell=True)
-                on_cpu_count = int(multiprocessing.cpu_count())
-                self.log.info("After SMT mode %s no of \
-                        online cpu's %d", smt_mode, on_cpu_count)
                 online_cpu = cpu.online_count()
-                self.current_totalcpus = int(multiprocessing.cpu_count())
                 self.mpstat_analyzer(on_cpu_count, smt_mode, core)
                 process.run("ps aux | grep '[m]pstat' | grep -v grep | awk \
                 '{print $2}' | xargs kill -9", ignore_status=True,
                             shell=True)
+        if self.analyzer == "sampler":
+            self.report_balance()
 
     def tearDown(self):
         """
         1. Restoring the system with turning on all the core's and smt on.
         2. Killing the stress-ng workload
         """
+        if self.sampler:
+            self.sampler.stop()
         process.run("ps aux | grep '[m]pstat' | grep -v grep | awk \
                 '{print $2}' | xargs kill -9", ignore_status=True,
                     shell=True)
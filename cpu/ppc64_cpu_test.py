@@ -19,9 +19,15 @@
 Test to verify ppc64_cpu command.
 """
 
+import glob
+import json
+import multiprocessing
 import os
 import re
 import random
+import shutil
+import statistics
+import threading
 import time
 from avocado import Test
 from avocado.utils import process
@@ -31,6 +37,35 @@ from avocado.utils import genio
 from avocado.utils.software_manager.manager import SoftwareManager
 from math import ceil
 
+SYSFS_CPU = "/sys/devices/system/cpu"
+
+
+def _spin_worker(counter, stop_event):
+    """
+    Background workload: count fixed-size chunks of busy work so the
+    throughput seen during SMT/core transitions can be sampled.
+    """
+    while not stop_event.is_set():
+        for _ in range(20000):
+            pass
+        counter.value += 1
+
+
+def _parse_cpu_list(cpu_list):
+    """
+    Expand a sysfs cpu list such as "0-3,8,10-11" into a set of ids.
+    """
+    cpus = set()
+    for chunk in cpu_list.strip().split(","):
+        if not chunk:
+            continue
+        if "-" in chunk:
+            start, end = chunk.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(chunk))
+    return cpus
+
 
 class PPC64Test(Test):
     """
@@ -44,10 +79,48 @@ class PPC64Test(Test):
         Helper function to reset system to clean state.
         Brings all cores online and enables SMT.
         """
-        process.system("ppc64_cpu --cores-on=all", shell=True)
-        process.system("ppc64_cpu --smt=on", shell=True)
+        if self.transition_backend == 'sysfs':
+            self._sysfs_set_state(self.max_smt_value, self.total_cores)
+        else:
+            process.system("ppc64_cpu --cores-on=all", shell=True)
+            process.system("ppc64_cpu --smt=on", shell=True)
         time.sleep(1)
 
+    def _all_cores_on(self):
+        """
+        Bring all cores online without touching the SMT mode.
+        """
+        if self.transition_backend == 'sysfs':
+            self._sysfs_set_cores(self.total_cores)
+        else:
+            process.system("ppc64_cpu --cores-on=all", shell=True)
+
+    def _require_ppc64_cpu(self):
+        """
+        Cancel tests that exercise the ppc64_cpu command itself when it
+        is not installed.
+        """
+        if not shutil.which('ppc64_cpu'):
+            self.cancel("ppc64_cpu is not available, this test needs it")
+
+    def _sysfs_topology(self):
+        """
+        (threads per core, cores) from the device tree interrupt servers,
+        the way ppc64_cpu computes them, or from the present CPUs and the
+        siblings of CPU 0.
+        """
+        servers = glob.glob("/proc/device-tree/cpus/*/"
+                            "ibm,ppc-interrupt-server#s")
+        if servers:
+            return os.path.getsize(servers[0]) // 4, len(servers)
+        present = _parse_cpu_list(genio.read_file(
+            os.path.join(SYSFS_CPU, "present")))
+        siblings = _parse_cpu_list(genio.read_file(
+            os.path.join(SYSFS_CPU, "cpu0", "topology",
+                         "thread_siblings_list")))
+        threads = max(len(siblings), 1)
+        return threads, len(present) // threads
+
     def setUp(self):
         """
         Verifies if powerpc-utils is installed, and gets current SMT value.
@@ -57,21 +130,43 @@ class PPC64Test(Test):
         self.sm = SoftwareManager()
         if not self.sm.check_installed("powerpc-utils"):
             if not self.sm.install("powerpc-utils"):
-                self.cancel("Cannot install powerpc-utils, check the log!")
+                self.log.warning("Cannot install powerpc-utils, only the "
+                                 "sysfs transition tests can run")
+
+        # SMT/core transition backend, sysfs when ppc64_cpu is missing
+        self.transition_backend = self.params.get(
+            'transition/backend', default='ppc64_cpu')
+        if not shutil.which('ppc64_cpu'):
+            self.transition_backend = 'sysfs'
 
         self.loop = int(self.params.get('test_loop', default=100))
         self.run_type = self.params.get('type', default='distro')
         self.smt_str = "ppc64_cpu --smt"
-        # Dynamically set max SMT specified at boot time
-        process.system("%s=on" % self.smt_str, shell=True)
-        # and get its value
-        smt_op = process.system_output(self.smt_str, shell=True).decode()
-        if "is not SMT capable" in smt_op:
-            self.cancel("Machine is not SMT capable")
-        if "Inconsistent state" in smt_op:
-            self.cancel("Machine has mix of ST and SMT cores")
-
-        self.curr_smt = smt_op.strip().split("=")[-1].split()[-1]
+        if self.transition_backend == 'sysfs':
+            self.sysfs_online = self._sysfs_online_cpus()
+            self.max_smt_value, self.total_cores = self._sysfs_topology()
+            if self.max_smt_value < 2:
+                self.cancel("Machine is not SMT capable")
+            self._sysfs_set_smt('on')
+            self.curr_smt = str(self.max_smt_value)
+        else:
+            # Dynamically set max SMT specified at boot time
+            process.system("%s=on" % self.smt_str, shell=True)
+            # and get its value
+            smt_op = process.system_output(self.smt_str,
+                                           shell=True).decode()
+            if "is not SMT capable" in smt_op:
+                self.cancel("Machine is not SMT capable")
+            if "Inconsistent state" in smt_op:
+                self.cancel("Machine has mix of ST and SMT cores")
+
+            self.curr_smt = smt_op.strip().split("=")[-1].split()[-1]
+            self.max_smt_value = int(self.curr_smt)
+
+            # Get total cores for dynamic tests
+            cores_output = process.system_output("ppc64_cpu --cores-present",
+                                                 shell=True).decode()
+            self.total_cores = int(cores_output.strip().split()[-1])
         self.smt_subcores = 0
         if os.path.exists("/sys/devices/system/cpu/subcores_per_core"):
             self.smt_subcores = 1
@@ -79,12 +174,6 @@ class PPC64Test(Test):
         self.smt_values = {1: "off"}
         self.key = 0
         self.value = ""
-        self.max_smt_value = int(self.curr_smt)
-
-        # Get total cores for dynamic tests
-        cores_output = process.system_output("ppc64_cpu --cores-present",
-                                             shell=True).decode()
-        self.total_cores = int(cores_output.strip().split()[-1])
 
         # Generate all possible SMT values dynamically
         self.all_smt_values = self._generate_smt_values()
@@ -136,6 +225,24 @@ class PPC64Test(Test):
         self.verbose_logging = self.params.get('logging/verbose', default=True)
         self.log_dmesg = self.params.get('logging/log_dmesg', default=True)
 
+        # SMT/core transition timing
+        self.settle_timeout = float(self.params.get(
+            'transition/settle_timeout', default=60))
+        self.poll_interval = float(self.params.get(
+            'transition/poll_interval', default=0.005))
+        self.transition_repeat = int(self.params.get(
+            'transition/repeat', default=3))
+        self.transition_cores = self.params.get(
+            'transition/cores', default=None)
+        self.run_workload = self.params.get(
+            'transition/workload', default=False)
+        self.workload_threads = int(self.params.get(
+            'transition/workload_threads', default=cpu.online_count()))
+        self.workload_window = float(self.params.get(
+            'transition/workload_window', default=1))
+        self.transitions = []
+        self.workload = None
+
         self.log.info("Total cores: %s, Max SMT: %s",
                       self.total_cores, self.max_smt_value)
         self.log.info("All SMT values to test: %s", self.all_smt_values)
@@ -154,6 +261,267 @@ class PPC64Test(Test):
         smt_values.append('on')
         return smt_values
 
+    def _sysfs_online_cpus(self):
+        """
+        Online CPUs as reported by sysfs.
+        """
+        return _parse_cpu_list(genio.read_file(
+            os.path.join(SYSFS_CPU, "online")))
+
+    def _smt_threads(self, smt_val):
+        """
+        Number of threads per core for an SMT value.
+        """
+        if str(smt_val) == 'off':
+            return 1
+        if str(smt_val) == 'on':
+            return self.max_smt_value
+        return int(smt_val)
+
+    def _cpu_online_write(self, cpu_id, online):
+        """
+        Online or offline a single CPU through its sysfs online file.
+        """
+        path = os.path.join(SYSFS_CPU, "cpu%d" % cpu_id, "online")
+        if not os.path.exists(path):
+            return
+        with open(path, "w") as online_fd:
+            online_fd.write("1" if online else "0")
+
+    def _sysfs_set_state(self, smt_threads, cores_on):
+        """
+        Fallback for systems without ppc64_cpu: lay out the requested
+        SMT mode on the first cores_on cores through the per-CPU online
+        files. Threads of a core are numbered consecutively on Power.
+        """
+        for core in range(self.total_cores):
+            for thread in range(self.max_smt_value):
+                cpu_id = core * self.max_smt_value + thread
+                self._cpu_online_write(
+                    cpu_id, core < cores_on and thread < smt_threads)
+
+    def _sysfs_state(self, online=None):
+        """
+        Current (threads per core, online cores) derived from the sysfs
+        online CPU list.
+        """
+        if online is None:
+            online = self._sysfs_online_cpus()
+        threads = {}
+        for cpu_id in online:
+            core = cpu_id // self.max_smt_value
+            threads[core] = threads.get(core, 0) + 1
+        return max(threads.values(), default=0), len(threads)
+
+    def _sysfs_set_smt(self, smt_val):
+        """
+        Change SMT mode through /sys/devices/system/cpu/smt/control,
+        falling back to the per-CPU online files.
+        """
+        control = os.path.join(SYSFS_CPU, "smt", "control")
+        try:
+            with open(control, "w") as control_fd:
+                control_fd.write(str(smt_val))
+            return
+        except OSError:
+            pass
+        self._sysfs_set_state(self._smt_threads(smt_val),
+                              self._sysfs_state()[1])
+
+    def _sysfs_set_cores(self, cores_on):
+        """
+        Change the number of online cores through the per-CPU online files.
+        """
+        self._sysfs_set_state(self._sysfs_state()[0], cores_on)
+
+    def _start_workload(self):
+        """
+        Start the background spin workload used to measure the throughput
+        dip during transitions.
+        """
+        stop_event = multiprocessing.Event()
+        counters = [multiprocessing.Value('Q', 0, lock=False)
+                    for _ in range(self.workload_threads)]
+        workers = [multiprocessing.Process(target=_spin_worker,
+                                           args=(counter, stop_event),
+                                           daemon=True)
+                   for counter in counters]
+        for worker in workers:
+            worker.start()
+        self.workload = (stop_event, counters, workers)
+
+    def _stop_workload(self):
+        if not self.workload:
+            return
+        stop_event, _, workers = self.workload
+        stop_event.set()
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workload = None
+
+    def _workload_ops(self):
+        return sum(counter.value for counter in self.workload[1])
+
+    def _timed_transition(self, smt=None, cores=None, record_it=True):
+        """
+        Run one SMT or core transition and time it.
+
+        sysfs online CPUs are polled from a separate thread while the
+        change is in progress, so the record holds the command latency,
+        the time until sysfs reached the expected CPU count and the
+        per-CPU online/offline progress. With the background workload
+        running, workload throughput before and during the transition is
+        sampled as well.
+
+        :param record_it: add the record to the transition matrix
+        :return: (exit status, transition record)
+        """
+        from_cpus = self._sysfs_online_cpus()
+        from_smt, cores_on = self._sysfs_state(from_cpus)
+        if cores is not None:
+            cores_on = int(cores)
+        to_smt = self._smt_threads(smt) if smt is not None else from_smt
+        expected = to_smt * cores_on
+
+        progress = []
+        done = threading.Event()
+        sampled = threading.Event()
+        rates = []
+
+        def poll_sysfs(start):
+            last = from_cpus
+            deadline = start + self.settle_timeout
+            while time.monotonic() < deadline:
+                online = self._sysfs_online_cpus()
+                if online != last:
+                    progress.append((time.monotonic() - start,
+                                     sorted(online - last),
+                                     sorted(last - online)))
+                    last = online
+                if len(online) == expected and done.is_set():
+                    return
+                time.sleep(self.poll_interval)
+
+        def sample_workload(start, window):
+            prev_ops, prev_time = self._workload_ops(), time.monotonic()
+            while not sampled.wait(window):
+                now_ops, now = self._workload_ops(), time.monotonic()
+                rates.append((now - start, (now_ops - prev_ops) /
+                              (now - prev_time)))
+                prev_ops, prev_time = now_ops, now
+
+        baseline_rate = None
+        if self.workload:
+            before = self._workload_ops()
+            time.sleep(self.workload_window)
+            baseline_rate = (self._workload_ops() - before) / \
+                self.workload_window
+
+        start = time.monotonic()
+        poller = threading.Thread(target=poll_sysfs, args=(start,))
+        poller.start()
+        sampler = None
+        if self.workload:
+            sampler = threading.Thread(
+                target=sample_workload,
+                args=(start, self.workload_window / 10))
+            sampler.start()
+
+        if self.transition_backend == 'ppc64_cpu':
+            if smt is not None:
+                cmd = "%s=%s" % (self.smt_str, smt)
+            else:
+                cmd = "ppc64_cpu --cores-on=%s" % cores
+            exit_status = process.run(cmd, shell=True,
+                                      ignore_status=True).exit_status
+        else:
+            exit_status = 0
+            try:
+                if smt is not None:
+                    self._sysfs_set_smt(smt)
+                else:
+                    self._sysfs_set_cores(cores)
+            except OSError as details:
+                self.log.error("sysfs transition failed: %s", details)
+                exit_status = 1
+        cmd_latency = time.monotonic() - start
+        done.set()
+        poller.join()
+        if sampler:
+            # Keep sampling for one more window to catch the recovery
+            time.sleep(self.workload_window)
+            sampled.set()
+            sampler.join()
+
+        settle = progress[-1][0] if progress else 0.0
+        if len(self._sysfs_online_cpus()) != expected:
+            settle = None
+        record = {'from_smt': from_smt, 'to_smt': to_smt,
+                  'cores_on': cores_on,
+                  'from_cpus': len(from_cpus), 'expected_cpus': expected,
+                  'exit_status': exit_status,
+                  'cmd_latency': cmd_latency,
+                  'settle_latency': settle,
+                  'progress': [{'time': round(stamp, 6), 'online': up,
+                                'offline': down}
+                               for stamp, up, down in progress]}
+        if baseline_rate:
+            during = [rate for _, rate in rates] or [baseline_rate]
+            record['workload_baseline'] = baseline_rate
+            record['workload_min'] = min(during)
+            record['workload_dip'] = 1 - min(during) / baseline_rate
+        if record_it:
+            self.transitions.append(record)
+        self.log.info("Transition SMT %s -> %s, cores %s: cmd %.3f s, "
+                      "settle %s%s", from_smt, to_smt, cores_on,
+                      cmd_latency,
+                      "%.3f s" % settle if settle is not None else "timeout",
+                      ", workload dip %.1f%%" % (100 * record['workload_dip'])
+                      if 'workload_dip' in record else "")
+        return exit_status, record
+
+    def _report_transitions(self, name):
+        """
+        Log the transition latency matrix (from-SMT x to-SMT x cores-on)
+        and save the raw records.
+        """
+        if not self.transitions:
+            return
+        matrix = {}
+        for record in self.transitions:
+            key = "cores=%s smt %s->%s" % (record['cores_on'],
+                                           record['from_smt'],
+                                           record['to_smt'])
+            matrix.setdefault(key, []).append(record)
+        summary = {}
+        self.log.info("%-30s %5s %10s %10s %10s %8s", "transition", "runs",
+                      "cmd_mean", "cmd_max", "settle_max", "dip_max")
+        for key, records in sorted(matrix.items()):
+            cmd = [rec['cmd_latency'] for rec in records]
+            settle = [rec['settle_latency'] for rec in records
+                      if rec['settle_latency'] is not None]
+            dips = [rec['workload_dip'] for rec in records
+                    if 'workload_dip' in rec]
+            summary[key] = {
+                'runs': len(records),
+                'cmd_mean': statistics.mean(cmd),
+                'cmd_stdev': statistics.stdev(cmd) if len(cmd) > 1 else 0.0,
+                'cmd_max': max(cmd),
+                'settle_max': max(settle) if settle else None,
+                'settle_timeouts': len(records) - len(settle),
+                'workload_dip_max': max(dips) if dips else None}
+            self.log.info("%-30s %5d %10.3f %10.3f %10s %8s", key,
+                          len(records), summary[key]['cmd_mean'],
+                          summary[key]['cmd_max'],
+                          "%.3f" % max(settle) if settle else "timeout",
+                          "%.1f%%" % (100 * max(dips)) if dips else "-")
+        with open(os.path.join(self.logdir, "%s_transitions.json" % name),
+                  "w") as result_fd:
+            json.dump({'summary': summary, 'records': self.transitions},
+                      result_fd, indent=2)
+
     def test_build_upstream(self):
         """
         For upstream target download and compile source code
@@ -217,6 +585,7 @@ class PPC64Test(Test):
         Note: SMT, core, subcore, and threads_per_core tests are now covered
         by the comprehensive test methods (test_all_smt_operations, etc.).
         """
+        self._require_ppc64_cpu()
         for i in range(2, self.max_smt_value):
             self.smt_values[i] = str(i)
         for self.key, self.value in self.smt_values.items():
@@ -286,9 +655,11 @@ class PPC64Test(Test):
         Tests smt on/off in a loop
         """
         for _ in range(1, self.loop):
-            if process.system("%s=off && %s=on" % (self.smt_str, self.smt_str),
-                              shell=True):
-                self.fail('SMT loop test failed')
+            for smt_val in ('off', 'on'):
+                if self._timed_transition(smt=smt_val)[0]:
+                    self._report_transitions('smt_loop')
+                    self.fail('SMT loop test failed')
+        self._report_transitions('smt_loop')
 
     def test_single_core_smt(self):
         """
@@ -306,6 +677,7 @@ class PPC64Test(Test):
            If not fail the test case
 
         """
+        self._require_ppc64_cpu()
         # online all cores
         process.system("ppc64_cpu --cores-on=all", shell=True)
         # Set highest SMT level
@@ -396,6 +768,27 @@ class PPC64Test(Test):
 
         return result
 
+    def parse_sysfs_info(self):
+        """
+        Same layout as parse_ppc64_cpu_info(), built from the sysfs online
+        CPU list for the sysfs backend.
+        """
+        online = self._sysfs_online_cpus()
+        threads = {core: 0 for core in range(self.total_cores)}
+        for cpu_id in online:
+            core = cpu_id // self.max_smt_value
+            threads[core] = threads.get(core, 0) + 1
+        online_cores = sorted(core for core, count in threads.items()
+                              if count)
+        counts = sorted(set(threads[core] for core in online_cores))
+        return {'total_cores': len(threads),
+                'online_cores': online_cores,
+                'offline_cores': sorted(core for core, count in
+                                        threads.items() if not count),
+                'actual_threads_per_core': threads,
+                'smt_mode': counts[0] if len(counts) == 1 else None,
+                'inconsistent': len(counts) > 1}
+
     def verify_system_state(self, expected_smt=None, expected_cores_on=None):
         """
         Comprehensive system state verification.
@@ -405,18 +798,23 @@ class PPC64Test(Test):
         self.log.info("SYSTEM STATE VERIFICATION")
         self.log.info("=" * 60)
 
-        # Get ppc64_cpu info
-        info = self.parse_ppc64_cpu_info()
+        if self.transition_backend == 'sysfs':
+            info = self.parse_sysfs_info()
+            current_smt = self.get_current_smt()
+            cores_on = len(info['online_cores'])
+        else:
+            # Get ppc64_cpu info
+            info = self.parse_ppc64_cpu_info()
 
-        # Get SMT mode
-        smt_output = process.system_output(
-            "ppc64_cpu --smt", shell=True).decode()
-        current_smt = smt_output.strip().split("=")[-1].split()[-1]
+            # Get SMT mode
+            smt_output = process.system_output(
+                "ppc64_cpu --smt", shell=True).decode()
+            current_smt = smt_output.strip().split("=")[-1].split()[-1]
 
-        # Get cores on
-        cores_output = process.system_output(
-            "ppc64_cpu --cores-on", shell=True).decode()
-        cores_on = int(cores_output.strip().split("=")[-1])
+            # Get cores on
+            cores_output = process.system_output(
+                "ppc64_cpu --cores-on", shell=True).decode()
+            cores_on = int(cores_output.strip().split("=")[-1])
 
         # Get online CPUs using avocado's cpu utility
         online_cpus = cpu.online_count()
@@ -474,6 +872,9 @@ class PPC64Test(Test):
         """
         Get current cores information.
         """
+        if self.transition_backend == 'sysfs':
+            return {'cores_on': self._sysfs_state()[1],
+                    'cores_present': self.total_cores}
         cores_output = process.system_output(
             "ppc64_cpu --cores-on", shell=True).decode()
         cores_on = int(cores_output.strip().split("=")[-1])
@@ -494,6 +895,7 @@ class PPC64Test(Test):
         Verifies that SMT changes work correctly with different
         core configurations.
         """
+        self._require_ppc64_cpu()
         self.log.info("Testing SMT operations with core hotplug")
 
         # Get total cores
@@ -532,6 +934,7 @@ class PPC64Test(Test):
         Stress test with random SMT and core operations.
         Performs random operations and validates system state.
         """
+        self._require_ppc64_cpu()
         iterations = int(self.params.get('stress_iterations', default=20))
         self.log.info(
             "Running parallel SMT/core stress test with %d iterations",
@@ -596,6 +999,7 @@ class PPC64Test(Test):
         """
         Test core operations using range syntax (cores-on=1,2,3,4).
         """
+        self._require_ppc64_cpu()
         self.log.info("Testing core range operations")
 
         cores_info = self.get_cores_info()
@@ -636,14 +1040,14 @@ class PPC64Test(Test):
         for smt_val in self.all_smt_values:
             self.log.info("Setting SMT=%s", smt_val)
 
-            cmd = "%s=%s" % (self.smt_str, smt_val)
-            result = process.run(cmd, shell=True, ignore_status=True)
+            exit_status, record = self._timed_transition(smt=smt_val)
 
-            if result.exit_status != 0:
+            if exit_status != 0:
                 self.failures.append("Failed to set SMT=%s" % smt_val)
                 continue
-
-            time.sleep(1)
+            if record['settle_latency'] is None:
+                self.failures.append(
+                    "SMT=%s did not settle in sysfs" % smt_val)
 
             # Verify the state
             expected_smt = smt_val if smt_val != 'on' else str(
@@ -657,6 +1061,7 @@ class PPC64Test(Test):
 
             self.log.info("SMT=%s operation completed successfully\n", smt_val)
 
+        self._report_transitions('all_smt_operations')
         if self.failures:
             self.fail("All SMT operations test failed: %s" % self.failures)
 
@@ -671,7 +1076,7 @@ class PPC64Test(Test):
         self.log.info("=== Testing Dynamic Core Operations ===")
 
         # Ensure all cores are online first
-        process.system("ppc64_cpu --cores-on=all", shell=True)
+        self._all_cores_on()
         time.sleep(1)
 
         # Generate test scenarios dynamically
@@ -699,14 +1104,14 @@ class PPC64Test(Test):
         for cores_count, description in unique_scenarios:
             self.log.info("Test: %s (cores=%s)", description, cores_count)
 
-            cmd = "ppc64_cpu --cores-on=%s" % cores_count
-            result = process.run(cmd, shell=True, ignore_status=True)
+            exit_status, record = self._timed_transition(cores=cores_count)
 
-            if result.exit_status != 0:
+            if exit_status != 0:
                 self.failures.append("Failed to set cores-on=%s" % cores_count)
                 continue
-
-            time.sleep(1)
+            if record['settle_latency'] is None:
+                self.failures.append(
+                    "cores-on=%s did not settle in sysfs" % cores_count)
 
             if not self.verify_system_state(expected_cores_on=cores_count):
                 self.failures.append(
@@ -715,9 +1120,10 @@ class PPC64Test(Test):
             self.log.info("Core operation completed: %s\n", description)
 
         # Restore all cores
-        process.system("ppc64_cpu --cores-on=all", shell=True)
+        self._all_cores_on()
         time.sleep(1)
 
+        self._report_transitions('dynamic_core_operations')
         if self.failures:
             self.fail("Dynamic core operations test failed: %s" %
                       self.failures)
@@ -727,6 +1133,7 @@ class PPC64Test(Test):
         Test interaction between SMT and core operations.
         Validates that SMT changes don't affect core count and vice versa.
         """
+        self._require_ppc64_cpu()
         self.log.info("=== Testing SMT-Core Interaction ===")
 
         # Ensure clean start
@@ -801,9 +1208,7 @@ class PPC64Test(Test):
                 self.log.info("  -> Setting SMT=%s", smt_val)
 
                 cores_before = self.get_cores_info()
-                process.system("ppc64_cpu --smt=%s" % smt_val,
-                               shell=True, ignore_status=True)
-                time.sleep(0.3)
+                self._timed_transition(smt=smt_val)
 
                 cores_after = self.get_cores_info()
                 if cores_before['cores_on'] != cores_after['cores_on']:
@@ -816,9 +1221,7 @@ class PPC64Test(Test):
                 self.log.info("  -> Setting cores-on=%s", cores_count)
 
                 smt_before = self.get_current_smt()
-                process.system("ppc64_cpu --cores-on=%s" % cores_count,
-                               shell=True, ignore_status=True)
-                time.sleep(0.3)
+                self._timed_transition(cores=cores_count)
 
                 smt_after = self.get_current_smt()
                 if smt_before != smt_after:
@@ -834,6 +1237,7 @@ class PPC64Test(Test):
                         (iteration + 1))
 
         self.log.info("Random stress test completed")
+        self._report_transitions('random_stress')
 
         if self.failures:
             self.fail("Random stress test failed: %s" % self.failures)
@@ -842,6 +1246,9 @@ class PPC64Test(Test):
         """
         Get current SMT value.
         """
+        if self.transition_backend == 'sysfs':
+            threads = self._sysfs_state()[0]
+            return 'off' if threads == 1 else str(threads)
         try:
             current_smt_output = process.system_output(
                 self.smt_str, shell=True).decode()
@@ -856,6 +1263,7 @@ class PPC64Test(Test):
         Progressive test: Start with minimal cores, perform all SMT operations,
         then progressively bring cores online and test SMT at each step.
         """
+        self._require_ppc64_cpu()
         self.log.info(
             "=== Testing Progressive Core Online with SMT Operations ===")
 
@@ -963,6 +1371,7 @@ class PPC64Test(Test):
         SMT operations. Validates that offline cores remain offline
         after SMT changes.
         """
+        self._require_ppc64_cpu()
         self.log.info(
             "=== Testing Specific Cores Offline with SMT Operations ===")
 
@@ -1055,13 +1464,71 @@ class PPC64Test(Test):
         if self.failures:
             self.fail("Specific cores offline test failed: %s" % self.failures)
 
+    def test_smt_transition_matrix(self):
+        """
+        Sweep every from-SMT -> to-SMT transition for a set of core counts
+        and build a transition latency matrix, optionally while a
+        background workload runs to measure its throughput dip.
+        """
+        self._reset_system_state()
+        cores_list = self.transition_cores
+        if not cores_list:
+            cores_list = sorted({1, max(1, self.total_cores // 2),
+                                 self.total_cores})
+        if self.run_workload:
+            self._start_workload()
+        try:
+            for cores_on in cores_list:
+                self._timed_transition(smt='on', record_it=False)
+                if self._timed_transition(cores=cores_on,
+                                          record_it=False)[0]:
+                    self.failures.append("Failed to set cores-on=%s" %
+                                         cores_on)
+                    continue
+                for from_smt in self.all_smt_values:
+                    for to_smt in self.all_smt_values:
+                        if self._smt_threads(from_smt) == \
+                                self._smt_threads(to_smt):
+                            continue
+                        for _ in range(self.transition_repeat):
+                            self._timed_transition(smt=from_smt,
+                                                   record_it=False)
+                            exit_status, record = \
+                                self._timed_transition(smt=to_smt)
+                            if exit_status:
+                                self.failures.append(
+                                    "SMT %s -> %s failed with %s cores" %
+                                    (from_smt, to_smt, cores_on))
+                            elif record['settle_latency'] is None:
+                                self.failures.append(
+                                    "SMT %s -> %s did not settle with %s "
+                                    "cores" % (from_smt, to_smt, cores_on))
+        finally:
+            self._stop_workload()
+            self._reset_system_state()
+        self._report_transitions('transition_matrix')
+        if self.failures:
+            self.fail("SMT transition sweep failed: %s" % self.failures)
+
     def tearDown(self):
         """
         Restores system to original state: all cores online
         and original SMT value. This ensures cleanup even if
         tests fail before their own restoration code.
         """
-        if hasattr(self, 'smt_str'):
+        if getattr(self, 'workload', None):
+            self._stop_workload()
+        if hasattr(self, 'sysfs_online'):
+            # Restore the CPUs that were online before the test
+            for cpu_id in _parse_cpu_list(genio.read_file(
+                    os.path.join(SYSFS_CPU, "present"))):
+                try:
+                    self._cpu_online_write(cpu_id,
+                                           cpu_id in self.sysfs_online)
+                except OSError as details:
+                    self.log.warning("Cannot restore cpu%d: %s", cpu_id,
+                                     details)
+        elif hasattr(self, 'curr_smt'):
             # Restore all cores online (safe default state)
             process.system("ppc64_cpu --cores-on=all",
                            shell=True, ignore_status=True)
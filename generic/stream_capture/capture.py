@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2025 IBM
+
+"""
+Streaming output capture for long running benchmark commands.
+
+StreamCapture runs a command and tees its stdout and stderr, unchanged
+and line by line, to a file on disk (gzip compressed when the path ends
+with ".gz") while every line is handed to the registered parsers as it
+arrives. Only the first head_lines and the last tail_lines lines are kept
+in memory, and the parsers only get the first max_line bytes of a line,
+so memory use stays bounded no matter how much the command prints. Lines
+longer than max_line are written to the file as they arrive and are the
+only ones that can interleave with the other stream.
+
+Tests outside generic/ add generic/ to sys.path to import it::
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), '..', 'generic'))
+    from stream_capture.capture import StreamCapture
+
+    capture = StreamCapture(os.path.join(self.logdir, 'output.gz'))
+    capture.add_parser(lambda line, stream: ...)
+    result = capture.run('make check', cwd=self.sourcedir)
+    self.log.info(result.excerpt())
+"""
+
+import collections
+import gzip
+import os
+import signal
+import subprocess
+import threading
+import time
+
+__all__ = ['StreamCapture', 'CaptureResult']
+
+
+class CaptureResult(object):
+
+    """
+    Outcome of a captured command.
+
+    :ivar exit_status: command exit status
+    :ivar duration: wall time in seconds
+    :ivar path: file holding the full output
+    :ivar head: first lines of output, as (stream, line) tuples
+    :ivar tail: last lines of output, as (stream, line) tuples
+    :ivar lines: total number of lines seen
+    :ivar bytes: total number of bytes seen
+    :ivar timed_out: True if the command was killed on timeout
+    """
+
+    def __init__(self, exit_status, duration, path, head, tail, lines,
+                 size, timed_out):
+        self.exit_status = exit_status
+        self.duration = duration
+        self.path = path
+        self.head = head
+        self.tail = tail
+        self.lines = lines
+        self.bytes = size
+        self.timed_out = timed_out
+
+    def excerpt(self, stream=None):
+        """
+        Head and tail of the output, with a marker for the skipped part.
+        """
+        head = [line for name, line in self.head
+                if stream is None or name == stream]
+        tail = [line for name, line in self.tail
+                if stream is None or name == stream]
+        skipped = self.lines - len(self.head) - len(self.tail)
+        if skipped > 0:
+            head.append("... %d lines skipped, see %s ..." %
+                        (skipped, self.path))
+        elif skipped < 0:
+            # head and tail overlap on short outputs
+            tail = tail[-skipped:]
+        return "\n".join(head + tail)
+
+
+class StreamCapture(object):
+
+    """
+    Run a command, stream its output to disk and to line parsers.
+
+    :param path: output file, gzip compressed when it ends with ".gz"
+    :param head_lines: number of leading lines kept in memory
+    :param tail_lines: number of trailing lines kept in memory
+    :param max_line: longest line, in bytes, kept or handed to parsers
+    :param append: append to path instead of truncating it
+    """
+
+    def __init__(self, path, head_lines=100, tail_lines=100, max_line=4096,
+                 append=False):
+        self.path = path
+        self.head_lines = head_lines
+        self.tail_lines = tail_lines
+        self.max_line = max_line
+        self.append = append
+        self.parsers = []
+        self._lock = threading.Lock()
+
+    def add_parser(self, parser):
+        """
+        Register a callable called as parser(line, stream) for every
+        decoded output line, stream being "stdout" or "stderr". Calls are
+        serialized, parsers do not need to be thread safe.
+        """
+        self.parsers.append(parser)
+
+    def _open(self):
+        mode = 'ab' if self.append else 'wb'
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, compresslevel=6)
+        return open(self.path, mode)
+
+    def _reader(self, pipe, stream, out_fd, state):
+        partial = b''
+        # the beginning of the current line went to the parsers already,
+        # its remaining bytes only go to the file
+        overflow = False
+        for chunk in iter(lambda: pipe.read1(65536), b''):
+            size = len(chunk)
+            if overflow:
+                end = chunk.find(b'\n')
+                if end < 0:
+                    self._feed(chunk, [], stream, out_fd, state, size)
+                    continue
+                overflow = False
+                self._feed(chunk[:end + 1], [], stream, out_fd, state, size)
+                chunk, size = chunk[end + 1:], 0
+            data = partial + chunk
+            lines = data.split(b'\n')
+            partial = lines.pop()
+            raw = data[:len(data) - len(partial)]
+            if len(partial) > self.max_line:
+                # an endless line, parsers only get its beginning
+                lines.append(partial)
+                raw, partial = data, b''
+                overflow = True
+            self._feed(raw, lines, stream, out_fd, state, size)
+        if partial:
+            self._feed(partial, [partial], stream, out_fd, state, 0)
+
+    def _feed(self, raw, lines, stream, out_fd, state, size):
+        # complete lines are written in one go, so that stdout and stderr
+        # interleave line by line and never inside a line
+        with self._lock:
+            if raw:
+                out_fd.write(raw)
+            state['bytes'] += size
+            for line in lines:
+                line = line[:self.max_line].decode('utf-8', 'replace')
+                line = line.rstrip('\r')
+                state['lines'] += 1
+                if len(state['head']) < self.head_lines:
+                    state['head'].append((stream, line))
+                state['tail'].append((stream, line))
+                for parser in self.parsers:
+                    parser(line, stream)
+
+    def run(self, cmd, shell=True, cwd=None, env=None, timeout=None):
+        """
+        Run cmd until it exits, or until timeout seconds have passed.
+
+        :return: CaptureResult
+        """
+        state = {'head': [], 'tail': collections.deque(
+            maxlen=self.tail_lines), 'lines': 0, 'bytes': 0}
+        timed_out = False
+        start = time.time()
+        with self._open() as out_fd:
+            proc = subprocess.Popen(cmd, shell=shell, cwd=cwd, env=env,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    start_new_session=True)
+            readers = [threading.Thread(target=self._reader,
+                                        args=(proc.stdout, 'stdout',
+                                              out_fd, state)),
+                       threading.Thread(target=self._reader,
+                                        args=(proc.stderr, 'stderr',
+                                              out_fd, state))]
+            for reader in readers:
+                reader.start()
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+            for reader in readers:
+                reader.join()
+            proc.stdout.close()
+            proc.stderr.close()
+        return CaptureResult(proc.returncode, time.time() - start, self.path,
+                             state['head'], list(state['tail']),
+                             state['lines'], state['bytes'], timed_out)
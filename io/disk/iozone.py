@@ -22,6 +22,7 @@
 
 import os
 import re
+import sys
 import json
 import logging
 
@@ -38,6 +39,9 @@ from avocado.utils import data_structures
 from avocado.utils import astring
 from avocado.utils.partition import PartitionError
 from avocado.utils.software_manager.manager import SoftwareManager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'generic'))
+from stream_capture.capture import StreamCapture  # noqa: E402
 
 
 _LABELS = ['file_size', 'record_size', 'write', 'rewrite', 'read', 'reread',
@@ -545,7 +549,7 @@ class IOZone(Test):
             labels = ('write', 'rewrite', 'read', 'reread', 'randread',
                       'randwrite', 'bkwdread', 'recordrewrite',
                       'strideread', 'fwrite', 'frewrite', 'fread', 'freread')
-            for line in self.results.splitlines():
+            for line in self.results:
                 fields = line.split()
                 if len(fields) != 15:
                     continue
@@ -570,7 +574,7 @@ class IOZone(Test):
             section = None
             w_count = 0
 
-            for line in self.results.splitlines():
+            for line in self.results:
                 line = line.strip()
 
                 # Check for the beginning of a new result section
@@ -633,17 +637,21 @@ class IOZone(Test):
             args = '-a'
 
         cmd = os.path.join(self.sourcedir, 'src', 'current', 'iozone')
-        self.results = process.system_output(
-            '%s %s' % (cmd, args)).decode('utf-8')
         self.auto_mode = ("-a" in args)
         results_path = os.path.join(self.outputdir,
                                     'raw_output')
         analysisdir = os.path.join(self.outputdir,
                                    'analysis')
-        with open(results_path, 'w') as r_file:
-            r_file.write(self.results)
-
-        self.generate_keyval()
+        # Stream the output to raw_output instead of holding the whole
+        # sweep in memory, the analyzers below read that file
+        result = StreamCapture(results_path).run('%s %s' % (cmd, args))
+        if result.exit_status:
+            self.log.error("IOZone output:\n%s", result.excerpt())
+            self.fail("IOZone exited with status %s" % result.exit_status)
+
+        with open(results_path) as r_file:
+            self.results = r_file
+            self.generate_keyval()
         if self.auto_mode:
             if previous_results:
                 analysis = IOzoneAnalyzer(self.log,
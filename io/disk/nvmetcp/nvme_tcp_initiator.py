@@ -23,8 +23,13 @@ multipath configurations and ensures persistence across reboots.
 """
 
 import os
+import sys
+import glob
 import json
+import shutil
+import subprocess
 import time
+import concurrent.futures
 from avocado import Test
 from avocado.utils import process, linux_modules, genio, distro, service
 from avocado.utils.software_manager.manager import SoftwareManager
@@ -34,6 +39,10 @@ from avocado.utils.process import CmdError
 from avocado.utils.network.hosts import LocalHost
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.exceptions import NWException
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'nvmf'))
+from nvmf_connect.connect import (  # noqa: E402
+    LoopbackTarget, ParallelConnector, latency_summary)
 
 
 class NVMeTCPInitiator(Test):
@@ -55,6 +64,9 @@ class NVMeTCPInitiator(Test):
     :param target_ips: Space-separated list of target IP addresses
     :param subsystem_nqn: Target subsystem NQN
     :param target_port: Target port (default: 4420)
+    :param loopback_target: Create a local nvmet TCP target on loopback
+    :param nr_io_queues: I/O queues requested per controller on connect
+    :param max_workers: Targets discovered and connected concurrently
     """
 
     def setUp(self):
@@ -77,6 +89,21 @@ class NVMeTCPInitiator(Test):
         self.target_ips = self.params.get('target_ips', default='')
         self.subsystem_nqn = self.params.get('subsystem_nqn', default=None)
         self.target_port = self.params.get('target_port', default=4420)
+        self.nr_io_queues = self.params.get('nr_io_queues', default=None)
+
+        self.loopback_target = self.params.get(
+            'loopback_target', default=False)
+        self.loopback = None
+        self.max_workers = int(self.params.get('max_workers', default=8))
+        self.visible_timeout = int(
+            self.params.get('visible_timeout', default=60))
+        self.timings = {}
+        if self.loopback_target:
+            # one nvmet port per loopback address, one path each
+            self.primary_ip = self.primary_ip or '127.0.0.1'
+            self.target_ips = self.target_ips or '127.0.0.1 127.0.0.2'
+            self.subsystem_nqn = (
+                self.subsystem_nqn or 'nqn.2026-01.io.avocado:loopback')
 
         if not self.primary_ip:
             self.cancel("primary_ip parameter is required")
@@ -88,6 +115,8 @@ class NVMeTCPInitiator(Test):
         self.target_ips = self.target_ips.split()
         self.network_mode = (
             "multi_path" if self.secondary_ip else "single_path")
+        if self.loopback_target and len(self.target_ips) > 1:
+            self.network_mode = "multi_path"
         self.connected_controllers = []
         self.namespaces = []
         self.multipath_enabled = False
@@ -564,8 +593,29 @@ class NVMeTCPInitiator(Test):
         """Discover NVMe/TCP targets using nvme discover command."""
         self.log.info("Discovering NVMe/TCP targets...")
 
-        for target_ip in self.target_ips:
-            self._discover_single_target(target_ip)
+        self.run_concurrently("discover", self._discover_single_target)
+
+    def run_concurrently(self, phase, func):
+        """
+        Run func for every target IP from a bounded worker pool.
+
+        The wall time of each call is recorded in self.timings[phase].
+        Failures (self.fail) raised in a worker are raised here.
+
+        :param phase: Name the timings are recorded under
+        :param func: Callable taking a target IP
+        """
+        def timed(target_ip):
+            start = time.monotonic()
+            func(target_ip)
+            return target_ip, time.monotonic() - start
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            timings = dict(executor.map(timed, self.target_ips))
+        self.timings[phase] = timings
+        self.log.info("%s latency per target (s): %s", phase,
+                      {ip: round(sec, 3) for ip, sec in timings.items()})
 
     def _connect_to_single_target(self, target_ip):
         """
@@ -575,6 +625,8 @@ class NVMeTCPInitiator(Test):
         """
         cmd = "nvme connect -t tcp -n %s -a %s -s %d" % (
             self.subsystem_nqn, target_ip, self.target_port)
+        if self.nr_io_queues:
+            cmd += " -i %d" % int(self.nr_io_queues)
         try:
             output = process.system_output(
                 cmd, shell=True, sudo=True).decode()
@@ -605,10 +657,23 @@ class NVMeTCPInitiator(Test):
             self.connected_controllers = existing_controllers
             return
 
-        for target_ip in self.target_ips:
-            self._connect_to_single_target(target_ip)
-
-        time.sleep(5)
+        start = time.monotonic()
+        self.run_concurrently("connect", self._connect_to_single_target)
+
+        # wait for the namespaces instead of a fixed delay
+        deadline = start + self.visible_timeout
+        while time.monotonic() < deadline:
+            subsys = ParallelConnector.find_subsystem(self.subsystem_nqn)
+            if subsys and ParallelConnector.subsystem_namespaces(subsys):
+                self.timings["namespace_visible"] = \
+                    time.monotonic() - start
+                self.log.info("Namespaces visible %.3f s after connect",
+                              self.timings["namespace_visible"])
+                break
+            time.sleep(0.1)
+        else:
+            self.log.warning("No namespace visible %d s after connect",
+                             self.visible_timeout)
 
         self.connected_controllers = self.get_connected_controllers()
         if not self.connected_controllers:
@@ -1083,12 +1148,314 @@ class NVMeTCPInitiator(Test):
         report = self.generate_status_report()
         self.log.info("\n%s", report)
 
+    def setup_loopback_target(self, nqns=None):
+        """
+        Create a local nvmet TCP target.
+
+        Exposes nr_namespaces null_blk devices per subsystem, with one
+        nvmet TCP port per target IP (127.0.0.1, 127.0.0.2, ...) so that
+        each target IP is a separate path on the same box.
+
+        :param nqns: Subsystem NQNs, only subsystem_nqn by default
+        """
+        nqns = nqns or [self.subsystem_nqn]
+        nr_namespaces = int(self.params.get('nr_namespaces', default=2))
+        self.log.info("Creating loopback nvmet TCP target with %d "
+                      "subsystem(s) of %d namespace(s)", len(nqns),
+                      nr_namespaces)
+        self.loopback = LoopbackTarget(
+            nqns, self.target_ips, trsvcid=self.target_port,
+            nr_namespaces=nr_namespaces)
+        try:
+            self.loopback.create()
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.cancel("Failed to create the loopback target: %s" % e)
+        self.log.info("Loopback target ports: %s", self.target_ips)
+
+    def teardown_loopback_target(self):
+        """Disconnect from and remove the loopback nvmet TCP target."""
+        connector = ParallelConnector('tcp', max_workers=self.max_workers)
+        connector.disconnect([os.path.basename(subsys)
+                              for subsys in self.loopback.subsystems])
+        self.loopback.remove()
+        self.loopback = None
+        self.log.info("Loopback target removed")
+
+    def get_subsystem_topology(self):
+        """
+        Map the namespaces of the subsystem to their paths.
+
+        With native multipath the namespaces are the nvmeXnY head devices
+        and the paths the hidden nvmeXcYnZ disks behind them. Without it,
+        every controller exposes its own namespace devices, which are
+        their own single path.
+
+        :return: (subsystem sysfs dir, {namespace: [path disks]})
+        """
+        subsys = ParallelConnector.find_subsystem(self.subsystem_nqn)
+        if not subsys:
+            return None, {}
+        topology = {}
+        for name in ParallelConnector.subsystem_namespaces(subsys):
+            paths = glob.glob(os.path.join(
+                "/sys/block", name, "multipath", "nvme*"))
+            topology[name] = sorted(
+                os.path.basename(path) for path in paths) or [name]
+        return subsys, topology
+
+    @staticmethod
+    def read_disk_stat(disk):
+        """
+        Read the I/O counters of a block device from sysfs.
+
+        :return: dict of ios, sectors and ticks (ms), reads plus writes
+        """
+        fields = [int(value) for value in genio.read_file(
+            os.path.join("/sys/block", disk, "stat")).split()]
+        return {'ios': fields[0] + fields[4],
+                'sectors': fields[2] + fields[6],
+                'ticks': fields[3] + fields[7]}
+
+    def run_fio_on_namespaces(self, namespaces, runtime):
+        """
+        Run one concurrent fio job per namespace.
+
+        :return: dict of namespace -> fio read/write results
+        """
+        queue_depth = int(self.params.get('queue_depth', default=32))
+        block_size = self.params.get('block_size', default='4k')
+        rw = self.params.get('io_pattern', default='randread')
+        numjobs = int(self.params.get('numjobs', default=1))
+        cmd = ("fio --output-format=json --direct=1 --ioengine=libaio "
+               "--rw=%s --bs=%s --iodepth=%d --numjobs=%d --runtime=%d "
+               "--time_based" % (rw, block_size, queue_depth, numjobs,
+                                 runtime))
+        for namespace in namespaces:
+            cmd += " --name=%s --filename=/dev/%s" % (namespace, namespace)
+        output = process.system_output(cmd, shell=True, sudo=True).decode()
+        data = json.loads(output[output.index('{'):])
+
+        results = {}
+        for job in data.get("jobs", []):
+            entry = results.setdefault(job["jobname"], {
+                'bw_mib_s': 0.0, 'iops': 0.0, 'lat_us': [], 'p99_us': []})
+            for direction in ["read", "write"]:
+                stats = job[direction]
+                if not stats.get("io_bytes"):
+                    continue
+                entry['bw_mib_s'] += stats["bw_bytes"] / 1048576.0
+                entry['iops'] += stats["iops"]
+                entry['lat_us'].append(stats["clat_ns"]["mean"] / 1000.0)
+                entry['p99_us'].append(stats["clat_ns"].get(
+                    "percentile", {}).get("99.000000", 0) / 1000.0)
+        for entry in results.values():
+            entry['bw_mib_s'] = round(entry['bw_mib_s'], 2)
+            entry['iops'] = round(entry['iops'], 1)
+            entry['lat_us'] = round(max(entry['lat_us'] or [0]), 2)
+            entry['p99_us'] = round(max(entry['p99_us'] or [0]), 2)
+        return results
+
+    def measure_io_policy(self, subsys, topology, policy, runtime):
+        """
+        Run I/O under one native multipath I/O policy.
+
+        Per path throughput, latency and share of the I/Os are derived
+        from the block counters of the path disks around the fio run.
+
+        :return: dict with the aggregate, per namespace and per path
+                 results, or None when the kernel lacks the policy
+        """
+        if policy:
+            try:
+                genio.write_file(os.path.join(subsys, "iopolicy"), policy)
+            except IOError as e:
+                self.log.warning("I/O policy %s not supported: %s",
+                                 policy, str(e))
+                return None
+        paths = [path for disks in topology.values() for path in disks]
+        before = {path: self.read_disk_stat(path) for path in paths}
+        start = time.monotonic()
+        namespaces = self.run_fio_on_namespaces(sorted(topology), runtime)
+        elapsed = time.monotonic() - start
+        after = {path: self.read_disk_stat(path) for path in paths}
+
+        total_ios = sum(after[path]['ios'] - before[path]['ios']
+                        for path in paths) or 1
+        per_path = {}
+        for path in paths:
+            ios = after[path]['ios'] - before[path]['ios']
+            sectors = after[path]['sectors'] - before[path]['sectors']
+            ticks = after[path]['ticks'] - before[path]['ticks']
+            per_path[path] = {
+                'ios': ios,
+                'share_pct': round(100.0 * ios / total_ios, 1),
+                'bw_mib_s': round(sectors * 512 / 1048576.0 / elapsed, 2),
+                'avg_lat_ms': round(float(ticks) / ios, 3) if ios else 0}
+        aggregate = {
+            'bw_mib_s': round(sum(
+                ns['bw_mib_s'] for ns in namespaces.values()), 2),
+            'iops': round(sum(ns['iops'] for ns in namespaces.values()), 1),
+            'max_lat_us': max(
+                [ns['lat_us'] for ns in namespaces.values()] or [0]),
+            'max_p99_us': max(
+                [ns['p99_us'] for ns in namespaces.values()] or [0])}
+        return {'aggregate': aggregate, 'namespaces': namespaces,
+                'paths': per_path}
+
+    def test_data_path(self):
+        """
+        Drive concurrent I/O over every namespace and path of the
+        subsystem and compare the native multipath I/O policies.
+
+        Execution flow:
+        1. Create a loopback nvmet TCP target (loopback_target)
+        2. Discover targets and connect, with nr_io_queues per controller
+        3. Configure multipath (if applicable)
+        4. For every I/O policy, run fio on all namespaces at once and
+           sample the per path block counters
+        5. Report aggregate, per namespace and per path throughput and
+           latency, and each path's share of the I/Os
+        """
+        if not shutil.which("fio"):
+            self.cancel("fio is needed for the data path test")
+        runtime = int(self.params.get('io_runtime', default=30))
+        policies = self.params.get(
+            'iopolicies', default='numa round-robin queue-depth').split()
+
+        if self.loopback_target:
+            self.setup_loopback_target()
+        else:
+            self.validate_network_configuration()
+            self.validate_connectivity()
+        self.discover_targets()
+        self.connect_to_subsystem()
+        self.configure_multipath()
+
+        subsys, topology = self.get_subsystem_topology()
+        if not topology:
+            self.fail("No namespaces found for subsystem %s" %
+                      self.subsystem_nqn)
+        self.log.info("Subsystem topology: %s", topology)
+        if not self.multipath_enabled:
+            policies = [None]
+
+        report = {'subsystem_nqn': self.subsystem_nqn,
+                  'kernel': os.uname().release,
+                  'nr_io_queues': self.nr_io_queues,
+                  'queue_depth': self.params.get('queue_depth', default=32),
+                  'block_size': self.params.get('block_size', default='4k'),
+                  'io_pattern': self.params.get('io_pattern',
+                                                default='randread'),
+                  'topology': topology, 'policies': {}}
+        for policy in policies:
+            result = self.measure_io_policy(subsys, topology, policy,
+                                            runtime)
+            if result is None:
+                continue
+            report['policies'][policy or 'none'] = result
+            self.log.info("=" * 70)
+            self.log.info("I/O policy %s: %.1f MiB/s, %.0f IOPS, max mean "
+                          "latency %.1f us, max p99 %.1f us",
+                          policy or 'none', result['aggregate']['bw_mib_s'],
+                          result['aggregate']['iops'],
+                          result['aggregate']['max_lat_us'],
+                          result['aggregate']['max_p99_us'])
+            for path, stats in sorted(result['paths'].items()):
+                self.log.info("  %-14s %5.1f%% of I/Os, %8.1f MiB/s, "
+                              "%.3f ms avg", path, stats['share_pct'],
+                              stats['bw_mib_s'], stats['avg_lat_ms'])
+
+        with open(os.path.join(self.logdir, 'nvme_tcp_datapath.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+        if not report['policies']:
+            self.fail("No I/O policy could be measured")
+
+    def test_connect_scale(self):
+        """
+        Time discovery and connect of many subsystems from a bounded
+        worker pool, against a local nvmet loopback target.
+
+        Execution flow:
+        1. Create nr_subsystems subsystems named <subsystem_nqn>-<n> on
+           every target IP
+        2. For every worker count in connect_workers, discover all
+           target IPs and connect every subsystem over every target IP
+           concurrently, then disconnect them again
+        3. Report the discover, connect and namespace visible latency
+           distributions and the total connect time per worker count
+        """
+        if not self.loopback_target:
+            self.cancel("test_connect_scale needs loopback_target")
+        nr_subsystems = int(self.params.get('nr_subsystems', default=100))
+        workers_list = [int(value) for value in str(self.params.get(
+            'connect_workers', default=self.max_workers)).split()]
+        nqns = ["%s-%d" % (self.subsystem_nqn, index)
+                for index in range(nr_subsystems)]
+        self.setup_loopback_target(nqns)
+        connect_args = (
+            "-i %d" % int(self.nr_io_queues) if self.nr_io_queues else "")
+        targets = [{'nqn': nqn, 'traddr': target_ip,
+                    'trsvcid': self.target_port}
+                   for nqn in nqns for target_ip in self.target_ips]
+
+        report = {'nr_subsystems': nr_subsystems,
+                  'target_ips': self.target_ips, 'runs': []}
+        errors = []
+        for workers in workers_list:
+            connector = ParallelConnector(
+                'tcp', max_workers=workers,
+                visible_timeout=self.visible_timeout,
+                connect_args=connect_args)
+            discovered = connector.discover(
+                [(target_ip, self.target_port)
+                 for target_ip in self.target_ips])
+            start = time.monotonic()
+            results = connector.connect(targets)
+            total = time.monotonic() - start
+            disconnects = connector.disconnect(nqns)
+            run = {'workers': workers,
+                   'connect_total_s': round(total, 3),
+                   'connects_per_s': round(len(targets) / total, 1),
+                   'discover': latency_summary(
+                       [res['discover_s'] for res in discovered]),
+                   'connect': latency_summary(
+                       [res['connect_s'] for res in results]),
+                   'namespace_visible': latency_summary(
+                       [res['visible_s'] for res in results]),
+                   'disconnect': latency_summary(
+                       [res[1] for res in disconnects]),
+                   'targets': results}
+            report['runs'].append(run)
+            errors.extend("%s@%s: %s" % (res['nqn'], res['traddr'],
+                                         res['error'])
+                          for res in results if res['error'])
+            self.log.info("=" * 70)
+            self.log.info("%d workers: %d connects in %.2f s (%.1f/s)",
+                          workers, len(targets), total,
+                          run['connects_per_s'])
+            for phase in ['discover', 'connect', 'namespace_visible',
+                          'disconnect']:
+                self.log.info("  %-18s %s", phase, run[phase])
+
+        with open(os.path.join(self.logdir, 'nvme_tcp_connect_scale.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+        if errors:
+            for error in errors[:20]:
+                self.log.warning(error)
+            self.fail("%d connect(s) failed, see the log" % len(errors))
+
     def tearDown(self):
         """
         Cleanup method (optional).
 
         Note: We intentionally do NOT disconnect controllers in tearDown
-        to maintain the configuration for persistence testing.
+        to maintain the configuration for persistence testing. A loopback
+        target created by the test is removed with its connections.
         """
+        if self.loopback:
+            self.teardown_loopback_target()
+            return
         self.log.info(
             "Test completed. Controllers remain connected for persistence.")
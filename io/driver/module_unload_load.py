@@ -17,13 +17,88 @@
 
 import time
 import os
-from avocado.utils import process
+import json
+from concurrent.futures import ThreadPoolExecutor
+from avocado.utils import process, wait
 from avocado.utils import linux_modules, genio
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import pci
 from avocado import Test
 
 
+def module_name(path):
+    """
+    Module name of a modules.dep path, kernel/drivers/x/foo-bar.ko.xz ->
+    foo_bar
+    """
+    return os.path.basename(path).split('.ko')[0].replace('-', '_')
+
+
+class ModuleDepGraph(object):
+
+    """
+    Module dependency graph, built once from modules.dep and the holders
+    of the loaded modules in /sys/module.
+    """
+
+    def __init__(self, uname):
+        self.deps = {}
+        dep_file = "/lib/modules/%s/modules.dep" % uname
+        if os.path.exists(dep_file):
+            for line in genio.read_all_lines(dep_file):
+                name, _, deps = line.partition(':')
+                self.deps[module_name(name)] = set(
+                    module_name(dep) for dep in deps.split())
+        for mod in os.listdir('/sys/module'):
+            holders = "/sys/module/%s/holders" % mod
+            if not os.path.isdir(holders):
+                continue
+            for holder in os.listdir(holders):
+                self.deps.setdefault(holder, set()).add(mod)
+
+    def all_deps(self, mod):
+        """
+        Transitive dependencies of a module
+        """
+        seen = set()
+        todo = [mod]
+        while todo:
+            for dep in self.deps.get(todo.pop(), ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    todo.append(dep)
+        return seen
+
+    def groups(self, modules, extra=None):
+        """
+        Split modules into groups that can be handled concurrently.
+
+        Two modules end up in the same group when one depends on the
+        other, or when one is listed as a sub module of the other in
+        extra (module -> list of modules unloaded with it). Modules only
+        sharing a common dependency stay independent.
+        """
+        extra = extra or {}
+        parent = {mod: mod for mod in modules}
+
+        def find(mod):
+            while parent[mod] != mod:
+                parent[mod] = parent[parent[mod]]
+                mod = parent[mod]
+            return mod
+
+        for mod in modules:
+            related = self.all_deps(mod) | set(extra.get(mod, []))
+            for other in modules:
+                if other != mod and (other in related or
+                                     mod in self.all_deps(other)):
+                    parent[find(other)] = find(mod)
+        groups = {}
+        for mod in modules:
+            groups.setdefault(find(mod), []).append(mod)
+        return list(groups.values())
+
+
 class ModuleLoadUnload(Test):
 
     """
@@ -40,9 +115,14 @@ class ModuleLoadUnload(Test):
         self.module = self.params.get('module', default=None)
         self.iteration = self.params.get('iteration', default=1)
         self.only_io = self.params.get('only_io', default=None)
-        self.load_unload_sleep_time = 30
+        # upper bound for a module to appear/disappear and its devices to
+        # be probed, the test no longer sleeps a fixed time
+        self.settle_timeout = int(self.params.get('settle_timeout',
+                                                  default=30))
+        self.max_workers = int(self.params.get('max_workers', default=8))
         self.error_modules = []
         self.mod_list = []
+        self.latency = {}
         self.uname = linux_modules.platform.uname()[2]
         smm = SoftwareManager()
         if not smm.check_installed("pciutils") and not smm.install("pciutils"):
@@ -82,50 +162,185 @@ class ModuleLoadUnload(Test):
             continue
         return False
 
+    @staticmethod
+    def bound_devices(mdl):
+        """
+        Number of devices bound to the drivers of a module
+        """
+        drivers = "/sys/module/%s/drivers" % mdl
+        count = 0
+        if not os.path.isdir(drivers):
+            return 0
+        for driver in os.listdir(drivers):
+            path = os.path.join(drivers, driver)
+            for entry in os.listdir(path):
+                if entry != 'module' and \
+                        os.path.islink(os.path.join(path, entry)):
+                    count += 1
+        return count
+
+    @staticmethod
+    def module_state(mdl):
+        """
+        initstate of a module, None when it is not loaded
+        """
+        try:
+            return genio.read_one_line("/sys/module/%s/initstate" % mdl)
+        except (IOError, OSError):
+            return None
+
+    def wait_state(self, func):
+        """
+        Poll func until it returns True, at most settle_timeout seconds
+
+        :return: seconds waited, or None on timeout
+        """
+        start = time.monotonic()
+        if wait.wait_for(func, timeout=self.settle_timeout, step=0.02):
+            return time.monotonic() - start
+        return None
+
+    def timed_load(self, mdl, devices=0):
+        """
+        Load a module and wait for it to be live and for its devices to
+        be probed again.
+
+        :return: dict with the modprobe, live and probe latency (seconds),
+                 probe is left out when the devices did not all come back
+        """
+        record = {}
+        start = time.monotonic()
+        linux_modules.load_module(mdl)
+        record['modprobe'] = time.monotonic() - start
+        if self.wait_state(lambda: self.module_state(mdl) == 'live') is None:
+            return None
+        record['live'] = time.monotonic() - start
+        if devices:
+            if self.wait_state(
+                    lambda: self.bound_devices(mdl) >= devices) is None:
+                record['probed'] = self.bound_devices(mdl)
+                self.log.warning("%s: only %s of %s devices probed", mdl,
+                                 record['probed'], devices)
+                self.error_modules.append(mdl)
+            else:
+                record['probe'] = time.monotonic() - start
+        return record
+
+    def timed_unload(self, mdl):
+        """
+        Unload a module and wait for it to be gone from /sys/module
+
+        :return: dict with the rmmod and gone latency (seconds)
+        """
+        record = {}
+        start = time.monotonic()
+        linux_modules.unload_module(mdl)
+        record['rmmod'] = time.monotonic() - start
+        if self.wait_state(
+                lambda: not os.path.exists("/sys/module/%s" % mdl)) is None:
+            return None
+        record['gone'] = time.monotonic() - start
+        return record
+
+    def module_cycle(self, mdl):
+        """
+        Unload and load one module for the given number of iterations
+        """
+        records = self.latency.setdefault(mdl, [])
+        for _ in range(0, self.iteration):
+            sub_mod = self.get_depend_modules(mdl)
+            if sub_mod:
+                for mod in sub_mod.split(' '):
+                    if mod == 'multipath':
+                        if self.flush_mpath(mdl) is False:
+                            self.error_modules.append(mdl)
+                            break
+                    else:
+                        self.log.info("unloading sub module %s " % mod)
+                        linux_modules.unload_module(mod)
+                        if linux_modules.module_is_loaded(mod) is True:
+                            self.error_modules.append(mod)
+                            break
+            self.log.info("error_module list before unloading: %s, iteration : %s" % (self.error_modules, _))
+            devices = self.bound_devices(mdl)
+            self.log.info("unloading module %s " % mdl)
+            unload = self.timed_unload(mdl)
+            if unload is None:
+                self.log.info("failed to unload the module, iteration : %s" % _)
+                self.error_modules.append(mdl)
+                break
+            else:
+                self.log.info("successfully unload: iteration : %s" % _)
+            self.log.info("loading module : %s " % mdl)
+            self.log.info("error_module list before loading: %s,iteration : %s" % (self.error_modules, _))
+            load = self.timed_load(mdl, devices)
+            if load is None:
+                self.log.info("failed to load the module, iteration : %s" % _)
+                self.error_modules.append(mdl)
+                break
+            else:
+                self.log.info("successfully load: iteration : %s" % _)
+            records.append({'iteration': _, 'devices': devices,
+                            'unload': unload, 'load': load})
+
+    def module_group_cycle(self, group):
+        for mdl in group:
+            self.module_cycle(mdl)
+
     def module_load_unload(self, module_list):
         """
-        Unloading and loading the given module
+        Unloading and loading the given modules, modules without any
+        dependency between them are handled concurrently
         """
         for mod1 in module_list:
             if linux_modules.module_is_loaded(mod1) is False:
                 linux_modules.load_module(mod1)
-                time.sleep(self.load_unload_sleep_time)
+                if self.wait_state(
+                        lambda: self.module_state(mod1) == 'live') is None:
+                    self.log.info("module %s did not come up" % mod1)
 
+        graph = ModuleDepGraph(self.uname)
+        extra = {}
         for mdl in module_list:
-            for _ in range(0, self.iteration):
-                sub_mod = self.get_depend_modules(mdl)
-                if sub_mod:
-                    for mod in sub_mod.split(' '):
-                        if mod == 'multipath':
-                            if self.flush_mpath(mdl) is False:
-                                self.error_modules.append(mdl)
-                                break
-                        else:
-                            self.log.info("unloading sub module %s " % mod)
-                            linux_modules.unload_module(mod)
-                            if linux_modules.module_is_loaded(mod) is True:
-                                self.error_modules.append(mod)
-                                break
-                self.log.info("error_module list before unloading: %s, iteration : %s" % (self.error_modules, _))
-                self.log.info("unloading module %s " % mdl)
-                linux_modules.unload_module(mdl)
-                time.sleep(self.load_unload_sleep_time)
-                if linux_modules.module_is_loaded(mdl) is True:
-                    self.log.info("failed to unload the module, iteration : %s" % _)
-                    self.error_modules.append(mdl)
-                    break
-                else:
-                    self.log.info("successfully unload: iteration : %s" % _)
-                self.log.info("loading module : %s " % mdl)
-                self.log.info("error_module list before loading: %s,iteration : %s" % (self.error_modules, _))
-                linux_modules.load_module(mdl)
-                time.sleep(self.load_unload_sleep_time)
-                if linux_modules.module_is_loaded(mdl) is False:
-                    self.log.info("failed to load the module, iteration : %s" % _)
-                    self.error_modules.append(mdl)
-                    break
-                else:
-                    self.log.info("successfully load: iteration : %s" % _)
+            sub_mod = self.get_depend_modules(mdl)
+            if sub_mod:
+                extra[mdl] = sub_mod.split(' ')
+        # "multipath -F" flushes every map, so the modules flushing
+        # multipath must not reload concurrently: keep them in one group
+        mpath = [mdl for mdl in module_list
+                 if 'multipath' in extra.get(mdl, [])]
+        for mdl in mpath[1:]:
+            extra[mpath[0]].append(mdl)
+        groups = graph.groups(module_list, extra)
+        self.log.info("module groups run concurrently: %s" % groups)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for future in [executor.submit(self.module_group_cycle, group)
+                           for group in groups]:
+                future.result()
+
+    def report_latency(self):
+        """
+        Log and save the per module load/unload latency
+        """
+        with open(os.path.join(self.logdir, 'module_latency.json'),
+                  'w') as latency_fd:
+            json.dump(self.latency, latency_fd, indent=4)
+        self.log.info("%-24s %8s %10s %10s %10s %10s", "module", "devices",
+                      "rmmod(ms)", "gone(ms)", "load(ms)", "probe(ms)")
+        for mdl, records in sorted(self.latency.items()):
+            if not records:
+                continue
+
+            def mean(step, key):
+                values = [rec[step][key] for rec in records
+                          if key in rec[step]]
+                return "%.1f" % (1000 * sum(values) / len(values)) \
+                    if values else "-"
+
+            self.log.info("%-24s %8s %10s %10s %10s %10s", mdl,
+                          records[0]['devices'], mean('unload', 'rmmod'),
+                          mean('unload', 'gone'), mean('load', 'live'),
+                          mean('load', 'probe'))
 
     def test(self):
         """
@@ -148,6 +363,7 @@ class ModuleLoadUnload(Test):
                 self.mod_list.remove(mod)
         self.log.info("\n\n final list : %s" % self.mod_list)
         self.module_load_unload(list(set(self.mod_list)))
+        self.report_latency()
 
         if self.error_modules:
             self.fail("Failed Modules: %s" % self.error_modules)
@@ -20,11 +20,50 @@ and rescan is used to form sub-tests that test and exercise iommu code.
 """
 
 import os
+import json
+import fcntl
+import struct
+import platform
 from avocado import Test
 from avocado.utils import process
 from avocado.utils import pci, genio
 from avocado.utils.software_manager.manager import SoftwareManager
 
+DMA_MAP_BENCHMARK_FILE = "/sys/kernel/debug/dma_map_benchmark"
+# struct map_benchmark from kernel/dma/map_benchmark.h (136 bytes):
+# avg_map_100ns, map_stddev, avg_unmap_100ns, unmap_stddev, threads,
+# seconds, node, dma_bits, dma_dir, dma_trans_ns, granule, expansion
+MAP_BENCHMARK_FMT = "=4QIIiIIII76s"
+
+
+def dma_map_benchmark_ioctl():
+    """
+    DMA_MAP_BENCHMARK ioctl number, _IOWR('d', 1, struct map_benchmark)
+    """
+    size = struct.calcsize(MAP_BENCHMARK_FMT)
+    if platform.machine().startswith(('ppc', 'mips', 'sparc')):
+        # 13 bit size field and 3 bit direction with read=2 and write=4
+        return (6 << 29) | (size << 16) | (ord('d') << 8) | 1
+    return (3 << 30) | (size << 16) | (ord('d') << 8) | 1
+
+
+def run_dma_map_benchmark(threads, seconds, node, granule, dma_bits=64,
+                          dma_dir=0):
+    """
+    Run one dma_map_benchmark pass through its debugfs ioctl.
+
+    :return: dict with the average map/unmap latency and stddev in ns
+    """
+    request = struct.pack(MAP_BENCHMARK_FMT, 0, 0, 0, 0, threads, seconds,
+                          node, dma_bits, dma_dir, 0, granule, b'')
+    with open(DMA_MAP_BENCHMARK_FILE, 'rb', buffering=0) as bench:
+        result = bytearray(request)
+        fcntl.ioctl(bench, dma_map_benchmark_ioctl(), result)
+    values = struct.unpack(MAP_BENCHMARK_FMT, bytes(result))
+    return {'map_ns': values[0] * 100.0, 'map_stddev_ns': values[1] * 100.0,
+            'unmap_ns': values[2] * 100.0,
+            'unmap_stddev_ns': values[3] * 100.0}
+
 
 class IommuTest(Test):
 
@@ -304,6 +343,132 @@ class IommuTest(Test):
             self.check(def_dom, pci_addr, driver)
         self.check_dmesg()
 
+    @staticmethod
+    def bind_benchmark(pci_addr):
+        """
+        Bind an unbound device to the dma_map_benchmark driver
+        """
+        override = f"/sys/bus/pci/devices/{pci_addr}/driver_override"
+        genio.write_one_line(override, "dma_map_benchmark")
+        genio.write_one_line("/sys/bus/pci/drivers/dma_map_benchmark/bind",
+                             pci_addr)
+
+    @staticmethod
+    def unbind_benchmark(pci_addr):
+        """
+        Unbind a device from dma_map_benchmark and clear the override
+        """
+        override = f"/sys/bus/pci/devices/{pci_addr}/driver_override"
+        genio.write_one_line(
+            "/sys/bus/pci/drivers/dma_map_benchmark/unbind", pci_addr)
+        genio.write_one_line(override, "\n")
+
+    def dma_benchmark_sweep(self, domain):
+        """
+        Run the buffer size x threads x NUMA node sweep on the device
+        currently bound to dma_map_benchmark
+        """
+        results = []
+        for granule in self.bench_granules:
+            for threads in self.bench_threads:
+                for node in self.bench_nodes:
+                    try:
+                        res = run_dma_map_benchmark(
+                            threads, self.bench_seconds, node, granule,
+                            self.bench_dma_bits, self.bench_dma_dir)
+                    except OSError as details:
+                        self.log.warning("%s granule=%s threads=%s node=%s:"
+                                         " %s", domain, granule, threads,
+                                         node, details)
+                        continue
+                    # every thread maps and unmaps back to back
+                    cycle_ns = res['map_ns'] + res['unmap_ns']
+                    res['mops'] = threads * 1000.0 / cycle_ns \
+                        if cycle_ns else 0.0
+                    res['mb_s'] = res['mops'] * granule * self.page_size
+                    res.update({'domain': domain, 'granule': granule,
+                                'bytes': granule * self.page_size,
+                                'threads': threads, 'node': node})
+                    results.append(res)
+        return results
+
+    def test_dma_map_benchmark(self):
+        """
+        Measure DMA map/unmap latency and throughput in every iommu
+        domain type with the dma_map_benchmark driver, and compare them
+        """
+        if self.verify_snp_host():
+            self.cancel("IOMMU domain change is not supported on SNP hosts")
+        if not os.path.exists("/sys/kernel/debug/dma_map_benchmark") and \
+                not os.path.ismount("/sys/kernel/debug"):
+            process.run("mount -t debugfs none /sys/kernel/debug",
+                        ignore_status=True, shell=True, sudo=True)
+        # CONFIG_DMA_MAP_BENCHMARK is built in, there is no module to load
+        if not os.path.isdir("/sys/bus/pci/drivers/dma_map_benchmark") and \
+                not os.path.exists("/sys/kernel/debug/dma_map_benchmark"):
+            self.cancel("dma_map_benchmark not available, "
+                        "CONFIG_DMA_MAP_BENCHMARK is needed")
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.bench_seconds = int(self.params.get('bench_seconds', default=5))
+        self.bench_threads = [int(val) for val in str(self.params.get(
+            'bench_threads', default="1 4 16")).split()]
+        self.bench_granules = [int(val) for val in str(self.params.get(
+            'bench_granules', default="1 16 256")).split()]
+        nodes = str(self.params.get('bench_nodes', default="")).split()
+        if not nodes:
+            nodes = [node[4:] for node in os.listdir('/sys/devices/system/'
+                                                     'node')
+                     if node.startswith('node') and node[4:].isdigit()]
+        self.bench_nodes = sorted(int(node) for node in nodes)
+        self.bench_dma_bits = int(self.params.get('bench_dma_bits',
+                                                  default=64))
+        self.bench_dma_dir = int(self.params.get('bench_dma_dir', default=0))
+        domains = self.params.get('bench_domains',
+                                  default="identity DMA DMA-FQ").split()
+
+        results = []
+        for pci_addr in self.pci_devices.split(" "):
+            driver, def_dom = self.get_params(pci_addr)
+            self.log.info("PCI_ID = %s", pci_addr)
+            for domain in domains:
+                try:
+                    # unbinding the driver
+                    pci.unbind(driver, pci_addr)
+                    # Changing domain type of iommu group
+                    pci.change_domain(domain, def_dom, pci_addr)
+                    self.bind_benchmark(pci_addr)
+                except Exception as e:
+                    self.fail(f"{e}")
+                try:
+                    for res in self.dma_benchmark_sweep(domain):
+                        res['pci_addr'] = pci_addr
+                        results.append(res)
+                finally:
+                    self.unbind_benchmark(pci_addr)
+                    pci.change_domain(def_dom, def_dom, pci_addr)
+                    # binding the driver back
+                    pci.bind(driver, pci_addr)
+            # check the device for default state
+            self.check(def_dom, pci_addr, driver)
+
+        with open(os.path.join(self.logdir, 'dma_map_benchmark.json'),
+                  'w') as result_fd:
+            json.dump(results, result_fd, indent=4)
+        if not results:
+            self.fail("dma_map_benchmark did not return any result")
+        self.log.info("%-13s %8s %7s %4s | %-9s %10s %10s %10s %10s",
+                      "pci", "bytes", "threads", "node", "domain",
+                      "map(ns)", "unmap(ns)", "Mops/s", "MB/s")
+        for res in sorted(results, key=lambda res: (
+                res['pci_addr'], res['granule'], res['threads'],
+                res['node'], domains.index(res['domain']))):
+            self.log.info("%-13s %8d %7d %4d | %-9s %10.1f %10.1f %10.3f "
+                          "%10.1f", res['pci_addr'], res['bytes'],
+                          res['threads'], res['node'], res['domain'],
+                          res['map_ns'], res['unmap_ns'], res['mops'],
+                          res['mb_s'])
+        self.check_dmesg()
+
     def check_dmesg(self):
         """
         Checks for any error or failure messages in dmesg after test
@@ -24,9 +24,13 @@ simultaneously increasing the bandwidth and providing redundancy.
 
 import time
 import os
+import json
 import socket
 import fcntl
 import struct
+import subprocess
+import sys
+import threading
 import netifaces
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
@@ -39,6 +43,202 @@ from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 
 
+# rtnetlink constants, see linux/rtnetlink.h and linux/if.h
+RTMGRP_LINK = 1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+IFLA_IFNAME = 3
+IFF_LOWER_UP = 0x10000
+
+
+class LinkEventMonitor(object):
+
+    """
+    Listen to rtnetlink link notifications and let callers wait for a
+    link to go up or down instead of sleeping a fixed amount of time.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._cond = threading.Condition()
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                   socket.NETLINK_ROUTE)
+        self._sock.bind((0, RTMGRP_LINK))
+        self._sock.settimeout(0.2)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _parse(data):
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=IH", data, offset)
+            if length < 16:
+                break
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                flags = struct.unpack_from("=I", data, offset + 24)[0]
+                ifname = None
+                attr = offset + 32
+                while attr + 4 <= offset + length:
+                    attr_len, attr_type = struct.unpack_from("=HH", data,
+                                                             attr)
+                    if attr_len < 4:
+                        break
+                    if attr_type == IFLA_IFNAME:
+                        ifname = data[attr + 4:attr + attr_len].split(
+                            b"\0")[0].decode()
+                    attr += (attr_len + 3) & ~3
+                if ifname:
+                    up = msg_type == RTM_NEWLINK and bool(flags & IFF_LOWER_UP)
+                    yield ifname, up
+            offset += (length + 3) & ~3
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self._sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            stamp = time.monotonic()
+            with self._cond:
+                for ifname, up in self._parse(data):
+                    self.events.append((stamp, ifname, up))
+                self._cond.notify_all()
+
+    @staticmethod
+    def is_up(ifname):
+        """
+        Current carrier state of an interface.
+        """
+        try:
+            with open("/sys/class/net/%s/carrier" % ifname) as carrier:
+                return carrier.read().strip() == "1"
+        except OSError:
+            return False
+
+    def wait_for(self, ifname, up, timeout, since=None):
+        """
+        Wait until ifname reports the requested link state.
+
+        :param since: only consider events after this monotonic time, when
+                      None the current sysfs state is checked first
+        :return: monotonic time of the event, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        if since is None:
+            if self.is_up(ifname) == up:
+                return time.monotonic()
+            since = time.monotonic()
+        with self._cond:
+            while True:
+                for stamp, name, state in self.events:
+                    if stamp >= since and name == ifname and state == up:
+                        return stamp
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self._sock.close()
+
+
+class ProbeStream(object):
+
+    """
+    Stream of timestamped UDP probes bounced off an echo responder.
+
+    Probes carry a sequence number and are sent at a fixed rate, the
+    echoes are matched back to their send time so the loss window and
+    recovery time around a link event can be computed afterwards.
+    """
+
+    def __init__(self, src_ip, dst_ip, port, rate=1000):
+        self.dst = (dst_ip, int(port))
+        self.interval = 1.0 / float(rate)
+        self.sent = []
+        self.received = {}
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((src_ip, 0))
+        self._sock.settimeout(0.2)
+        self._running = False
+        self._threads = []
+
+    def _send(self):
+        seq = 0
+        next_send = time.monotonic()
+        while self._running:
+            now = time.monotonic()
+            if now < next_send:
+                time.sleep(min(next_send - now, 0.0005))
+                continue
+            self.sent.append(now)
+            try:
+                self._sock.sendto(struct.pack("!Q", seq), self.dst)
+            except OSError:
+                pass
+            seq += 1
+            next_send += self.interval
+
+    def _receive(self):
+        while self._running:
+            try:
+                data = self._sock.recv(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.received[struct.unpack("!Q", data[:8])[0]] = \
+                time.monotonic()
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._receive, daemon=True),
+                         threading.Thread(target=self._send, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, drain=0.5):
+        time.sleep(drain)
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._sock.close()
+
+    def analyze(self, start, end):
+        """
+        Loss around one event, for probes sent between start and end.
+
+        :return: dict with lost probe count, loss window (first to last
+                 lost probe, ms) and time to recover (event to first echo
+                 after the last loss, ms)
+        """
+        lost = [seq for seq, stamp in enumerate(self.sent)
+                if start <= stamp < end and seq not in self.received]
+        result = {'sent': len([stamp for stamp in self.sent
+                               if start <= stamp < end]),
+                  'lost': len(lost), 'loss_window_ms': 0.0,
+                  'time_to_recover_ms': 0.0}
+        if not lost:
+            return result
+        result['loss_window_ms'] = 1000 * (self.sent[lost[-1]] -
+                                           self.sent[lost[0]] +
+                                           self.interval)
+        recovered = [self.received[seq]
+                     for seq in range(lost[-1] + 1, len(self.sent))
+                     if seq in self.received]
+        if recovered:
+            result['time_to_recover_ms'] = 1000 * (min(recovered) - start)
+        else:
+            result['time_to_recover_ms'] = None
+        return result
+
+
 class Bonding(Test):
     '''
     Channel bonding enables two or more network interfaces to act as one,
@@ -291,8 +491,13 @@ class Bonding(Test):
         '''
         ping check
         '''
-        # need some time for specific interface before ping
-        time.sleep(10)
+        # wait for the bond link to come up instead of a fixed sleep
+        monitor = LinkEventMonitor()
+        try:
+            if monitor.wait_for(self.bond_name, True, 10) is None:
+                self.log.info("%s link is still down", self.bond_name)
+        finally:
+            monitor.close()
         cmd = "ping -I %s %s -c 5"\
               % (self.bond_name, self.peer_first_ipinterface[0])
         if process.system(cmd, shell=True, ignore_status=True) != 0:
@@ -586,3 +791,183 @@ class Bonding(Test):
 
     def tearDown(self):
         self.session.quit()
+
+
+ECHO_RESPONDER = """
+import socket
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.bind(('0.0.0.0', %d))
+while True:
+    data, addr = sock.recvfrom(64)
+    sock.sendto(data, addr)
+"""
+
+
+class BondFailover(Test):
+
+    """
+    Measure bonding failover time on a single host.
+
+    A bond is built over veth pairs whose peers live in a network
+    namespace, behind a bridge (or a bond for 802.3ad). A 1 kpps UDP
+    probe stream runs through the bond to an echo responder in the
+    namespace while each slave is failed and restored. Link state
+    changes are taken from rtnetlink events, and the traffic loss window
+    and time to recover are computed per event.
+
+    :avocado: tags=net,privileged
+    """
+
+    def setUp(self):
+        """
+        Build the veth/netns topology and the bond under test
+        """
+        self.mode = str(self.params.get("bonding_mode", default="1"))
+        self.bond_name = self.params.get("bond_name", default="bondfo")
+        self.netns = self.params.get("netns", default="bondfo_peer")
+        self.nr_slaves = int(self.params.get("slaves", default=2))
+        self.miimon = self.params.get("miimon", default="100")
+        self.probe_rate = int(self.params.get("probe_rate", default=1000))
+        self.probe_port = int(self.params.get("probe_port", default=7777))
+        self.fail_dwell = float(self.params.get("fail_dwell", default=1))
+        self.restore_dwell = float(self.params.get("restore_dwell",
+                                                   default=1))
+        self.link_timeout = float(self.params.get("link_timeout",
+                                                  default=10))
+        self.max_loss_ms = float(self.params.get("max_loss_ms",
+                                                 default=1000))
+        self.host_ip = self.params.get("host_ip", default="192.168.250.1")
+        self.peer_ip = self.params.get("peer_ip", default="192.168.250.2")
+        self.slaves = ["%s_s%d" % (self.bond_name, idx)
+                       for idx in range(self.nr_slaves)]
+        self.peers = ["%s_p%d" % (self.bond_name, idx)
+                      for idx in range(self.nr_slaves)]
+        self.responder = None
+        self.monitor = None
+        self.topology = False
+
+        linux_modules.load_module("bonding")
+        self.run_cmd("ip netns add %s" % self.netns)
+        self.topology = True
+        peer_dev = "br0"
+        if self.mode == "4":
+            self.run_ns("ip link add %s type bond mode 4 miimon %s "
+                        "lacp_rate fast" % (peer_dev, self.miimon))
+        else:
+            self.run_ns("ip link add %s type bridge" % peer_dev)
+        self.run_cmd("ip link add %s type bond mode %s miimon %s" %
+                     (self.bond_name, self.mode, self.miimon))
+        if self.mode == "4":
+            self.run_cmd("ip link set %s type bond lacp_rate fast" %
+                         self.bond_name)
+        for slave, peer in zip(self.slaves, self.peers):
+            self.run_cmd("ip link add %s type veth peer name %s" %
+                         (slave, peer))
+            self.run_cmd("ip link set %s netns %s" % (peer, self.netns))
+            self.run_cmd("ip link set %s master %s" % (slave,
+                                                       self.bond_name))
+            self.run_ns("ip link set %s master %s" % (peer, peer_dev))
+            self.run_ns("ip link set %s up" % peer)
+        self.run_ns("ip addr add %s/24 dev %s" % (self.peer_ip, peer_dev))
+        self.run_ns("ip link set %s up" % peer_dev)
+        self.run_ns("ip link set lo up")
+        self.run_cmd("ip addr add %s/24 dev %s" % (self.host_ip,
+                                                   self.bond_name))
+        self.run_cmd("ip link set %s up" % self.bond_name)
+        self.responder = subprocess.Popen(
+            ["ip", "netns", "exec", self.netns, sys.executable, "-c",
+             ECHO_RESPONDER % self.probe_port])
+        self.monitor = LinkEventMonitor()
+        if self.monitor.wait_for(self.bond_name, True,
+                                 self.link_timeout) is None:
+            self.fail("Bond %s did not come up" % self.bond_name)
+        if process.system("ping -c 1 -W 5 -I %s %s" % (self.bond_name,
+                                                       self.peer_ip),
+                          shell=True, ignore_status=True):
+            self.fail("Peer %s not reachable through %s" %
+                      (self.peer_ip, self.bond_name))
+
+    def run_cmd(self, cmd):
+        if process.system(cmd, shell=True, ignore_status=True):
+            self.fail("Command failed: %s" % cmd)
+
+    def run_ns(self, cmd):
+        self.run_cmd("ip netns exec %s %s" % (self.netns, cmd))
+
+    def set_link(self, slave, up):
+        """
+        Change a slave link state and wait for the rtnetlink event.
+
+        :return: monotonic time the change was issued
+        """
+        stamp = time.monotonic()
+        self.run_cmd("ip link set %s %s" % (slave, "up" if up else "down"))
+        if self.monitor.wait_for(slave, up, self.link_timeout,
+                                 since=stamp) is None:
+            self.fail("No link %s event for %s" %
+                      ("up" if up else "down", slave))
+        return stamp
+
+    def test_failover(self):
+        """
+        Fail and restore every slave under the probe stream and report
+        loss window and time to recover per event
+        """
+        stream = ProbeStream(self.host_ip, self.peer_ip, self.probe_port,
+                             self.probe_rate)
+        stream.start()
+        events = []
+        try:
+            time.sleep(self.restore_dwell)
+            for slave in self.slaves:
+                events.append(('fail', slave,
+                               self.set_link(slave, False)))
+                time.sleep(self.fail_dwell)
+                events.append(('restore', slave,
+                               self.set_link(slave, True)))
+                time.sleep(self.restore_dwell)
+        finally:
+            stream.stop()
+
+        results = []
+        self.log.info("%-8s %-14s %6s %6s %14s %14s", "event", "slave",
+                      "sent", "lost", "loss_win(ms)", "recover(ms)")
+        for idx, (kind, slave, stamp) in enumerate(events):
+            end = events[idx + 1][2] if idx + 1 < len(events) else \
+                stream.sent[-1] + stream.interval
+            result = stream.analyze(stamp, end)
+            result.update({'mode': self.mode, 'event': kind,
+                           'slave': slave})
+            results.append(result)
+            recover = result['time_to_recover_ms']
+            self.log.info("%-8s %-14s %6d %6d %14.1f %14s", kind, slave,
+                          result['sent'], result['lost'],
+                          result['loss_window_ms'],
+                          "%.1f" % recover if recover is not None
+                          else "never")
+        with open(os.path.join(self.logdir, 'bond_failover_mode%s.json' %
+                               self.mode), 'w') as result_fd:
+            json.dump(results, result_fd, indent=4)
+
+        slow = [result for result in results
+                if result['time_to_recover_ms'] is None or
+                result['loss_window_ms'] > self.max_loss_ms]
+        if slow:
+            self.fail("Mode %s: %d event(s) exceeded %.0f ms of traffic "
+                      "loss or never recovered" % (self.mode, len(slow),
+                                                   self.max_loss_ms))
+
+    def tearDown(self):
+        if self.monitor:
+            self.monitor.close()
+        if self.responder:
+            self.responder.terminate()
+            self.responder.wait()
+        if self.topology:
+            process.system("ip link del %s" % self.bond_name, shell=True,
+                           ignore_status=True)
+            for slave in self.slaves:
+                process.system("ip link del %s" % slave, shell=True,
+                               ignore_status=True)
+            process.system("ip netns del %s" % self.netns, shell=True,
+                           ignore_status=True)
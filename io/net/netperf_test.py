@@ -23,6 +23,9 @@ unidirectional throughput, and end-to-end latency.
 
 
 import os
+import csv
+import json
+import subprocess
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import distro
@@ -144,8 +147,12 @@ class Netperf(Test):
         output = self.session.cmd(cmd)
         if output.exit_status != 0:
             self.cancel("Netperf compilation failed on peer machine")
+        configure = './configure --build=powerpc64le'
+        if self.params.get("enable_histogram", default=False):
+            # needed for the P50/P90/P99 latency omni selectors
+            configure += ' --enable-histogram'
         try:
-            process.system('./configure --build=powerpc64le', shell=True)
+            process.system(configure, shell=True)
             build.make(self.netperf_dir)
         except Exception as e:
             self.cancel("Netperf compilation failed on local machine: %s"
@@ -161,9 +168,9 @@ class Netperf(Test):
         self.timeout = self.duration * self.max + 60
         self.option = self.params.get("option", default='')
 
-    def test(self):
+    def start_netserver(self):
         """
-        netperf test
+        Start netserver on the peer
         """
         if self.netperf_run:
             cmd = "chmod 777 /tmp/%s/src" % self.version
@@ -174,6 +181,12 @@ class Netperf(Test):
             output = self.session.cmd(cmd)
             if not output.exit_status == 0:
                 self.fail("test failed because netserver not available")
+
+    def test(self):
+        """
+        netperf test
+        """
+        self.start_netserver()
         speed = int(read_file("/sys/class/net/%s/speed" % self.iface))
         cmd = "timeout %s %s -H %s" % (self.timeout, self.perf,
                                        self.peer_ip)
@@ -208,6 +221,138 @@ class Netperf(Test):
         if 'WARNING' in result.stdout.decode("utf-8"):
             self.log.warn('Test completed with warning')
 
+    # omni output selectors collected for every matrix cell
+    OMNI_SELECTORS = ['THROUGHPUT', 'THROUGHPUT_UNITS', 'TRANSACTION_RATE',
+                      'MEAN_LATENCY', 'P50_LATENCY', 'P90_LATENCY',
+                      'P99_LATENCY', 'LOCAL_CPU_UTIL', 'REMOTE_CPU_UTIL',
+                      'LOCAL_SD', 'REMOTE_SD', 'SD_UNITS']
+    # selectors summed over concurrent instances, the others are averaged
+    OMNI_SUMMED = ['THROUGHPUT', 'TRANSACTION_RATE']
+
+    def matrix_cmd(self, test, size, duration):
+        """
+        netperf command line for one instance of a matrix cell
+        """
+        if test == 'TCP_STREAM':
+            size_opt = '-m %s' % size
+        elif test == 'TCP_MAERTS':
+            size_opt = '-M %s' % size
+        else:
+            size_opt = '-r %s,%s' % (size, size)
+        return ("timeout %s %s -H %s -t %s -l %s -c -C -P 0 -- %s -o %s" %
+                (int(duration) + 60, self.perf, self.peer_ip, test,
+                 duration, size_opt, ','.join(self.OMNI_SELECTORS)))
+
+    def parse_omni(self, output):
+        """
+        Parse the CSV line printed by the omni -o selectors.
+
+        :return: dict of selector -> value, None if no result line
+        """
+        for line in reversed(output.splitlines()):
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) != len(self.OMNI_SELECTORS) or \
+                    fields[0] == self.OMNI_SELECTORS[0]:
+                continue
+            values = {}
+            for name, value in zip(self.OMNI_SELECTORS, fields):
+                try:
+                    values[name] = float(value)
+                except ValueError:
+                    values[name] = value
+            return values
+        return None
+
+    def run_matrix_cell(self, test, size, instances, duration):
+        """
+        Run concurrent netperf instances and aggregate their results
+        """
+        cmd = self.matrix_cmd(test, size, duration)
+        self.log.info("Running %d x %s", instances, cmd)
+        procs = [subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT)
+                 for _ in range(instances)]
+        results = []
+        for proc in procs:
+            output = proc.communicate()[0].decode("utf-8", "replace")
+            values = self.parse_omni(output)
+            if proc.returncode or values is None:
+                self.log.warning("netperf %s size %s failed:\n%s", test,
+                                 size, output)
+                continue
+            results.append(values)
+        cell = {'test': test, 'size': int(size), 'instances': instances,
+                'completed': len(results)}
+        for name in self.OMNI_SELECTORS:
+            numbers = [res[name] for res in results
+                       if isinstance(res.get(name), float)]
+            if not numbers:
+                cell[name.lower()] = results[0].get(name) if results \
+                    else None
+            elif name in self.OMNI_SUMMED:
+                cell[name.lower()] = round(sum(numbers), 3)
+            else:
+                cell[name.lower()] = round(sum(numbers) / len(numbers), 3)
+        # percentiles can not be merged, keep the worst instance as well
+        for name in ('P99_LATENCY', 'MEAN_LATENCY'):
+            numbers = [res[name] for res in results
+                       if isinstance(res.get(name), float)]
+            if numbers:
+                cell['max_%s' % name.lower()] = max(numbers)
+        return cell
+
+    def test_matrix(self):
+        """
+        Run TCP_STREAM, TCP_MAERTS, TCP_RR, TCP_CRR and UDP_RR over a
+        matrix of message sizes and concurrent instances and record
+        throughput, transaction rate, latency percentiles and CPU
+        utilization / service demand as JSON and CSV
+        """
+        self.start_netserver()
+        tests = self.params.get("matrix_tests", default="TCP_STREAM "
+                                "TCP_MAERTS TCP_RR TCP_CRR UDP_RR").split()
+        sizes = str(self.params.get("matrix_sizes",
+                                    default="1 64 1024 16384")).split()
+        instances = [int(count) for count in str(self.params.get(
+            "matrix_instances", default="1 4 16")).split()]
+        duration = self.params.get("matrix_duration", default=30)
+
+        matrix = []
+        for test in tests:
+            for size in sizes:
+                if test.startswith('UDP') and int(size) > 65507:
+                    self.log.info("Skipping %s with %s bytes", test, size)
+                    continue
+                for count in instances:
+                    cell = self.run_matrix_cell(test, size, count, duration)
+                    self.log.info("%s size=%s instances=%d: throughput=%s "
+                                  "%s trans/s=%s p50/p90/p99=%s/%s/%s us "
+                                  "sd=%s/%s", test, size, count,
+                                  cell['throughput'],
+                                  cell['throughput_units'],
+                                  cell['transaction_rate'],
+                                  cell['p50_latency'], cell['p90_latency'],
+                                  cell['p99_latency'], cell['local_sd'],
+                                  cell['remote_sd'])
+                    matrix.append(cell)
+
+        with open(os.path.join(self.logdir, 'netperf_matrix.json'),
+                  'w') as json_fd:
+            json.dump(matrix, json_fd, indent=4)
+        fields = ['test', 'size', 'instances', 'completed']
+        fields += sorted(set(key for cell in matrix for key in cell) -
+                         set(fields))
+        with open(os.path.join(self.logdir, 'netperf_matrix.csv'),
+                  'w') as csv_fd:
+            writer = csv.DictWriter(csv_fd, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(matrix)
+        failed = [cell for cell in matrix
+                  if cell['completed'] < cell['instances']]
+        if failed:
+            self.fail("%d matrix cells had failed netperf instances, see "
+                      "netperf_matrix.json" % len(failed))
+
     def tearDown(self):
         """
         removing the data in peer machine
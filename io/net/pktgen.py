@@ -19,10 +19,35 @@
 # https://github.com/autotest/autotest-client-tests/tree/master/pktgen
 
 import os
+import re
+import json
 import shutil
 from avocado import Test
+from avocado.utils import cpu
 from avocado.utils import process
 
+# Result: OK: 2006742(c1989720+d17021) usec, 1000000 (60byte,0frags)
+#   498320pps 239Mb/sec (239193600bps) errors: 0
+RESULT_RE = re.compile(r'Result: OK: (\d+)\(c(\d+)\+d(\d+)\) usec, (\d+) '
+                       r'\((\d+)byte,(\d+)frags\)\s+(\d+)pps (\d+)Mb/sec '
+                       r'\((\d+)bps\) errors: (\d+)')
+
+
+def parse_result(text):
+    """
+    Parse the Result section of a pktgen device file.
+
+    :return: dict with usec, packets, pkt_size, pps, mbps, bps and errors,
+             or None when the run did not complete
+    """
+    match = RESULT_RE.search(text)
+    if not match:
+        return None
+    values = [int(value) for value in match.groups()]
+    return {'usec': values[0], 'packets': values[3], 'pkt_size': values[4],
+            'pps': values[6], 'mbps': values[7], 'bps': values[8],
+            'errors': values[9]}
+
 
 class Pktgen(Test):
 
@@ -34,22 +59,66 @@ class Pktgen(Test):
     def setUp(self):
 
         self.start_flag = False
+        self.created_links = []
+        self.used_threads = []
+        self.target = self.params.get("target", default="interface")
         self.eth = self.params.get("interface", default="eth0")
         self.count = self.params.get("count", default="50000")
         self.clone_skb = self.params.get("clone_skb", default="1")
         self.dst_ip = self.params.get("peer_ip", default="")
         self.dst_mac = self.params.get("peer_mac", default="")
         self.results = self.params.get("resultsdir", default="/tmp/")
+        self.pkt_sizes = str(self.params.get("pkt_sizes",
+                                             default="60")).split()
+        self.bursts = str(self.params.get("bursts", default="1")).split()
+        self.threads = str(self.params.get("threads", default="")).split()
+        self.max_threads = cpu.online_count()
+        # veth clears IFF_TX_SKB_SHARING, pktgen then refuses clone_skb
+        # and bursts above 1 with -ENOTSUPP
+        self.skb_sharing = self.target != "veth"
         if not os.path.exists('/proc/net/pktgen'):
             process.system("modprobe pktgen", ignore_status=True, shell=True)
         if not os.path.exists('/proc/net/pktgen'):
             self.error("pktgen not loaded")
 
-        # validating the dst_ip and network interface
-        self.validate_net_interface()
-        self.ping_test()
+        if self.target in ("veth", "dummy"):
+            # no physical NIC needed, pktgen transmits into a local device
+            self.create_target()
+        else:
+            # validating the dst_ip and network interface
+            self.validate_net_interface()
+            self.ping_test()
+
+    def create_target(self):
+        """
+        Create a multi-queue veth pair or dummy device to transmit into
+        """
+        queues = self.max_threads
+        self.eth = self.params.get("target_name", default="pgtest0")
+        if self.target == "veth":
+            peer = "%s_peer" % self.eth
+            cmd = ("ip link add %s numtxqueues %d numrxqueues %d type veth "
+                   "peer name %s numtxqueues %d numrxqueues %d" %
+                   (self.eth, queues, queues, peer, queues, queues))
+        else:
+            peer = None
+            cmd = ("ip link add %s numtxqueues %d numrxqueues %d type "
+                   "dummy" % (self.eth, queues, queues))
+        if process.system(cmd, ignore_status=True, shell=True):
+            self.cancel("Unable to create %s target device" % self.target)
+        self.created_links.append(self.eth)
+        process.system("ip link set %s up" % self.eth, shell=True)
+        if peer:
+            process.system("ip link set %s up" % peer, shell=True)
+            with open("/sys/class/net/%s/address" % peer) as addr:
+                self.dst_mac = self.dst_mac or addr.read().strip()
+        self.dst_ip = self.dst_ip or "198.18.0.2"
+        self.dst_mac = self.dst_mac or "02:00:00:00:00:02"
 
-        # Adding the devices
+    def add_single_device(self):
+        """
+        Attach the interface to the first pktgen thread
+        """
         self.log.info("Adding devices")
         self.pgdev = '/proc/net/pktgen/kpktgend_0'
         self.pgset('rem_device_all')
@@ -59,7 +128,7 @@ class Pktgen(Test):
         # configure the individual devices
         self.log.info("Configuring the individual devices")
         self.pgdev = '/proc/net/pktgen/%s' % self.eth
-        if self.clone_skb:
+        if self.clone_skb and self.skb_sharing:
             self.pgset('clone_skb %s' % (self.count))
         self.pgset('min_pkt_size 60')
         self.pgset('max_pkt_size 60')
@@ -68,6 +137,7 @@ class Pktgen(Test):
         self.pgset('count %s' % (self.count))
 
     def test_pktgen(self):
+        self.add_single_device()
         self.pgdev = '/proc/net/pktgen/pgctrl'
         self.start_flag = True
         self.pgset('start')
@@ -76,6 +146,115 @@ class Pktgen(Test):
         output = os.path.join(self.results, self.eth)
         shutil.copyfile(self.pgdev, output)
 
+    def get_thread_counts(self):
+        """
+        Thread counts to sweep: the threads parameter, or powers of two
+        up to the number of online CPUs
+        """
+        if self.threads:
+            return [min(int(count), self.max_threads)
+                    for count in self.threads]
+        counts = []
+        count = 1
+        while count < self.max_threads:
+            counts.append(count)
+            count *= 2
+        counts.append(self.max_threads)
+        return counts
+
+    def clear_threads(self):
+        for thread in self.used_threads:
+            self.pgdev = '/proc/net/pktgen/kpktgend_%s' % thread
+            self.pgset('rem_device_all')
+
+    def run_multiqueue(self, nr_threads, pkt_size, burst):
+        """
+        Run pktgen with one kernel thread per TX queue.
+
+        Thread N runs on the Nth online CPU and transmits on TX queue N
+        of the target through its own "<dev>@N" pktgen device.
+
+        :return: list of per thread results
+        """
+        cpus = cpu.online_list()[:nr_threads]
+        self.clear_threads()
+        self.used_threads = cpus
+        for queue, thread in enumerate(cpus):
+            self.pgdev = '/proc/net/pktgen/kpktgend_%s' % thread
+            self.pgset('rem_device_all')
+            self.pgset('add_device %s@%d' % (self.eth, queue))
+            self.pgdev = '/proc/net/pktgen/%s@%d' % (self.eth, queue)
+            if self.clone_skb and self.skb_sharing:
+                self.pgset('clone_skb %s' % self.count)
+            self.pgset('count %s' % self.count)
+            self.pgset('pkt_size %s' % pkt_size)
+            self.pgset('burst %s' % burst)
+            self.pgset('queue_map_min %d' % queue)
+            self.pgset('queue_map_max %d' % queue)
+            self.pgset('dst %s' % self.dst_ip)
+            self.pgset('dst_mac %s' % self.dst_mac)
+
+        self.pgdev = '/proc/net/pktgen/pgctrl'
+        self.start_flag = True
+        self.pgset('start')
+        self.start_flag = False
+
+        results = []
+        for queue, thread in enumerate(cpus):
+            dev_file = '/proc/net/pktgen/%s@%d' % (self.eth, queue)
+            with open(dev_file) as dev_fd:
+                result = parse_result(dev_fd.read())
+            if result is None:
+                self.fail("No pktgen result for %s" % dev_file)
+            result.update({'queue': queue, 'cpu': thread})
+            results.append(result)
+        return results
+
+    def test_pktgen_scaling(self):
+        """
+        Sweep packet size, burst and thread count, one pktgen thread per
+        TX queue, and report per thread and aggregate pps / Mb/s with the
+        scaling efficiency against a single thread
+        """
+        report = []
+        bursts = self.bursts
+        if not self.skb_sharing:
+            skipped = [burst for burst in bursts if int(burst) > 1]
+            bursts = [burst for burst in bursts if int(burst) <= 1]
+            if skipped:
+                self.log.info("Skipping bursts %s, %s does not support TX "
+                              "skb sharing", " ".join(skipped), self.target)
+            if not bursts:
+                self.cancel("No burst size usable on %s" % self.target)
+        self.log.info("%8s %6s %8s %14s %10s %10s", "pkt_size", "burst",
+                      "threads", "pps", "Mb/s", "efficiency")
+        for pkt_size in self.pkt_sizes:
+            for burst in bursts:
+                single_pps = None
+                for nr_threads in self.get_thread_counts():
+                    results = self.run_multiqueue(nr_threads, pkt_size,
+                                                  burst)
+                    total_pps = sum(res['pps'] for res in results)
+                    total_mbps = sum(res['mbps'] for res in results)
+                    if single_pps is None:
+                        single_pps = float(total_pps) / nr_threads
+                    efficiency = total_pps / (single_pps * nr_threads) \
+                        if single_pps else 0.0
+                    report.append({'pkt_size': int(pkt_size),
+                                   'burst': int(burst),
+                                   'threads': nr_threads,
+                                   'pps': total_pps, 'mbps': total_mbps,
+                                   'efficiency': round(efficiency, 3),
+                                   'errors': sum(res['errors']
+                                                 for res in results),
+                                   'per_thread': results})
+                    self.log.info("%8s %6s %8d %14d %10d %10.2f", pkt_size,
+                                  burst, nr_threads, total_pps, total_mbps,
+                                  efficiency)
+        with open(os.path.join(self.logdir, 'pktgen_scaling.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+
     def pgset(self, command):
         file_name = open(self.pgdev, 'w')
         file_name.write(command + '\n')
@@ -105,3 +284,11 @@ class Pktgen(Test):
         self.log.info("Ping response value is %d" % ping_response)
         if ping_response != 0:
             self.cancel("Host not reachable")
+
+    def tearDown(self):
+        if hasattr(self, 'used_threads'):
+            self.start_flag = True
+            self.clear_threads()
+        for link in getattr(self, 'created_links', []):
+            process.system("ip link del %s" % link, ignore_status=True,
+                           shell=True)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2025 IBM
+
+"""
+Parallel NVMe over Fabrics discovery and connect, with timings.
+
+ParallelConnector runs "nvme discover" and "nvme connect" for many
+targets from a bounded pool of worker threads. For every target it
+records the discover and connect latency, and how long it took from the
+start of the connect until the namespaces of the subsystem showed up as
+block devices. latency_summary() turns those into a distribution.
+
+LoopbackTarget builds an nvmet target on the local host through configfs,
+with any number of subsystems backed by configfs null_blk devices, so the
+connect path can be exercised at scale on a single box.
+
+Tests outside io/nvmf add io/nvmf to sys.path to import it::
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), '..', '..', 'nvmf'))
+    from nvmf_connect.connect import ParallelConnector, latency_summary
+
+    connector = ParallelConnector('tcp', max_workers=16)
+    results = connector.connect([{'nqn': nqn, 'traddr': '127.0.0.1',
+                                  'trsvcid': 4420} for nqn in nqns])
+    self.log.info(latency_summary([res['visible_s'] for res in results]))
+"""
+
+import concurrent.futures
+import glob
+import os
+import subprocess
+import time
+
+__all__ = ['ParallelConnector', 'LoopbackTarget', 'latency_summary']
+
+NVMET_CONFIGFS = '/sys/kernel/config/nvmet'
+NULLB_CONFIGFS = '/sys/kernel/config/nullb'
+SUBSYS_CLASS = '/sys/class/nvme-subsystem'
+
+
+def _write(path, value):
+    with open(path, 'w') as sysfs:
+        sysfs.write(str(value))
+
+
+def _read(path):
+    with open(path) as sysfs:
+        return sysfs.read().strip()
+
+
+def latency_summary(values):
+    """
+    Distribution of a list of latencies in seconds.
+
+    :return: dict with count, and min, mean, p50, p90, p99 and max in ms
+    """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return {'count': 0}
+
+    def percentile(pct):
+        return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+    return {'count': len(values),
+            'min_ms': round(values[0] * 1000, 2),
+            'mean_ms': round(sum(values) * 1000 / len(values), 2),
+            'p50_ms': round(percentile(50) * 1000, 2),
+            'p90_ms': round(percentile(90) * 1000, 2),
+            'p99_ms': round(percentile(99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2)}
+
+
+class ParallelConnector(object):
+
+    """
+    Discover and connect NVMe over Fabrics targets concurrently.
+
+    :param transport: nvme-cli transport, "tcp" or "rdma"
+    :param max_workers: number of discover/connect commands in flight
+    :param visible_timeout: seconds to wait for the namespaces to appear
+    :param connect_args: extra "nvme connect" arguments, like "-i 4"
+    """
+
+    def __init__(self, transport, max_workers=8, visible_timeout=60,
+                 connect_args=''):
+        self.transport = transport
+        self.max_workers = max_workers
+        self.visible_timeout = visible_timeout
+        self.connect_args = connect_args
+
+    def _map(self, func, items):
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def _discover_one(self, address):
+        traddr, trsvcid = address
+        cmd = ['nvme', 'discover', '-t', self.transport, '-a', traddr,
+               '-s', str(trsvcid)]
+        start = time.monotonic()
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        elapsed = time.monotonic() - start
+        output = proc.stdout.decode('utf-8', 'replace')
+        nqns = [line.split(':', 1)[1].strip() for line in output.splitlines()
+                if line.strip().startswith('subnqn:')]
+        return {'traddr': traddr, 'trsvcid': trsvcid,
+                'discover_s': round(elapsed, 4), 'subsystems': nqns,
+                'error': output.strip() if proc.returncode else None}
+
+    def discover(self, addresses):
+        """
+        Discover every (traddr, trsvcid) address concurrently.
+
+        :return: list of dicts with traddr, trsvcid, discover_s, the
+                 subsystem NQNs found and the error output on failure
+        """
+        return self._map(self._discover_one, addresses)
+
+    @staticmethod
+    def find_subsystem(nqn):
+        """
+        sysfs directory of the connected subsystem with this NQN, or None
+        """
+        for subsys in glob.glob(os.path.join(SUBSYS_CLASS, 'nvme-subsys*')):
+            try:
+                if _read(os.path.join(subsys, 'subsysnqn')) == nqn:
+                    return subsys
+            except IOError:
+                continue
+        return None
+
+    @staticmethod
+    def subsystem_namespaces(subsys):
+        """
+        Namespace block devices of a subsystem that have a /dev node.
+        """
+        names = [os.path.basename(path) for path in
+                 glob.glob(os.path.join(subsys, 'nvme*n*'))]
+        if not names:
+            # without native multipath they hang off the controllers
+            names = [os.path.basename(path) for path in glob.glob(
+                os.path.join(subsys, 'nvme[0-9]*', 'nvme*n*'))
+                if 'c' not in os.path.basename(path)[4:]]
+        return sorted(name for name in names
+                      if os.path.exists(os.path.join('/dev', name)))
+
+    def _wait_visible(self, nqn, start):
+        subsys = None
+        deadline = start + self.visible_timeout
+        while time.monotonic() < deadline:
+            subsys = subsys or self.find_subsystem(nqn)
+            if subsys:
+                namespaces = self.subsystem_namespaces(subsys)
+                if namespaces:
+                    return time.monotonic() - start, namespaces
+            time.sleep(0.01)
+        return None, []
+
+    def _connect_one(self, target):
+        port = str(target.get('trsvcid', 4420))
+        cmd = ['nvme', 'connect', '-t', self.transport, '-n', target['nqn'],
+               '-a', target['traddr'], '-s', port]
+        cmd.extend(self.connect_args.split())
+        result = {'nqn': target['nqn'], 'traddr': target['traddr'],
+                  'connect_s': None, 'visible_s': None, 'namespaces': [],
+                  'error': None}
+        start = time.monotonic()
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        result['connect_s'] = round(time.monotonic() - start, 4)
+        if proc.returncode:
+            result['error'] = proc.stdout.decode('utf-8', 'replace').strip()
+            return result
+        visible, namespaces = self._wait_visible(target['nqn'], start)
+        result['namespaces'] = namespaces
+        if visible is None:
+            result['error'] = 'namespaces not visible after %ss' % \
+                self.visible_timeout
+        else:
+            result['visible_s'] = round(visible, 4)
+        return result
+
+    def connect(self, targets):
+        """
+        Connect every target concurrently, each a dict with nqn, traddr
+        and trsvcid.
+
+        :return: list of dicts with nqn, traddr, connect_s, visible_s
+                 (from the start of the connect), namespaces and error
+        """
+        return self._map(self._connect_one, targets)
+
+    def disconnect(self, nqns):
+        """
+        Disconnect every controller of the given subsystems concurrently.
+
+        :return: list of (nqn, seconds, exit status)
+        """
+        def disconnect_one(nqn):
+            start = time.monotonic()
+            proc = subprocess.run(['nvme', 'disconnect', '-n', nqn],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+            return nqn, round(time.monotonic() - start, 4), proc.returncode
+
+        return self._map(disconnect_one, nqns)
+
+
+class LoopbackTarget(object):
+
+    """
+    nvmet target on the local host, configured through configfs.
+
+    Every subsystem gets nr_namespaces null_blk devices and is exported on
+    one port per address in traddrs.
+
+    :param nqns: subsystem NQNs to create
+    :param traddrs: addresses to listen on, like ['127.0.0.1']
+    :param trsvcid: port number
+    :param transport: nvmet transport, "tcp" or "rdma"
+    :param nr_namespaces: namespaces per subsystem
+    :param ns_size_mb: size of each null_blk namespace
+    """
+
+    def __init__(self, nqns, traddrs, trsvcid=4420, transport='tcp',
+                 nr_namespaces=1, ns_size_mb=1024):
+        self.nqns = list(nqns)
+        self.traddrs = list(traddrs)
+        self.trsvcid = trsvcid
+        self.transport = transport
+        self.nr_namespaces = nr_namespaces
+        self.ns_size_mb = ns_size_mb
+        self.ports = []
+        self.nullbs = []
+        self.subsystems = []
+
+    def _nullb(self, name):
+        path = os.path.join(NULLB_CONFIGFS, name)
+        os.makedirs(path)
+        self.nullbs.append(path)
+        _write(os.path.join(path, 'size'), self.ns_size_mb)
+        _write(os.path.join(path, 'power'), 1)
+        return '/dev/nullb%s' % _read(os.path.join(path, 'index'))
+
+    def create(self):
+        """
+        Load the target modules and create subsystems, namespaces and
+        ports. Raises OSError or subprocess.CalledProcessError on failure.
+        """
+        for module in ['nvmet', 'nvmet-%s' % self.transport]:
+            subprocess.run(['modprobe', module], check=True)
+        if not os.path.isdir(NULLB_CONFIGFS):
+            # only configfs devices, so any number can be created
+            subprocess.run(['modprobe', 'null_blk', 'nr_devices=0'],
+                           check=True)
+        for index, nqn in enumerate(self.nqns):
+            subsys = os.path.join(NVMET_CONFIGFS, 'subsystems', nqn)
+            os.makedirs(subsys)
+            self.subsystems.append(subsys)
+            _write(os.path.join(subsys, 'attr_allow_any_host'), 1)
+            for nsid in range(1, self.nr_namespaces + 1):
+                namespace = os.path.join(subsys, 'namespaces', str(nsid))
+                os.makedirs(namespace)
+                _write(os.path.join(namespace, 'device_path'),
+                       self._nullb('avocado_%d_%d' % (index, nsid)))
+                _write(os.path.join(namespace, 'enable'), 1)
+        port_dir = os.path.join(NVMET_CONFIGFS, 'ports')
+        used = [int(name) for name in os.listdir(port_dir) if name.isdigit()]
+        next_id = max(used + [0]) + 1
+        for traddr in self.traddrs:
+            port = os.path.join(port_dir, str(next_id))
+            next_id += 1
+            os.makedirs(port)
+            self.ports.append(port)
+            _write(os.path.join(port, 'addr_trtype'), self.transport)
+            _write(os.path.join(port, 'addr_adrfam'),
+                   'ipv6' if ':' in traddr else 'ipv4')
+            _write(os.path.join(port, 'addr_traddr'), traddr)
+            _write(os.path.join(port, 'addr_trsvcid'), self.trsvcid)
+            for subsys in self.subsystems:
+                os.symlink(subsys, os.path.join(
+                    port, 'subsystems', os.path.basename(subsys)))
+
+    def remove(self):
+        """
+        Remove everything create() made, in reverse order.
+        """
+        for port in self.ports:
+            for link in glob.glob(os.path.join(port, 'subsystems', '*')):
+                os.unlink(link)
+            os.rmdir(port)
+        for subsys in self.subsystems:
+            for namespace in glob.glob(os.path.join(subsys, 'namespaces',
+                                                    '*')):
+                _write(os.path.join(namespace, 'enable'), 0)
+                os.rmdir(namespace)
+            os.rmdir(subsys)
+        for nullb in self.nullbs:
+            _write(os.path.join(nullb, 'power'), 0)
+            os.rmdir(nullb)
+        self.ports = []
+        self.subsystems = []
+        self.nullbs = []
@@ -23,12 +23,12 @@ a storage networking fabric.
 import os
 import json
 import copy
-import time
 from avocado import Test
 from avocado.utils import process, linux_modules, genio
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils.ssh import Session
 from avocado.utils.process import CmdError
+from nvmf_connect.connect import ParallelConnector, latency_summary
 import yaml
 
 
@@ -65,6 +65,9 @@ class NVMfTest(Test):
         dirname = os.path.dirname(os.path.abspath(self.cfg_tmpl))
         self.cfg_file = os.path.join(dirname, "nvmf.cfg")
         self.nvmf_discovery_file = "/etc/nvme/discovery.conf"
+        self.connector = ParallelConnector(
+            'rdma', max_workers=int(self.params.get('max_workers',
+                                                    default=8)))
 
     def create_cfg_file(self):
         """
@@ -131,14 +134,31 @@ class NVMfTest(Test):
         if output.exit_status:
             self.fail("nvmetcli setup config fails on peer")
 
+    def save_timings(self, name, results, keys):
+        """
+        Logs the latency distributions and saves them with the per target
+        timings
+        """
+        summary = {}
+        for key in keys:
+            summary[key] = latency_summary([res[key] for res in results])
+            self.log.info("%s latency: %s", key, summary[key])
+        with open(os.path.join(self.logdir, name), 'w') as timings_fp:
+            json.dump({'max_workers': self.connector.max_workers,
+                       'summary': summary, 'targets': results}, timings_fp,
+                      indent=4)
+
     def test_nvmfdiscover(self):
         """
         Discovers NVMf subsystems on the initiator
         """
-        for i in range(len(self.ids)):
-            cmd = "nvme discover -t rdma -a %s -s 4420 -q mysubsys%s" % (
-                self.peer_ips[i], str(i + 1))
-            if process.system(cmd, shell=True, ignore_status=True) != 0:
+        results = self.connector.discover(
+            [(peer_ip, 4420) for peer_ip in self.peer_ips])
+        self.save_timings('nvmf_discover_timings.json', results,
+                          ['discover_s'])
+        for i, res in enumerate(results):
+            if res['error']:
+                self.log.info(res['error'])
                 self.fail("Discover of mysubsys%s fails" % str(i + 1))
 
     def test_nvmfconnect(self):
@@ -146,13 +166,15 @@ class NVMfTest(Test):
         Connects to NVMf subsystems on the initiator
         """
         pre_count = self.nvme_devs_count()
-        for i in range(len(self.ids)):
-            cmd = "nvme connect -t rdma -n mysubsys%s -a %s -s 4420" % (
-                str(i + 1), self.peer_ips[i])
-            if process.system(cmd, shell=True, ignore_status=True) != 0:
-                self.fail("Connect to mysubsys%s fails" % str(i + 1))
-            # Time needed to populate the device in nvme list command
-            time.sleep(1)
+        results = self.connector.connect(
+            [{'nqn': "mysubsys%s" % str(i + 1), 'traddr': self.peer_ips[i],
+              'trsvcid': 4420} for i in range(len(self.ids))])
+        self.save_timings('nvmf_connect_timings.json', results,
+                          ['connect_s', 'visible_s'])
+        for res in results:
+            if res['error']:
+                self.log.info(res['error'])
+                self.fail("Connect to %s fails" % res['nqn'])
         if (self.nvme_devs_count() - pre_count) != len(self.ids):
             self.fail("%d new nvme devices not added" % len(self.ids))
 
@@ -20,7 +20,10 @@
 
 import os
 import re
+import json
+import time
 import platform
+import statistics
 
 from avocado import Test
 from avocado.utils import build
@@ -28,6 +31,7 @@ from avocado.utils import process
 from avocado.utils import cpu
 from avocado.utils import distro
 from avocado.utils import archive
+from avocado.utils.partition import Partition
 from avocado.utils.software_manager.manager import SoftwareManager
 
 
@@ -38,17 +42,29 @@ class Kernbench(Test):
     shown in the log file.
     """
 
-    def time_build(self, threads=None, timefile=None, make_opts=None):
+    def prepare_config(self, configure=True):
         """
-        Time the building of the kernel
+        Clean the tree and generate the kernel config, returns the
+        wall time spent in seconds
         """
         os.chdir(self.sourcedir)
+        start = time.time()
         build.make(self.sourcedir, extra_args='clean')
-        if self.config_path is None:
-            build.make(self.sourcedir, extra_args='defconfig')
-        else:
-            build.make(self.sourcedir, extra_args='olddefconfig')
-        self.kernel_config_fix()
+        if configure:
+            if self.config_path is None:
+                build.make(self.sourcedir, extra_args='defconfig')
+            else:
+                build.make(self.sourcedir, extra_args='olddefconfig')
+            self.kernel_config_fix()
+        return time.time() - start
+
+    def compile_kernel(self, threads=None, timefile=None, make_opts=None):
+        """
+        Time the compilation of vmlinux on an already configured tree
+        """
+        os.chdir(self.sourcedir)
+        if self.ccache:
+            make_opts = '%s CC="ccache gcc"' % (make_opts or '')
         if make_opts:
             build_string = "yes \"\"|/usr/bin/time -o %s make %s -j %s vmlinux" % (
                 timefile, make_opts, threads)
@@ -102,6 +118,7 @@ class Kernbench(Test):
         """
         Setting up the env for the kernel building
         """
+        self.tmpfs = None
         smg = SoftwareManager()
         self.detected_distro = distro.detect()
         deps = ['gcc', 'make', 'automake', 'autoconf', 'time', 'bison', 'flex']
@@ -126,6 +143,16 @@ class Kernbench(Test):
         self.threads = self.params.get('cpus', default=None)
         if self.threads is None:
             self.threads = 2 * cpu.online_cpus_count()
+        self.configure_once = self.params.get('configure_once',
+                                              default=False)
+        self.ccache = self.params.get('ccache', default=False)
+        self.use_tmpfs = self.params.get('tmpfs', default=False)
+        self.sweep = self.params.get('thread_sweep', default=False)
+        if self.ccache:
+            if not smg.check_installed('ccache') and \
+                    not smg.install('ccache'):
+                self.cancel('ccache is needed for the test to be run')
+            os.environ['CCACHE_DIR'] = os.path.join(self.workdir, 'ccache')
         self.location = self.params.get(
             'url', default='https://github.com/torvalds/linux/archive'
             '/master.zip')
@@ -133,34 +160,102 @@ class Kernbench(Test):
         # Uncompress the kernel archive to the work directory
         tarball = self.fetch_asset("kernbench.zip", locations=[self.location],
                                    expire='1d')
-        archive.extract(tarball, self.workdir)
+        self.builddir = self.workdir
+        if self.use_tmpfs:
+            # Keep the source tree in memory so that the build measures
+            # the compiler and the scheduler rather than the disk
+            self.builddir = os.path.join(self.workdir, 'tmpfs')
+            os.makedirs(self.builddir, exist_ok=True)
+            self.tmpfs = Partition(device='tmpfs', mountpoint=self.builddir)
+            self.tmpfs.mount(mountpoint=self.builddir, fstype='tmpfs',
+                             mnt_check=False)
+        archive.extract(tarball, self.builddir)
+
+    def get_thread_counts(self):
+        """
+        Thread counts to build with, either the configured one or a
+        1, N/2, N, 2N sweep over the online CPUs
+        """
+        if not self.sweep:
+            return [self.threads]
+        online = cpu.online_cpus_count()
+        return sorted(set([1, max(online // 2, 1), online, 2 * online]))
+
+    def summarize(self, values):
+        """
+        Mean, standard deviation, min and max of a list of values
+        """
+        return {'mean': statistics.mean(values),
+                'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+                'min': min(values),
+                'max': max(values)}
 
     def test(self):
         """
         Kernel build Test
         """
         # Setting the kernel
-        self.sourcedir = os.path.join(self.workdir, 'linux-master')
+        self.sourcedir = os.path.join(self.builddir, 'linux-master')
 
         self.log.info("Starting build the kernel")
         timefile = "%s/time_file" % self.sourcedir
-        # Build kernel
-        user_time = 0
-        system_time = 0
-        elapsed_time = 0
-        for run in range(self.iterations):
-            self.log.info("Iteration: %s" % (int(run) + 1))
-            self.time_build(self.threads, timefile, "")
-            # Processing the timefile
-            results = open(timefile).readline().strip()
-            (user, system, elapsed) = self.extract_all_time_results(results)[0]
-            user_time += float(user)
-            system_time += float(system)
-            elapsed_time += float(elapsed)
-        # Results
-        self.log.info("Performance figures:")
-        self.log.info("Iterations        : %s", self.iterations)
-        self.log.info("Number of threads     : %s", self.threads)
-        self.log.info("User      : %s", user_time)
-        self.log.info("System    : %s", system_time)
-        self.log.info("Elapsed   : %s", elapsed_time)
+        if self.configure_once:
+            # Generate the config once, iterations then only clean the tree
+            config_time = self.prepare_config()
+            self.log.info("Config preparation: %.2f s", config_time)
+        results = {}
+        for threads in self.get_thread_counts():
+            iterations = []
+            for run in range(self.iterations):
+                self.log.info("Threads: %s Iteration: %s", threads,
+                              int(run) + 1)
+                prep = self.prepare_config(
+                    configure=not self.configure_once)
+                self.compile_kernel(threads, timefile, "")
+                # Processing the timefile
+                with open(timefile) as time_fd:
+                    line = time_fd.readline().strip()
+                (user, system, elapsed) = \
+                    self.extract_all_time_results(line)[0]
+                iterations.append({'prep': prep,
+                                   'user': float(user),
+                                   'system': float(system),
+                                   'elapsed': float(elapsed)})
+            summary = {key: self.summarize([it[key] for it in iterations])
+                       for key in ('prep', 'user', 'system', 'elapsed')}
+            results[threads] = {'iterations': iterations,
+                                'summary': summary}
+            # Results
+            self.log.info("Performance figures:")
+            self.log.info("Iterations        : %s", self.iterations)
+            self.log.info("Number of threads     : %s", threads)
+            for key in ('prep', 'user', 'system', 'elapsed'):
+                self.log.info("%-10s: mean %.2f stdev %.2f min %.2f max %.2f",
+                              key.capitalize(), summary[key]['mean'],
+                              summary[key]['stdev'], summary[key]['min'],
+                              summary[key]['max'])
+
+        # Build scaling curve relative to the lowest thread count
+        base_threads = min(results)
+        base = results[base_threads]['summary']['elapsed']['mean']
+        self.log.info("Build scaling:")
+        for threads in sorted(results):
+            elapsed = results[threads]['summary']['elapsed']['mean']
+            speedup = base / elapsed if elapsed else 0.0
+            results[threads]['speedup'] = speedup
+            self.log.info("Threads %-5s: elapsed %.2f s speedup %.2fx "
+                          "efficiency %.2f%%", threads, elapsed, speedup,
+                          100 * speedup * base_threads / threads)
+        with open(os.path.join(self.logdir, 'kernbench.json'), 'w') as f:
+            json.dump({'kernel': self.kernel_version,
+                       'configure_once': self.configure_once,
+                       'ccache': self.ccache,
+                       'tmpfs': self.use_tmpfs,
+                       'results': results}, f, indent=4)
+
+    def tearDown(self):
+        """
+        Unmount the tmpfs holding the source tree
+        """
+        if self.tmpfs:
+            self.tmpfs.unmount()
@@ -14,6 +14,7 @@
 # Author: Abdul Haleem <abdhalee@linux.vnet.ibm.com>
 
 import os
+import sys
 import platform
 import re
 import glob
@@ -24,6 +25,9 @@ from avocado.utils import build, process
 from avocado.utils import distro
 from avocado.utils import archive, git
 from avocado.utils.software_manager.manager import SoftwareManager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'generic'))
+from stream_capture.capture import StreamCapture  # noqa: E402
 
 
 class kselftest(Test):
@@ -231,6 +235,7 @@ class kselftest(Test):
         """
         self.error = False
         self.failed_tests = []
+        self.result = None
         kself_args = self.params.get("kself_args", default='')
         if self.comp == "bpf":
             self.bpf()
@@ -248,25 +253,19 @@ class kselftest(Test):
                     test_comp = self.comp
                 make_cmd = 'make -C %s %s -C %s run_tests' % (
                     self.sourcedir, kself_args, test_comp)
-                self.result = process.run(
-                    make_cmd, shell=True, ignore_status=True)
-        log_output = self.result.stdout.decode('utf-8')
-        results_path = os.path.join(self.outputdir, 'raw_output')
-        with open(results_path, 'w') as r_file:
-            r_file.write(log_output)
-        for line in open(results_path).readlines():
-            if self.run_type == 'upstream':
-                # Match both overall test failures and individual test failures
-                self.find_match(r'not ok (.*) selftests:(.*)', line)
-                self.find_match(r'# not ok \d+ .* # exit=\d+', line)
-            elif self.run_type == 'distro':
-                if self.detected_distro.name == 'SuSE' and\
-                        self.distro_ver == 12:
-                    self.find_match(r'selftests:(.*)\[FAIL\]', line)
-                else:
-                    # Match both overall test failures and individual test failures
-                    self.find_match(r'not ok (.*) selftests:(.*)', line)
-                    self.find_match(r'# not ok \d+ .* # exit=\d+', line)
+                # run_tests output can be huge, stream it to a compressed
+                # raw_output and match failures line by line
+                capture = StreamCapture(os.path.join(self.outputdir,
+                                                     'raw_output.gz'))
+                capture.add_parser(self.check_line)
+                capture.run(make_cmd)
+        if self.result is not None:
+            log_output = self.result.stdout.decode('utf-8')
+            results_path = os.path.join(self.outputdir, 'raw_output')
+            with open(results_path, 'w') as r_file:
+                r_file.write(log_output)
+            for line in open(results_path).readlines():
+                self.check_line(line)
 
         if self.error:
             # Build the summary message
@@ -292,6 +291,25 @@ class kselftest(Test):
             # Fail with a concise message (detailed summary already logged above)
             self.fail(f"Testcase failed during selftests. Total failed tests: {len(self.failed_tests)}")
 
+    def check_line(self, line, stream='stdout'):
+        """
+        Match one line of selftest output against the failure patterns
+        """
+        if stream != 'stdout':
+            return
+        if self.run_type == 'upstream':
+            # Match both overall test failures and individual test failures
+            self.find_match(r'not ok (.*) selftests:(.*)', line)
+            self.find_match(r'# not ok \d+ .* # exit=\d+', line)
+        elif self.run_type == 'distro':
+            if self.detected_distro.name == 'SuSE' and\
+                    self.distro_ver == 12:
+                self.find_match(r'selftests:(.*)\[FAIL\]', line)
+            else:
+                # Match both overall test failures and individual test failures
+                self.find_match(r'not ok (.*) selftests:(.*)', line)
+                self.find_match(r'# not ok \d+ .* # exit=\d+', line)
+
     def run_cmd(self, cmd):
         """
         Run the command:
@@ -31,6 +31,7 @@ and stress tests to control which CPUs lockstorm runs on.
 """
 
 import os
+import sys
 import platform
 import subprocess
 import time
@@ -38,6 +39,9 @@ from avocado import Test
 from avocado.utils import process, distro, dmesg
 from avocado.utils import genio, git, build, linux_modules
 from avocado.utils.software_manager.manager import SoftwareManager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'generic'))
+from stream_capture.capture import StreamCapture  # noqa: E402
 
 
 class QspinlockTracepoint(Test):
@@ -417,14 +421,23 @@ class QspinlockTracepoint(Test):
                 self.failures.append("%s: perf.data file is empty" % test_name)
                 return False
 
-            script_cmd = 'perf script -i %s' % self.perf_data
-            script_output = process.system_output(script_cmd, shell=True,
-                                                  ignore_status=True)
-            if isinstance(script_output, bytes):
-                script_output = script_output.decode('utf-8')
+            # perf script output grows with the contention, count the
+            # events as they stream by and keep the output compressed
+            counts = {'lock:contention_begin': 0, 'lock:contention_end': 0}
 
-            contention_begin_count = script_output.count('lock:contention_begin')
-            contention_end_count = script_output.count('lock:contention_end')
+            def count_events(line, stream):
+                for event in counts:
+                    counts[event] += line.count(event)
+
+            script_cmd = 'perf script -i %s' % self.perf_data
+            capture = StreamCapture(os.path.join(
+                self.logdir, '%s_perf_script.txt.gz' %
+                test_name.lower().replace(' ', '_')))
+            capture.add_parser(count_events)
+            capture.run(script_cmd)
+
+            contention_begin_count = counts['lock:contention_begin']
+            contention_end_count = counts['lock:contention_end']
 
             self.log.info("%s captured lock:contention_begin events: %d",
                           test_name, contention_begin_count)
@@ -16,13 +16,80 @@
 #
 
 import os
+import re
+import glob
 import shutil
 import json
+import statistics
 
 from avocado import Test
-from avocado.utils import process
+from avocado.utils import cpu, genio, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# FILE_SIZE / PAGE_SIZE the tool is built with, munmap calls = PAGES / n
+PAGES = 128 * 1048576 // 4096
+
+RESULT_RE = re.compile(r'munmap use (\d+)ms (\d+)ns/time, memory access '
+                       r'uses (-?\d+) times/thread/ms, cost (-?\d+)ns/time')
+SINGLE_RE = re.compile(r'munmap use (\d+)ms (\d+)ns/time, memory access '
+                       r'uses (\d+)ms (\d+)ns/time')
+
+
+def parse_result(output):
+    """
+    Parse the tlbflush output line
+
+    :return: dict with munmap_ms, munmap_ns (per munmap call) and
+             access_ns (per memory access), or None
+    """
+    match = RESULT_RE.search(output)
+    if match:
+        return {'munmap_ms': int(match.group(1)),
+                'munmap_ns': int(match.group(2)),
+                'access_ns': int(match.group(4))}
+    match = SINGLE_RE.search(output)
+    if match:
+        return {'munmap_ms': int(match.group(1)),
+                'munmap_ns': int(match.group(2)),
+                'access_ns': int(match.group(4))}
+    return None
+
+
+# /proc/interrupts rows counted as IPIs, matched on their description:
+# x86 TLB and CAL, arm64 IPI1, ppc64 DBL and the XICS "IPI" or per node
+# XIVE "IPI-<node>" irq
+IPI_IRQ_RE = re.compile(r'IPI(-\d+)?')
+IPI_ROWS = [('tlb', lambda label, desc: 'TLB shootdowns' in desc),
+            ('call', lambda label, desc: 'Function call interrupts' in desc),
+            ('doorbell', lambda label, desc: 'Doorbell interrupts' in desc),
+            ('irq', lambda label, desc: label[:-1].isdigit() and
+             bool(desc.split()) and
+             IPI_IRQ_RE.fullmatch(desc.split()[-1]) is not None)]
+
+
+def read_ipi_counts():
+    """
+    Sum over all CPUs of the IPI rows of /proc/interrupts
+
+    :return: dict of IPI_ROWS name -> count, only the rows this
+             architecture reports
+    """
+    lines = genio.read_all_lines('/proc/interrupts')
+    ncpus = len(lines[0].split()) if lines else 0
+    counts = {}
+    for line in lines[1:]:
+        fields = line.split()
+        if not fields:
+            continue
+        values = fields[1:ncpus + 1]
+        numbers = [int(field) for field in values if field.isdigit()]
+        desc = ' '.join(fields[1 + len(numbers):])
+        for name, match in IPI_ROWS:
+            if match(fields[0], desc):
+                counts[name] = counts.get(name, 0) + sum(numbers)
+                break
+    return counts
+
 
 class Tlbflush(Test):
 
@@ -35,7 +102,6 @@ class Tlbflush(Test):
     def setUp(self):
 
         self.tlbflush_max_entries = self.params.get('entries', default=200)
-        self.tlbflush_iteration = self.params.get('iterations', default=50)
         self.nr_threads = self.params.get('nr_threads', default=50)
 
         # Check for basic utilities
@@ -56,38 +122,176 @@ class Tlbflush(Test):
                -lpthread -o tlbflush'
         process.run(cmd, shell=True)
 
-    def set_value(self):
-
-        self.perf_json = [{}]
-        self.nr_entries = 100
+    @staticmethod
+    def cpu_topology():
+        """
+        Online CPUs with the core (SMT siblings) and chip (package, or
+        NUMA node when the package id is not set) they belong to
+        """
+        topology = []
+        for cpu_id in cpu.online_list():
+            base = '/sys/devices/system/cpu/cpu%d' % cpu_id
+            core = genio.read_one_line(
+                os.path.join(base, 'topology', 'thread_siblings_list'))
+            chip = int(genio.read_one_line(
+                os.path.join(base, 'topology', 'physical_package_id')))
+            if chip < 0:
+                nodes = glob.glob(os.path.join(base, 'node[0-9]*'))
+                chip = int(os.path.basename(nodes[0])[4:]) if nodes else 0
+            topology.append((cpu_id, core, chip))
+        return topology
 
-        for ite in range(1, self.tlbflush_iteration):
-            # Select a range of entries to randomly select from.
-            # This is to ensure an evenish spread of entries to
-            # be tested
+    def placement_cpus(self, placement, count):
+        """
+        CPUs to run the tool and its count threads on
 
-            nr_section = ite % 8
-            ranges = self.tlbflush_max_entries / 8
-            min_entries = ranges * nr_section + 1
-            max_entries = min_entries + ranges
-            if self.nr_entries > max_entries:
-                self.nr_entries = max_entries
+        same_core: the SMT siblings of the first CPU
+        same_chip: the first CPU's chip, one CPU per core first
+        cross_socket: CPUs taken round robin from every chip
 
-            out = self.run()
-            self.perf_json.append({'Test time' + str(ite): out})
-        self.whiteboard = json.dumps(self.perf_json)
+        :return: list of CPUs, empty for no affinity, None when the
+                 placement cannot hold count + 1 tasks
+        """
+        if placement == 'none':
+            return []
+        topology = self.cpu_topology()
+        first_core, first_chip = topology[0][1], topology[0][2]
+        if placement == 'same_core':
+            cpus = [cpu_id for cpu_id, core, _ in topology
+                    if core == first_core]
+        elif placement == 'same_chip':
+            chip_cpus = [(cpu_id, core) for cpu_id, core, chip in topology
+                         if chip == first_chip]
+            # first SMT thread of every core, then the siblings
+            seen = set()
+            cpus = []
+            for cpu_id, core in chip_cpus:
+                if core not in seen:
+                    seen.add(core)
+                    cpus.append(cpu_id)
+            cpus += [cpu_id for cpu_id, _ in chip_cpus if cpu_id not in cpus]
+        else:
+            chips = sorted(set(chip for _, _, chip in topology))
+            if len(chips) < 2:
+                return None
+            per_chip = [[cpu_id for cpu_id, _, chip in topology
+                         if chip == chip_id] for chip_id in chips]
+            cpus = [cpu_id for group in zip(*per_chip) for cpu_id in group]
+        if len(cpus) < count + 1:
+            return None
+        return cpus[:count + 1]
 
-    def run(self):
+    def run(self, entries, threads, cpus):
+        """
+        Run the tool once
 
+        :return: parsed result with the IPI deltas, or None
+        """
         tlbflush = os.path.join(self.workdir, 'tlbflush')
-
-        cmd = '%s -n %s -t %s' % (tlbflush, self.nr_entries, self.nr_threads)
-
+        cmd = '%s -n %s -t %s' % (tlbflush, entries, threads)
+        if cpus:
+            cpu_list = ','.join(str(cpu_id) for cpu_id in cpus)
+            cmd = 'taskset -c %s %s' % (cpu_list, cmd)
+        before = read_ipi_counts()
         out = process.system_output(cmd).decode("utf-8")
+        after = read_ipi_counts()
+        result = parse_result(out)
+        if result is None:
+            self.log.warning("Unexpected output of %s: %s", cmd, out)
+            return None
+        for name, count in after.items():
+            result['%s_ipis' % name] = count - before.get(name, 0)
+        return result
 
-        return out
+    @staticmethod
+    def summarize(runs, key):
+        values = [run[key] for run in runs if key in run]
+        if not values:
+            return None
+        mean = statistics.mean(values)
+        stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+        return {'mean': round(mean, 2), 'stdev': round(stdev, 2),
+                'cv_pct': round(100.0 * stdev / mean, 1) if mean else 0.0}
 
     def test(self):
+        """
+        Sweep flushed entries x thread count x thread placement and
+        report the per flush cost matrix with its variance and IPI counts
+        """
+        max_entries = int(self.tlbflush_max_entries)
+        entries_list = [int(val) for val in str(self.params.get(
+            'entries_list', default='')).split()]
+        if not entries_list:
+            # the upper bound of each of 8 sections up to max_entries
+            entries_list = sorted(set(
+                max(1, max_entries * section // 8)
+                for section in range(1, 9)))
+        threads_list = [int(val) for val in str(self.params.get(
+            'thread_counts', default=self.nr_threads)).split()]
+        placements = self.params.get(
+            'placements', default='none same_core same_chip '
+            'cross_socket').split()
+        repeats = int(self.params.get('repeats', default=5))
+
+        ipi_names = sorted(read_ipi_counts())
+        if ipi_names:
+            self.log.info("Counting IPIs from /proc/interrupts rows: %s",
+                          ', '.join(ipi_names))
+        else:
+            self.log.warning("No IPI row found in /proc/interrupts on %s, "
+                             "IPI counts are unavailable",
+                             os.uname()[4])
+
+        matrix = []
+        for placement in placements:
+            for threads in threads_list:
+                cpus = self.placement_cpus(placement, threads)
+                if cpus is None:
+                    self.log.info("Skipping %s with %d threads, not enough "
+                                  "CPUs", placement, threads)
+                    continue
+                for entries in entries_list:
+                    runs = [run for run in (
+                        self.run(entries, threads, cpus)
+                        for _ in range(repeats)) if run]
+                    if not runs:
+                        continue
+                    munmaps = PAGES // entries
+                    for run in runs:
+                        run['flush_ns_per_entry'] = \
+                            float(run['munmap_ns']) / entries
+                        for name in ipi_names:
+                            if '%s_ipis' % name not in run:
+                                continue
+                            run['%s_ipis_per_munmap' % name] = \
+                                float(run['%s_ipis' % name]) / munmaps
+                    cell = {'placement': placement, 'threads': threads,
+                            'entries': entries, 'cpus': cpus,
+                            'runs': len(runs)}
+                    keys = ['munmap_ns', 'flush_ns_per_entry', 'access_ns']
+                    for name in ipi_names:
+                        keys += ['%s_ipis' % name,
+                                 '%s_ipis_per_munmap' % name]
+                    for key in keys:
+                        summary = self.summarize(runs, key)
+                        if summary:
+                            cell[key] = summary
+                    matrix.append(cell)
+                    self.log.info("%-12s %4d thr %5d entries: %8.1f ns/munmap"
+                                  " (cv %4.1f%%), %7.1f ns/entry, IPIs/"
+                                  "munmap %s", placement, threads, entries,
+                                  cell['munmap_ns']['mean'],
+                                  cell['munmap_ns']['cv_pct'],
+                                  cell['flush_ns_per_entry']['mean'],
+                                  ', '.join('%s %.2f' % (name, cell[
+                                      '%s_ipis_per_munmap' % name]['mean'])
+                                      for name in ipi_names
+                                      if '%s_ipis_per_munmap' % name in cell)
+                                  or 'n/a')
 
-        # call test function
-        self.set_value()
+        with open(os.path.join(self.logdir, 'tlbflush_matrix.json'),
+                  'w') as result_fd:
+            json.dump(matrix, result_fd, indent=4)
+        self.whiteboard = json.dumps(matrix)
+        if not matrix:
+            self.fail("No tlbflush run produced a result")
@@ -22,6 +22,7 @@ import shutil
 import pathlib
 import csv
 import glob
+import json
 from sys import version_info
 
 from avocado import Test
@@ -177,6 +178,175 @@ class WillItScaleTest(Test):
             import traceback
             self.log.debug(traceback.format_exc())
 
+    @staticmethod
+    def load_csv_columns(csv_file):
+        """
+        Load a will-it-scale CSV file into columnar arrays.
+
+        Row 0 (tasks=0) is the idle baseline emitted by runtest.py and is
+        dropped, along with any row that can not be parsed.
+
+        :param csv_file: path of the CSV file generated by runtest.py
+        :return: dict mapping each CSV column to a list of floats, sorted
+                 by task count
+        """
+        columns = {'tasks': [], 'processes': [], 'processes_idle': [],
+                   'threads': [], 'threads_idle': [], 'linear': []}
+        with open(csv_file, 'r') as f:
+            for row in csv.DictReader(f):
+                try:
+                    values = {key: float(row[key]) for key in columns}
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if values['tasks'] <= 0:
+                    continue
+                for key, value in values.items():
+                    columns[key].append(value)
+        order = sorted(range(len(columns['tasks'])),
+                       key=lambda idx: columns['tasks'][idx])
+        return {key: [values[idx] for idx in order]
+                for key, values in columns.items()}
+
+    def fit_scaling_curve(self, tasks, ops):
+        """
+        Fit a scaling curve and locate its saturation knee and collapse.
+
+        Efficiency at each point is the measured throughput relative to
+        perfect linear scaling of the single task result. The knee is the
+        last task count before efficiency falls below ``knee_efficiency``,
+        the collapse is the first task count past the peak where
+        throughput drops below ``collapse_ratio`` of the peak.
+
+        :param tasks: list of task counts
+        :param ops: list of ops/sec measured at each task count
+        :return: dict describing the curve, or None if there is no data
+        """
+        if not tasks or not ops or ops[0] <= 0:
+            return None
+        single = ops[0] / tasks[0]
+        efficiency = [op / (single * task) for task, op in zip(tasks, ops)]
+        peak_idx = max(range(len(ops)), key=lambda idx: ops[idx])
+
+        knee = int(tasks[-1])
+        for idx, eff in enumerate(efficiency):
+            if eff < self.knee_efficiency:
+                knee = int(tasks[max(idx - 1, 0)])
+                break
+
+        collapse = None
+        for idx in range(peak_idx + 1, len(ops)):
+            if ops[idx] < ops[peak_idx] * self.collapse_ratio:
+                collapse = int(tasks[idx])
+                break
+
+        return {'tasks': [int(task) for task in tasks],
+                'ops': ops,
+                'efficiency': [round(eff, 4) for eff in efficiency],
+                'peak_ops': ops[peak_idx],
+                'peak_tasks': int(tasks[peak_idx]),
+                'knee_tasks': knee,
+                'collapse_tasks': collapse}
+
+    def analyze_scaling(self, csv_file):
+        """
+        Build the process and thread scaling curves for one testcase.
+
+        :param csv_file: path of the CSV file generated by runtest.py
+        :return: dict with 'processes' and 'threads' curves
+        """
+        columns = self.load_csv_columns(csv_file)
+        analysis = {}
+        for mode in ('processes', 'threads'):
+            curve = self.fit_scaling_curve(columns['tasks'], columns[mode])
+            if curve is None:
+                self.log.warning(f"No {mode} data in {csv_file}")
+                continue
+            analysis[mode] = curve
+            collapse = curve['collapse_tasks']
+            self.log.info(
+                f"{mode:<10} peak {curve['peak_ops']:,.0f} ops/sec @ "
+                f"{curve['peak_tasks']} tasks, knee @ "
+                f"{curve['knee_tasks']} tasks, collapse @ "
+                f"{collapse if collapse is not None else 'none'}")
+        return analysis
+
+    def compare_with_baseline(self, report, baseline):
+        """
+        Compare the scaling report of this run against a stored baseline.
+
+        :param report: dict of testcase -> analysis for this run
+        :param baseline: dict of testcase -> analysis of the baseline run
+        :return: list of regression messages
+        """
+        regressions = []
+        for test_name, analysis in report.items():
+            if test_name not in baseline:
+                self.log.info(f"{test_name}: not present in baseline")
+                continue
+            for mode, curve in analysis.items():
+                base = baseline[test_name].get(mode)
+                if not base:
+                    continue
+                if curve['knee_tasks'] < base['knee_tasks']:
+                    regressions.append(
+                        f"{test_name}/{mode}: knee moved left from "
+                        f"{base['knee_tasks']} to {curve['knee_tasks']} "
+                        f"tasks")
+                if (curve['collapse_tasks'] is not None and
+                        (base['collapse_tasks'] is None or
+                         curve['collapse_tasks'] < base['collapse_tasks'])):
+                    regressions.append(
+                        f"{test_name}/{mode}: throughput collapses at "
+                        f"{curve['collapse_tasks']} tasks (baseline: "
+                        f"{base['collapse_tasks']})")
+                base_eff = dict(zip(base['tasks'], base['efficiency']))
+                for task, eff in zip(curve['tasks'], curve['efficiency']):
+                    if task in base_eff:
+                        self.log.debug(
+                            f"{test_name}/{mode} @ {task} tasks: "
+                            f"efficiency {eff:.2%} "
+                            f"(baseline {base_eff[task]:.2%})")
+        return regressions
+
+    def report_scaling(self, csv_files, results_dir):
+        """
+        Analyze every generated CSV, save the scaling report and compare it
+        against the baseline report when one is given.
+        """
+        report = {}
+        for csv_file in csv_files:
+            test_name = os.path.basename(csv_file).replace('.csv', '')
+            self.log.info(f"Scaling analysis: {test_name}")
+            try:
+                analysis = self.analyze_scaling(csv_file)
+            except OSError as e:
+                self.log.warning(f"Failed to analyze {csv_file}: {e}")
+                continue
+            if analysis:
+                report[test_name] = analysis
+
+        report_file = os.path.join(results_dir, 'scaling_report.json')
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=4)
+        self.log.info(f"Scaling report saved to {report_file}")
+
+        if not self.baseline:
+            return
+        if not os.path.exists(self.baseline):
+            self.log.warning(f"Baseline report {self.baseline} not found")
+            return
+        with open(self.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = self.compare_with_baseline(report, baseline)
+        for msg in regressions:
+            self.log.warning(f"Scaling regression: {msg}")
+        if regressions:
+            msg = (f"{len(regressions)} scaling regression(s) against "
+                   f"{self.baseline}, see debug log")
+            if self.fail_on_regression:
+                self.fail(msg)
+            self.log.warning(msg)
+
     def run_cmd(self, cmd):
         if process.system(cmd, ignore_status=True, sudo=True, shell=True):
             self.fail_cmd.append(cmd)
@@ -235,6 +405,13 @@ class WillItScaleTest(Test):
 
         self.postprocess = self.params.get('postprocess', default=True)
         self.testcase = self.params.get('name', default='brk1')
+        self.knee_efficiency = float(self.params.get('knee_efficiency',
+                                                     default=0.8))
+        self.collapse_ratio = float(self.params.get('collapse_ratio',
+                                                    default=0.9))
+        self.baseline = self.params.get('baseline', default=None)
+        self.fail_on_regression = self.params.get('fail_on_regression',
+                                                  default=False)
         url = self.params.get(
             'willit_url', default='https://github.com/antonblanchard/'
             'will-it-scale/archive/refs/heads/master.zip')
@@ -317,3 +494,7 @@ class WillItScaleTest(Test):
             for html_file in html_files:
                 shutil.copy(html_file, results_dir)
                 self.log.info(f"Copied {html_file} to {results_dir}")
+
+        # Fit scaling curves and compare them against the baseline run
+        self.report_scaling(glob.glob(os.path.join(results_dir, "*.csv")),
+                            results_dir)
@@ -17,33 +17,63 @@
 
 
 import os
+import re
+import json
 from avocado import Test
 from avocado.utils import build
 from avocado.utils import archive
 from avocado.utils import process
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import distro
+from mm_telemetry.telemetry import MemTelemetry
 
 
 class AutoNuma(Test):
 
+    @staticmethod
+    def read_vmstat(counter):
+        """
+        Returns the current value of a /proc/vmstat counter as an integer.
+        """
+        with open('/proc/vmstat') as vmstat:
+            for line in vmstat:
+                name, value = line.split()
+                if name == counter:
+                    return int(value)
+        return 0
+
     def count_numa_pte_updates(self):
         """
         This function retrieves the current value of numa_pte_updates
         from /proc/vmstat and returns it as an integer.
         """
-        cmd = 'cat /proc/vmstat  | grep numa_pte_updates'
-        output = process.run(cmd, shell=True).stdout_text
-        return int(output.split()[-1])
+        return self.read_vmstat('numa_pte_updates')
 
     def count_numa_hint_faults(self):
         """
         This function fetches the current value of numa_hint_faults from
         /proc/vmstat and returns it as an integer.
         """
-        cmd = 'cat /proc/vmstat  | grep numa_hint_faults | head -1'
-        output = process.run(cmd, shell=True).stdout_text
-        return int(output.split()[-1])
+        return self.read_vmstat('numa_hint_faults')
+
+    def run_with_telemetry(self, cmd, name):
+        """
+        Run a workload with the memory telemetry sidecar sampling in the
+        background, log the rate summary and save the time series.
+        """
+        telemetry = MemTelemetry(interval=self.telemetry_interval)
+        telemetry.start()
+        try:
+            process.run(cmd, shell=True)
+        finally:
+            telemetry.stop()
+        for metric, rates in telemetry.summary().items():
+            if rates['total']:
+                self.log.info("%s: %s mean %.1f peak %.1f", name, metric,
+                              rates['mean'], rates['peak'])
+        telemetry.save(os.path.join(self.logdir,
+                                    '%s_telemetry.json' % name))
+        return telemetry
 
     def setUp(self):
         """
@@ -59,6 +89,8 @@ class AutoNuma(Test):
         for packages in deps:
             if not smm.check_installed(packages) and not smm.install(packages):
                 self.cancel('%s is needed for the test to be run' % packages)
+        self.telemetry_interval = self.params.get('telemetry_interval',
+                                                  default=0.5)
         self.url = self.params.get('ebizzy_url',
                                    default='https://sourceforge.net/projects/ebizzy/files/ebizzy/0.3/ebizzy-0.3.tar.gz')
         tarball = self.fetch_asset("ebizzy-0.3.tar.gz", locations=[self.url], expire='7d')
@@ -84,13 +116,13 @@ class AutoNuma(Test):
         init_pte_updates = self.count_numa_pte_updates()
         init_hint_faults = self.count_numa_hint_faults()
         process.run('echo "0" > /proc/sys/kernel/numa_balancing', shell=True)
-        process.run('./ebizzy', shell=True)
+        self.run_with_telemetry('./ebizzy', 'numa_balancing_off')
         pte_updates_0 = self.count_numa_pte_updates()
         hint_faults_0 = self.count_numa_hint_faults()
         if(pte_updates_0 - init_pte_updates) or (hint_faults_0 - init_hint_faults):
             self.fail("Numa balancing disable test failed")
         process.run('echo "1" > /proc/sys/kernel/numa_balancing', shell=True)
-        process.run('./ebizzy', shell=True)
+        self.run_with_telemetry('./ebizzy', 'numa_balancing_on')
         pte_updates_1 = self.count_numa_pte_updates()
         hint_faults_1 = self.count_numa_hint_faults()
         if(pte_updates_1 - init_pte_updates) < 10:
@@ -100,16 +132,144 @@ class AutoNuma(Test):
             self.fail("numa_hint_faults has not incremented even after"
                       " running workload with numa balancing enabled.")
 
+    def parse_benchmark_output(self, output):
+        """
+        Parse per-test runtimes in seconds out of the start_bench.sh output.
+        The last value reported for a test wins.
+        """
+        runtimes = {}
+        pattern = re.compile(self.result_regex, re.MULTILINE)
+        for match in pattern.finditer(output):
+            runtimes[match.group(1)] = float(match.group(2))
+        return runtimes
+
+    @staticmethod
+    def convergence_time(telemetry, fraction=0.9):
+        """
+        Time in seconds until fraction of all NUMA page migrations of the
+        run had happened, None when nothing was migrated.
+        """
+        series = telemetry.series('vmstat:numa_pages_migrated')
+        if not series:
+            return None
+        total = series[-1][1] - series[0][1]
+        if total <= 0:
+            return None
+        for stamp, value in series:
+            if value - series[0][1] >= fraction * total:
+                return stamp
+        return series[-1][0]
+
+    def run_benchmark(self, balancing):
+        """
+        Run start_bench.sh with numa_balancing set to balancing and return
+        the parsed runtimes and placement convergence metrics.
+        """
+        process.run('echo "%s" > /proc/sys/kernel/numa_balancing' %
+                    balancing, shell=True)
+        name = 'autonuma_benchmark_balancing_%s' % balancing
+        telemetry = MemTelemetry(interval=self.telemetry_interval,
+                                 sources=('vmstat', 'numastat'))
+        telemetry.start()
+        try:
+            output = process.run('./start_bench.sh %s' % self.bench_args,
+                                 shell=True, ignore_status=True).stdout_text
+        finally:
+            telemetry.stop()
+        with open(os.path.join(self.logdir, '%s.log' % name), 'w') as log:
+            log.write(output)
+        telemetry.save(os.path.join(self.logdir, '%s_telemetry.json' % name))
+        summary = telemetry.summary()
+        result = {'runtimes': self.parse_benchmark_output(output),
+                  'convergence_time': self.convergence_time(telemetry),
+                  'numa_pages_migrated':
+                  telemetry.delta('vmstat:numa_pages_migrated'),
+                  'rates': summary}
+        for test_name, runtime in sorted(result['runtimes'].items()):
+            self.log.info("numa_balancing=%s %s: %.2f s", balancing,
+                          test_name, runtime)
+        self.log.info("numa_balancing=%s: %d pages migrated, placement "
+                      "converged after %s s", balancing,
+                      result['numa_pages_migrated'],
+                      result['convergence_time'])
+        return result
+
+    def compare_runtimes(self, current, reference, threshold, label):
+        """
+        List the tests that are more than threshold percent slower in
+        current than in reference.
+        """
+        regressions = []
+        for test_name, runtime in sorted(current.items()):
+            ref = reference.get(test_name)
+            if not ref:
+                continue
+            change = 100.0 * (runtime - ref) / ref
+            self.log.info("%s %s: %.2f s vs %.2f s (%+.1f%%)", label,
+                          test_name, runtime, ref, change)
+            if change > threshold:
+                regressions.append("%s %s: %.2f s vs %.2f s (%+.1f%%)" %
+                                   (label, test_name, runtime, ref, change))
+        return regressions
+
     def test_autonuma_benchmark(self):
         """
-        This test case runs downloading, extracting, and running the autonuma-benchmark tests,
-        Test results need to be verified manually.
+        This test case runs downloading, extracting, and running the
+        autonuma-benchmark tests with NUMA balancing enabled and disabled.
+        Per-test runtimes are compared between the two runs and against a
+        stored baseline, the test fails when balancing loses or regresses.
         """
         url_autonuma = self.params.get('url_autonuma',
                                        default='https://github.com/pholasek/autonuma-benchmark/archive/refs/heads/master.zip')
+        self.bench_args = self.params.get('bench_args', default='-A')
+        self.result_regex = self.params.get(
+            'result_regex',
+            default=r'^\s*(numa\w+)\s*[:=]?\s+(\d+(?:\.\d+)?)')
+        compare_balancing = self.params.get('compare_balancing', default=True)
+        balancing_tolerance = float(self.params.get('balancing_tolerance',
+                                                    default=0))
+        baseline = self.params.get('baseline', default=None)
+        regression_threshold = float(self.params.get('regression_threshold',
+                                                     default=10))
         tarball = self.fetch_asset("master.zip", locations=[url_autonuma], expire='7d')
         archive.extract(tarball, self.workdir)
         self.sourcedir = os.path.join(self.workdir, "autonuma-benchmark-master")
         os.chdir(self.sourcedir)
-        process.system_output('./start_bench.sh -A', shell=True, ignore_status=True)
-        self.log.warn("Have run the tests please review the results in debug.log")
+        with open('/proc/sys/kernel/numa_balancing') as balancing_fd:
+            orig_balancing = balancing_fd.read().strip()
+        results = {}
+        try:
+            results['on'] = self.run_benchmark(1)
+            if compare_balancing:
+                results['off'] = self.run_benchmark(0)
+        finally:
+            process.run('echo "%s" > /proc/sys/kernel/numa_balancing' %
+                        orig_balancing, shell=True)
+        with open(os.path.join(self.logdir, 'autonuma_results.json'),
+                  'w') as result_fd:
+            json.dump(results, result_fd, indent=4)
+
+        if not results['on']['runtimes']:
+            self.fail("Could not parse autonuma-benchmark results, check "
+                      "result_regex against the output in %s" % self.logdir)
+        failures = []
+        if 'off' in results:
+            failures.extend(self.compare_runtimes(
+                results['on']['runtimes'], results['off']['runtimes'],
+                balancing_tolerance, 'balancing on vs off'))
+        if baseline:
+            if not os.path.exists(baseline):
+                self.log.warning("Baseline %s not found", baseline)
+            else:
+                with open(baseline) as baseline_fd:
+                    reference = json.load(baseline_fd)
+                for state, result in results.items():
+                    if state in reference:
+                        failures.extend(self.compare_runtimes(
+                            result['runtimes'],
+                            reference[state]['runtimes'],
+                            regression_threshold,
+                            'balancing %s vs baseline' % state))
+        if failures:
+            self.fail("autonuma-benchmark regressions: %s" %
+                      "; ".join(failures))
@@ -13,22 +13,247 @@
 # Copyright: 2017 IBM
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
+import bisect
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
 import time
 import getpass
+from queue import Empty
 from avocado import Test
 from avocado.utils import process
 from avocado.utils import memory
 from avocado.utils import distro
+from avocado.utils import wait
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# Latency histogram resolution: buckets are exp(index / _BUCKET_SCALE) us
+_BUCKET_SCALE = 50.0
+
+
+class MemcacheLoad(object):
+
+    """
+    Multi-connection memcached load generator speaking the text protocol.
+
+    Every connection runs in its own process and sends batches of
+    ``pipeline`` requests, a ``get_ratio`` share of them gets and the rest
+    sets. Keys are drawn uniformly or from a zipf distribution over
+    ``key_count`` keys, values are ``value_min`` to ``value_max`` bytes.
+    Each request is charged the round trip time of its batch, and
+    latencies are kept in log-scale histograms so that percentiles can be
+    merged across connections.
+    """
+
+    def __init__(self, host, port, key_count=100000, key_dist='uniform',
+                 zipf_s=0.99, value_min=100, value_max=100, get_ratio=0.9,
+                 pipeline=1):
+        self.host = host
+        self.port = int(port)
+        self.key_count = int(key_count)
+        self.key_dist = key_dist
+        self.zipf_s = float(zipf_s)
+        self.value_min = int(value_min)
+        self.value_max = int(value_max)
+        self.get_ratio = float(get_ratio)
+        self.pipeline = int(pipeline)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _key_sampler(self, rng):
+        if self.key_dist != 'zipf':
+            return lambda: rng.randrange(self.key_count)
+        cdf = []
+        total = 0.0
+        for rank in range(1, self.key_count + 1):
+            total += 1.0 / rank ** self.zipf_s
+            cdf.append(total)
+        return lambda: bisect.bisect_left(cdf, rng.random() * total)
+
+    def _value(self, rng):
+        return b'x' * rng.randint(self.value_min, self.value_max)
+
+    @staticmethod
+    def _read_responses(sock, buf, requests):
+        """
+        Consume one response per request: a single line for set, lines up
+        to END for get (skipping the value payloads).
+        """
+        errors = 0
+        for request in requests:
+            while True:
+                end = buf.find(b'\r\n')
+                while end < 0:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        raise ConnectionError("memcached closed connection")
+                    buf.extend(chunk)
+                    end = buf.find(b'\r\n')
+                line = bytes(buf[:end])
+                if line.startswith(b'VALUE '):
+                    size = int(line.split()[3])
+                    need = end + 2 + size + 2
+                    while len(buf) < need:
+                        chunk = sock.recv(65536)
+                        if not chunk:
+                            raise ConnectionError(
+                                "memcached closed connection")
+                        buf.extend(chunk)
+                    del buf[:need]
+                    continue
+                del buf[:end + 2]
+                if request == 'set':
+                    errors += line != b'STORED'
+                    break
+                if line == b'END':
+                    break
+                errors += 1
+                break
+        return errors
+
+    def preload(self):
+        """
+        Store every key once so that gets hit.
+        """
+        rng = random.Random(0)
+        sock = self._connect()
+        buf = bytearray()
+        try:
+            batch = 100
+            for first in range(0, self.key_count, batch):
+                keys = range(first, min(first + batch, self.key_count))
+                payload = b''.join(
+                    b'set key%d 0 0 %d\r\n%s\r\n' % (key, len(value), value)
+                    for key, value in ((key, self._value(rng))
+                                       for key in keys))
+                sock.sendall(payload)
+                self._read_responses(sock, buf, ['set'] * len(keys))
+        finally:
+            sock.close()
+
+    def _worker(self, seed, duration, queue):
+        rng = random.Random(seed)
+        next_key = self._key_sampler(rng)
+        hist = {}
+        ops = errors = 0
+        try:
+            sock = self._connect()
+        except OSError as details:
+            queue.put((0, 0, {}, "connect: %s" % details))
+            return
+        buf = bytearray()
+        try:
+            end_time = time.monotonic() + duration
+            while time.monotonic() < end_time:
+                requests = []
+                payload = []
+                for _ in range(self.pipeline):
+                    key = next_key()
+                    if rng.random() < self.get_ratio:
+                        requests.append('get')
+                        payload.append(b'get key%d\r\n' % key)
+                    else:
+                        value = self._value(rng)
+                        requests.append('set')
+                        payload.append(b'set key%d 0 0 %d\r\n%s\r\n' %
+                                       (key, len(value), value))
+                start = time.monotonic()
+                sock.sendall(b''.join(payload))
+                errors += self._read_responses(sock, buf, requests)
+                latency = (time.monotonic() - start) * 1e6
+                bucket = int(math.log(max(latency, 1.0)) * _BUCKET_SCALE)
+                hist[bucket] = hist.get(bucket, 0) + len(requests)
+                ops += len(requests)
+        except (OSError, ValueError) as details:
+            # always answer, run() waits for one result per worker
+            queue.put((ops, errors, hist, str(details)))
+            return
+        finally:
+            sock.close()
+        queue.put((ops, errors, hist, None))
+
+    @staticmethod
+    def percentile(hist, pct):
+        """
+        Latency in microseconds at percentile pct of a merged histogram.
+        """
+        total = sum(hist.values())
+        if not total:
+            return 0.0
+        threshold = total * pct / 100.0
+        seen = 0
+        for bucket in sorted(hist):
+            seen += hist[bucket]
+            if seen >= threshold:
+                return math.exp((bucket + 0.5) / _BUCKET_SCALE)
+        return math.exp((max(hist) + 0.5) / _BUCKET_SCALE)
+
+    def run(self, connections, duration):
+        """
+        Drive the server with the given number of connections.
+
+        :return: dict with ops/s, errors and p50/p99/p999 latency in us
+        :raises ConnectionError: when a connection failed or a worker
+                                 died without reporting
+        """
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=self._worker,
+                                           args=(seed, duration, queue))
+                   for seed in range(connections)]
+        start = time.monotonic()
+        for worker in workers:
+            worker.start()
+        results = []
+        try:
+            for _ in workers:
+                results.append(queue.get(timeout=duration + 60))
+        except Empty:
+            dead = [worker.exitcode for worker in workers
+                    if worker.exitcode]
+            raise ConnectionError("%d of %d load workers did not report, "
+                                  "exit codes %s" % (len(workers) -
+                                                     len(results),
+                                                     len(workers), dead))
+        finally:
+            elapsed = time.monotonic() - start
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        failed = [result[3] for result in results if result[3]]
+        if failed:
+            raise ConnectionError("%d of %d connections failed: %s" %
+                                  (len(failed), len(workers), failed[0]))
+        hist = {}
+        for _, _, worker_hist, _ in results:
+            for bucket, count in worker_hist.items():
+                hist[bucket] = hist.get(bucket, 0) + count
+        ops = sum(result[0] for result in results)
+        return {'connections': connections,
+                'ops': ops,
+                'ops_per_sec': ops / elapsed,
+                'errors': sum(result[1] for result in results),
+                'p50_us': self.percentile(hist, 50),
+                'p99_us': self.percentile(hist, 99),
+                'p999_us': self.percentile(hist, 99.9)}
+
 
 class Memcached(Test):
 
     """
     Memcached - High performance memory object caching system.
     This test Runs the memcached server in the background, based
-    upon the memory param given. And it tries to run the memcslap
-    stress tool which generates a load against memcached server.
+    upon the memory param given. And it loads it either with the
+    built-in multi-connection load generator, reporting ops/s and
+    p50/p99/p999 latency per connection count, or with the memcslap
+    stress tool.
     For more options on memcached:
     Refer - https://linux.die.net/man/1/memcached
 
@@ -64,9 +289,26 @@ class Memcached(Test):
                                         default=memory.meminfo.MemFree.m)
         port_no = self.params.get("port_no", default='12111')
         memcached_args = self.params.get('memcached_args', default='')
-        self.memcached_cmd = 'memcached -u %s -p %s -m %d  %s &'\
-                             % (getpass.getuser(), port_no, memory_to_use,
-                                memcached_args)
+        server_threads = self.params.get('server_threads', default=None)
+        if server_threads:
+            memcached_args = '%s -t %s' % (memcached_args, server_threads)
+        # Pin the server across NUMA nodes: "interleave" spreads threads
+        # and memory over all nodes, a node list binds to those nodes
+        numa_nodes = self.params.get('numa_nodes', default=None)
+        numa_prefix = ''
+        if numa_nodes:
+            if not smm.check_installed('numactl') and \
+                    not smm.install('numactl'):
+                self.cancel('numactl is needed to pin memcached')
+            if numa_nodes == 'interleave':
+                numa_prefix = 'numactl --interleave=all --cpunodebind=all '
+            else:
+                numa_prefix = 'numactl --cpunodebind=%s --membind=%s ' % (
+                    numa_nodes, numa_nodes)
+        self.memcached_cmd = '%smemcached -u %s -p %s -m %d  %s &'\
+                             % (numa_prefix, getpass.getuser(), port_no,
+                                memory_to_use, memcached_args)
+        self.port_no = port_no
 
         # Memcached stress tool required Args
         # For more options : memcslap --help
@@ -75,6 +317,21 @@ class Memcached(Test):
         concurrency = self.params.get('concurrency', default='100')
         stress_tool_args = self.params.get('stress_tool_args', default='')
 
+        self.system_ip = system_ip
+        self.load_driver = self.params.get('load_driver', default='builtin')
+        self.connections = self.params.get('connections',
+                                           default=[1, 8, 32, 128])
+        self.duration = float(self.params.get('duration', default=10))
+        self.load = MemcacheLoad(
+            system_ip, port_no,
+            key_count=self.params.get('key_count', default=100000),
+            key_dist=self.params.get('key_dist', default='uniform'),
+            zipf_s=self.params.get('zipf_s', default=0.99),
+            value_min=self.params.get('value_min', default=100),
+            value_max=self.params.get('value_max', default=100),
+            get_ratio=self.params.get('get_ratio', default=0.9),
+            pipeline=self.params.get('pipeline', default=1))
+
         self.stress_tool_cmd = '%s -s %s:%s --test %s --verbose '\
                                '--concurrency %s %s' % (stress_tool,
                                                         system_ip, port_no,
@@ -92,14 +349,18 @@ class Memcached(Test):
                     verbose=True, ignore_bg_processes=True)
 
         # Giving some time for server to start properly
-        self.log.info('Sleeping for 5 seconds for server startup')
-        time.sleep(5)
+        self.log.info('Waiting for memcached to accept connections')
+        wait.wait_for(self.server_ready, timeout=30, step=0.2)
 
         if process.system('pgrep memcached', verbose=False,
                           ignore_status=True):
             self.fail('Memcached Server not Running\n'
                       'Cmd "%s" Failed' % self.memcached_cmd)
 
+        if self.load_driver == 'builtin':
+            self.run_builtin_load()
+            return
+
         self.log.info("Memcached started successfully !! Running Stress tool")
 
         if (process.system(self.stress_tool_cmd, verbose=True,
@@ -107,6 +368,51 @@ class Memcached(Test):
             self.fail('Stress tool fails to load memcached server'
                       'Cmd "%s" Failed' % self.stress_tool_cmd)
 
+    def server_ready(self):
+        """
+        True once memcached accepts connections.
+        """
+        try:
+            socket.create_connection((self.system_ip, int(self.port_no)),
+                                     timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    def run_builtin_load(self):
+        """
+        Preload the key space, then drive memcached with the built-in load
+        generator for every connection count and report throughput and
+        tail latency.
+        """
+        self.log.info("Memcached started successfully !! Preloading %d keys",
+                      self.load.key_count)
+        self.load.preload()
+        results = []
+        self.log.info("%-12s %12s %10s %10s %10s %8s", "connections",
+                      "ops/s", "p50(us)", "p99(us)", "p999(us)", "errors")
+        for connections in self.connections:
+            try:
+                result = self.load.run(int(connections), self.duration)
+            except ConnectionError as details:
+                self.fail("Load with %s connections failed: %s" %
+                          (connections, details))
+            results.append(result)
+            self.log.info("%-12d %12.0f %10.1f %10.1f %10.1f %8d",
+                          result['connections'], result['ops_per_sec'],
+                          result['p50_us'], result['p99_us'],
+                          result['p999_us'], result['errors'])
+        with open(os.path.join(self.logdir, 'memcached_load.json'),
+                  'w') as result_fd:
+            json.dump({'server': self.memcached_cmd,
+                       'get_ratio': self.load.get_ratio,
+                       'key_dist': self.load.key_dist,
+                       'pipeline': self.load.pipeline,
+                       'results': results}, result_fd, indent=4)
+        if any(result['errors'] for result in results):
+            self.fail('memcached returned errors under load, see %s' %
+                      os.path.join(self.logdir, 'memcached_load.json'))
+
     def tearDown(self):
         """
         Kills the memcached which is running background
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2025 IBM
+
+"""
+Memory management telemetry sidecar for the memory tests.
+
+MemTelemetry polls /proc/vmstat, /proc/meminfo, the per-node numastat and
+meminfo files, /proc/buddyinfo and /proc/pagetypeinfo from a background
+thread while a test runs. The files are kept open and re-read in place,
+so sampling does not spawn any process.
+
+Counters are stored delta-encoded: the first sample is kept in full and
+every following sample only records the counters that changed since the
+previous one. Time series and rates can be rebuilt for any counter.
+
+Usage::
+
+    from mm_telemetry.telemetry import MemTelemetry
+
+    telemetry = MemTelemetry(interval=0.5)
+    telemetry.start()
+    ... run the workload ...
+    telemetry.stop()
+    self.log.info(telemetry.summary())
+    telemetry.save(os.path.join(self.logdir, 'telemetry.json'))
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+__all__ = ['MemTelemetry', 'RATE_KEYS']
+
+# Counters summarized as per-second rates
+RATE_KEYS = {
+    'faults/s': ['vmstat:pgfault'],
+    'major_faults/s': ['vmstat:pgmajfault'],
+    'numa_hint_faults/s': ['vmstat:numa_hint_faults'],
+    'numa_pte_updates/s': ['vmstat:numa_pte_updates'],
+    'numa_migrations/s': ['vmstat:numa_pages_migrated'],
+    'migrations/s': ['vmstat:pgmigrate_success'],
+    'migration_failures/s': ['vmstat:pgmigrate_fail'],
+    'compaction_stalls/s': ['vmstat:compact_stall'],
+    'compaction_success/s': ['vmstat:compact_success'],
+    'compaction_fail/s': ['vmstat:compact_fail'],
+    'thp_fault_alloc/s': ['vmstat:thp_fault_alloc'],
+    'thp_collapse_alloc/s': ['vmstat:thp_collapse_alloc'],
+    'thp_split/s': ['vmstat:thp_split_page'],
+    'kswapd_scan/s': ['vmstat:pgscan_kswapd'],
+    'direct_scan/s': ['vmstat:pgscan_direct'],
+    'reclaimed/s': ['vmstat:pgsteal_kswapd', 'vmstat:pgsteal_direct'],
+}
+
+
+def _parse_key_value(text, prefix):
+    """
+    Parse "key value" lines (vmstat, numastat).
+    """
+    values = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            try:
+                values['%s:%s' % (prefix, fields[0])] = int(fields[1])
+            except ValueError:
+                continue
+    return values
+
+
+def _parse_meminfo(text, prefix):
+    """
+    Parse "Key: value [kB]" lines, including the "Node N Key: value kB"
+    layout of the per-node meminfo files.
+    """
+    values = {}
+    for line in text.splitlines():
+        key, _, rest = line.partition(':')
+        fields = rest.split()
+        if not fields:
+            continue
+        try:
+            values['%s:%s' % (prefix, key.split()[-1])] = int(fields[0])
+        except ValueError:
+            continue
+    return values
+
+
+def _parse_buddyinfo(text, prefix):
+    """
+    Parse /proc/buddyinfo into one counter per node, zone and order.
+    """
+    values = {}
+    for line in text.splitlines():
+        fields = line.replace(',', '').split()
+        if len(fields) < 5 or fields[0] != 'Node':
+            continue
+        for order, count in enumerate(fields[4:]):
+            values['%s:node%s:%s:%d' % (prefix, fields[1], fields[3],
+                                        order)] = int(count)
+    return values
+
+
+def _parse_pagetypeinfo(text, prefix):
+    """
+    Parse the free pages per migrate type section of /proc/pagetypeinfo.
+    """
+    values = {}
+    for line in text.splitlines():
+        if not line.startswith('Node') or 'type' not in line:
+            continue
+        head, _, counts = line.partition('type')
+        fields = head.replace(',', '').split()
+        counts = counts.split()
+        if len(fields) < 4 or len(counts) < 2:
+            continue
+        for order, count in enumerate(counts[1:]):
+            try:
+                values['%s:node%s:%s:%s:%d' % (prefix, fields[1], fields[3],
+                                               counts[0], order)] = int(count)
+            except ValueError:
+                break
+    return values
+
+
+class MemTelemetry(object):
+
+    """
+    Background sampler of memory management counters.
+
+    :param interval: seconds between two samples
+    :param sources: subset of 'vmstat', 'meminfo', 'numastat',
+                    'node_meminfo', 'buddyinfo' and 'pagetypeinfo',
+                    all of them by default
+    """
+
+    SOURCES = ('vmstat', 'meminfo', 'numastat', 'node_meminfo',
+               'buddyinfo', 'pagetypeinfo')
+
+    def __init__(self, interval=1.0, sources=None):
+        self.interval = float(interval)
+        self.sources = sources or self.SOURCES
+        self.base = {}
+        self.deltas = []
+        self._last = {}
+        self._files = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+
+    def _open_sources(self):
+        paths = []
+        if 'vmstat' in self.sources:
+            paths.append(('/proc/vmstat', 'vmstat', _parse_key_value))
+        if 'meminfo' in self.sources:
+            paths.append(('/proc/meminfo', 'meminfo', _parse_meminfo))
+        nodes = sorted(glob.glob('/sys/devices/system/node/node[0-9]*'))
+        for node in nodes:
+            name = os.path.basename(node)
+            if 'numastat' in self.sources:
+                paths.append((os.path.join(node, 'numastat'),
+                              '%s_numastat' % name, _parse_key_value))
+            if 'node_meminfo' in self.sources:
+                paths.append((os.path.join(node, 'meminfo'),
+                              '%s_meminfo' % name, _parse_meminfo))
+        if 'buddyinfo' in self.sources:
+            paths.append(('/proc/buddyinfo', 'buddyinfo', _parse_buddyinfo))
+        if 'pagetypeinfo' in self.sources:
+            paths.append(('/proc/pagetypeinfo', 'pagetypeinfo',
+                          _parse_pagetypeinfo))
+        for path, prefix, parser in paths:
+            try:
+                self._files.append((open(path, 'rb', buffering=0), prefix,
+                                    parser))
+            except OSError:
+                continue
+
+    def _close_sources(self):
+        for fd, _, _ in self._files:
+            fd.close()
+        self._files = []
+
+    def read(self):
+        """
+        Read every open source once.
+
+        :return: flat dict of "source:counter" -> value
+        """
+        values = {}
+        for fd, prefix, parser in self._files:
+            fd.seek(0)
+            chunks = []
+            chunk = fd.read(65536)
+            while chunk:
+                chunks.append(chunk)
+                chunk = fd.read(65536)
+            values.update(parser(b''.join(chunks).decode(), prefix))
+        return values
+
+    def _record(self):
+        stamp = time.time() - self._start_time
+        values = self.read()
+        if not self.base:
+            self.base = values
+            self._last = values
+            self.deltas.append((stamp, {}))
+            return
+        changed = {key: value - self._last.get(key, 0)
+                   for key, value in values.items()
+                   if value != self._last.get(key, 0)}
+        self.deltas.append((stamp, changed))
+        self._last = values
+
+    def _run(self):
+        self._record()
+        while not self._stop.wait(self.interval):
+            self._record()
+        self._record()
+
+    def start(self):
+        """
+        Start sampling in a background thread.
+        """
+        self.base = {}
+        self.deltas = []
+        self._last = {}
+        self._stop.clear()
+        self._open_sources()
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Take a last sample and stop the background thread.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._close_sources()
+
+    def keys(self):
+        return sorted(set(self.base) | set(self._last))
+
+    def series(self, key):
+        """
+        Rebuild the time series of one counter.
+
+        :return: list of (seconds since start, value)
+        """
+        value = self.base.get(key, 0)
+        points = []
+        for stamp, changed in self.deltas:
+            value += changed.get(key, 0)
+            points.append((stamp, value))
+        return points
+
+    def delta(self, key):
+        """
+        Total change of one counter over the sampling window.
+        """
+        return self._last.get(key, 0) - self.base.get(key, 0)
+
+    def rate_series(self, keys):
+        """
+        Per-interval rate of the sum of one or more counters.
+
+        :return: list of (seconds since start, rate per second)
+        """
+        rates = []
+        prev_stamp = None
+        for stamp, changed in self.deltas:
+            if prev_stamp is not None and stamp > prev_stamp:
+                total = sum(changed.get(key, 0) for key in keys)
+                rates.append((stamp, total / (stamp - prev_stamp)))
+            prev_stamp = stamp
+        return rates
+
+    def duration(self):
+        if len(self.deltas) < 2:
+            return 0.0
+        return self.deltas[-1][0] - self.deltas[0][0]
+
+    def summary(self, rate_keys=None):
+        """
+        Mean and peak rates of the counters in rate_keys (RATE_KEYS by
+        default) that exist on this kernel.
+
+        :return: dict of name -> {'mean': rate/s, 'peak': rate/s,
+                 'total': change over the window}
+        """
+        rate_keys = rate_keys or RATE_KEYS
+        duration = self.duration()
+        result = {}
+        for name, keys in rate_keys.items():
+            keys = [key for key in keys if key in self.base]
+            if not keys:
+                continue
+            total = sum(self.delta(key) for key in keys)
+            rates = [rate for _, rate in self.rate_series(keys)]
+            result[name] = {'mean': total / duration if duration else 0.0,
+                            'peak': max(rates) if rates else 0.0,
+                            'total': total}
+        return result
+
+    def save(self, path):
+        """
+        Save the delta-encoded samples and the rate summary as JSON.
+        """
+        with open(path, 'w') as result_fd:
+            json.dump({'interval': self.interval,
+                       'base': self.base,
+                       'deltas': self.deltas,
+                       'summary': self.summary()}, result_fd)
@@ -22,6 +22,7 @@ from avocado.utils import process
 from avocado.utils import memory
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
+from mm_telemetry.telemetry import MemTelemetry
 
 
 THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
@@ -52,6 +53,8 @@ class Thp(Test):
         free_mem = self.params.get(
             "mem_size", default=memory.meminfo.MemFree.m)
         self.dd_timeout = self.params.get("dd_timeout", default=900)
+        self.telemetry_interval = self.params.get("telemetry_interval",
+                                                  default=1)
         self.thp_split = None
         try:
             memory.read_from_vmstat("thp_split_page")
@@ -93,12 +96,24 @@ class Thp(Test):
 
         if not self.count:
             self.cancel("Please pass valid value for mem_size in yaml file")
-        for iterator in range(self.count):
-            stress_cmd = 'dd if=/dev/zero of=%s/%d bs=%dM count=1'\
-                         % (self.mem_path, iterator, self.block_size)
-            if(process.system(stress_cmd, timeout=self.dd_timeout,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('dd command failed  %s' % stress_cmd)
+        telemetry = MemTelemetry(interval=self.telemetry_interval,
+                                 sources=('vmstat', 'meminfo', 'buddyinfo'))
+        telemetry.start()
+        try:
+            for iterator in range(self.count):
+                stress_cmd = 'dd if=/dev/zero of=%s/%d bs=%dM count=1'\
+                             % (self.mem_path, iterator, self.block_size)
+                if(process.system(stress_cmd, timeout=self.dd_timeout,
+                                  verbose=False, ignore_status=True,
+                                  shell=True)):
+                    self.fail('dd command failed  %s' % stress_cmd)
+        finally:
+            telemetry.stop()
+            telemetry.save(os.path.join(self.logdir, 'thp_telemetry.json'))
+        for metric, rates in telemetry.summary().items():
+            if rates['total']:
+                self.log.info("%s mean %.1f peak %.1f", metric,
+                              rates['mean'], rates['peak'])
 
         # Read thp values after stressing the system
         thp_alloted_after = int(memory.read_from_vmstat("thp_fault_alloc"))
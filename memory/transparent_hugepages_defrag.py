@@ -16,8 +16,10 @@
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
 import os
+import json
 import time
 import mmap
+import ctypes
 import avocado
 from avocado import Test
 from avocado import skipIf, skipUnless
@@ -26,16 +28,151 @@ from avocado.utils import memory
 from avocado.utils import disk
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
+from mm_telemetry.telemetry import MemTelemetry
 
 
 THP_PATH = os.path.exists("/sys/kernel/mm/transparent_hugepage")
+EXTFRAG_PATH = "/sys/kernel/debug/extfrag/unusable_index"
+
+
+def unusable_index(order):
+    """
+    Unusable free space index for allocations of the given order.
+
+    Read from debugfs when available, otherwise computed from
+    /proc/buddyinfo the same way the kernel does: the fraction of free
+    memory that sits in blocks smaller than the requested order. The
+    worst zone is reported.
+    """
+    if os.path.exists(EXTFRAG_PATH):
+        worst = 0.0
+        with open(EXTFRAG_PATH) as extfrag:
+            for line in extfrag:
+                fields = line.split()
+                if len(fields) > 4 + order:
+                    worst = max(worst, float(fields[4 + order]))
+        return worst
+    worst = 0.0
+    with open("/proc/buddyinfo") as buddyinfo:
+        for line in buddyinfo:
+            counts = [int(val) for val in line.split()[4:]]
+            free = sum(cnt << idx for idx, cnt in enumerate(counts))
+            if not free:
+                continue
+            usable = sum(cnt << idx for idx, cnt in enumerate(counts)
+                         if idx >= order)
+            worst = max(worst, (free - usable) / free)
+    return worst
+
+
+def kcompactd_cpu_time():
+    """
+    Total CPU time in seconds consumed so far by the kcompactd threads.
+    """
+    ticks = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % pid) as stat:
+                fields = stat.read().rsplit(")", 1)
+            if "(kcompactd" not in fields[0]:
+                continue
+            values = fields[1].split()
+            # utime and stime are fields 14 and 15 of /proc/pid/stat
+            ticks += int(values[11]) + int(values[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def anon_hugepages_kb():
+    """
+    AnonHugePages of the current process in kB.
+    """
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith("AnonHugePages:"):
+                return int(line.split()[1])
+    return 0
+
+
+class MemFragmenter(object):
+
+    """
+    Fragment physical memory from a single process.
+
+    Anonymous memory is mapped chunk by chunk with THP disabled on it,
+    every page is touched, then all pages but one every ``stride`` pages
+    are released with MADV_DONTNEED. The pinned pages are spread over the
+    whole range, so the freed memory comes back in blocks smaller than a
+    hugepage.
+    """
+
+    def __init__(self, hugepage_size, stride=None, chunk_hugepages=256):
+        self.page_size = mmap.PAGESIZE
+        self.hugepage_size = hugepage_size
+        self.pages_per_hugepage = hugepage_size // self.page_size
+        self.stride = stride or self.pages_per_hugepage
+        self.chunk_size = chunk_hugepages * hugepage_size
+        self.regions = []
+
+    @staticmethod
+    def _address(region):
+        return ctypes.addressof(ctypes.c_char.from_buffer(region))
+
+    def add_chunk(self):
+        """
+        Map, touch and punch holes in one more chunk of memory.
+        """
+        # One extra hugepage so that blocks can be hugepage aligned
+        region = mmap.mmap(-1, self.chunk_size + self.hugepage_size,
+                           flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        region.madvise(mmap.MADV_NOHUGEPAGE)
+        offset = -self._address(region) % self.hugepage_size
+        for pos in range(0, len(region), self.page_size):
+            region[pos] = 1
+        keep = self.stride * self.page_size
+        for pos in range(offset, offset + self.chunk_size, keep):
+            start = pos + self.page_size
+            length = min(keep, len(region) - pos) - self.page_size
+            if length > 0:
+                region.madvise(mmap.MADV_DONTNEED, start, length)
+        region.madvise(mmap.MADV_DONTNEED, 0, offset)
+        self.regions.append((region, offset))
+        return self.chunk_size
+
+    def enable_thp(self, nr_hugepages):
+        """
+        Make the first nr_hugepages aligned blocks eligible for khugepaged
+        collapse.
+
+        :return: number of blocks enabled
+        """
+        enabled = 0
+        for region, offset in self.regions:
+            blocks = min(nr_hugepages - enabled,
+                         self.chunk_size // self.hugepage_size)
+            if blocks <= 0:
+                break
+            region.madvise(mmap.MADV_HUGEPAGE, offset,
+                           blocks * self.hugepage_size)
+            enabled += blocks
+        return enabled
+
+    def release(self):
+        for region, _ in self.regions:
+            region.close()
+        self.regions = []
 
 
 class ThpDefrag(Test):
 
     '''
-    Defrag test enables THP and fragments the system memory using dd load
-    and turns on THP defrag and checks whether defrag occurred.
+    Defrag test enables THP and fragments the system memory, either from
+    a single process through mmap (default) or using dd load, then turns
+    on THP defrag and records compaction and khugepaged progress over
+    time, checking whether defrag occurred.
 
     :avocado: tags=memory,privileged,hugepage
     '''
@@ -65,6 +202,23 @@ class ThpDefrag(Test):
         # Leaving out some free space in tmpfs
         self.count = (free_space // self.block_size) - 3
 
+        self.fragmenter = None
+        self.engine = self.params.get('engine', default='mmap')
+        self.target_index = float(self.params.get('target_index',
+                                                  default=0.9))
+        self.max_fraction = float(self.params.get('max_fraction',
+                                                  default=0.9))
+        self.stride = self.params.get('stride', default=None)
+        self.compact_duration = float(self.params.get('compact_duration',
+                                                      default=12))
+        self.compact_interval = float(self.params.get('compact_interval',
+                                                      default=1))
+        self.khugepaged_target = int(self.params.get('khugepaged_target',
+                                                     default=64))
+        self.khugepaged_timeout = float(self.params.get(
+            'khugepaged_timeout', default=300))
+        self.results = {}
+
     @avocado.fail_on
     def test(self):
         '''
@@ -79,29 +233,44 @@ class ThpDefrag(Test):
         # Turns off Defrag
         memory.set_thp_value("khugepaged/defrag", "0")
 
-        # Fragments The memory
-        self.log.info("Fragmenting the memory Using dd command \n")
-        for iterator in range(self.count):
-            defrag_cmd = 'dd if=/dev/urandom of=%s/%d bs=%dK count=1'\
-                         % (self.mem_path, iterator, self.block_size)
-            if(process.system(defrag_cmd, timeout=900,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('Defrag command Failed %s' % defrag_cmd)
-
         hugepagesize = memory.get_huge_page_size()
         nr_full = int(0.8 * (memory.meminfo.MemTotal.k / hugepagesize))
 
+        # Fragments The memory
+        if self.engine == 'dd':
+            self.log.info("Fragmenting the memory Using dd command \n")
+            for iterator in range(self.count):
+                defrag_cmd = 'dd if=/dev/urandom of=%s/%d bs=%dK count=1'\
+                             % (self.mem_path, iterator, self.block_size)
+                if(process.system(defrag_cmd, timeout=900, verbose=False,
+                                  ignore_status=True, shell=True)):
+                    self.fail('Defrag command Failed %s' % defrag_cmd)
+        else:
+            self.fragment_memory(hugepagesize * 1024)
+
         # Sets max possible hugepages before defrag on
         nr_hp_before = self.set_max_hugepages(nr_full)
 
         # Turns Defrag ON
         memory.set_thp_value("khugepaged/defrag", "1")
 
-        self.log.info("Sleeping %d seconds to settle out things", 12)
-        time.sleep(12)
+        # Compaction curve replaces the fixed settle time
+        telemetry = MemTelemetry(interval=self.compact_interval,
+                                 sources=('vmstat', 'buddyinfo'))
+        telemetry.start()
+        try:
+            nr_hp_after = self.compaction_curve(nr_full)
+        finally:
+            telemetry.stop()
+        self.results['compaction_rates'] = telemetry.summary()
+        telemetry.save(os.path.join(self.logdir, 'defrag_telemetry.json'))
 
-        # Sets max hugepages after defrag on
-        nr_hp_after = self.set_max_hugepages(nr_full)
+        if self.fragmenter:
+            memory.set_num_huge_pages(0)
+            self.khugepaged_curve(hugepagesize * 1024)
+        with open(os.path.join(self.logdir, 'defrag_results.json'),
+                  'w') as result_fd:
+            json.dump(self.results, result_fd, indent=2)
 
         # Check for memory defragmentation
         if nr_hp_before >= nr_hp_after:
@@ -112,6 +281,102 @@ class ThpDefrag(Test):
 
         self.log.info("Defrag test passed")
 
+    def fragment_memory(self, hugepage_size):
+        """
+        Fragment memory in-process until the unusable free space index at
+        hugepage order reaches target_index, or max_fraction of the free
+        memory has been mapped.
+        """
+        order = (hugepage_size // mmap.PAGESIZE).bit_length() - 1
+        stride = int(self.stride) if self.stride else None
+        self.fragmenter = MemFragmenter(hugepage_size, stride)
+        budget = self.max_fraction * memory.meminfo.MemFree.b
+        mapped = 0
+        index = unusable_index(order)
+        curve = [(0, index)]
+        self.log.info("Fragmenting memory in-process, unusable index at "
+                      "order %d: %.3f, target %.3f", order, index,
+                      self.target_index)
+        start = time.time()
+        while index < self.target_index and mapped < budget:
+            mapped += self.fragmenter.add_chunk()
+            index = unusable_index(order)
+            curve.append((mapped // 1048576, index))
+        self.log.info("Fragmented %d MB in %.1f s, unusable index %.3f",
+                      mapped // 1048576, time.time() - start, index)
+        self.results['fragmentation'] = {'order': order,
+                                         'target_index': self.target_index,
+                                         'final_index': index,
+                                         'mapped_mb': mapped // 1048576,
+                                         'curve_mb_index': curve}
+
+    def compaction_curve(self, nr_full):
+        """
+        Request nr_full hugepages every compact_interval seconds for
+        compact_duration seconds. Each request is direct compaction done
+        by this process, kcompactd works in the background; both are
+        timed and recorded with the compaction counters.
+
+        :return: hugepages obtained by the last request
+        """
+        curve = []
+        counters = ('compact_stall', 'compact_success', 'compact_fail')
+        initial = {name: int(memory.read_from_vmstat(name))
+                   for name in counters}
+        kcompactd_start = kcompactd_cpu_time()
+        start = time.time()
+        nr_hp = 0
+        while True:
+            req_start = time.time()
+            nr_hp = self.set_max_hugepages(nr_full)
+            direct = time.time() - req_start
+            point = {'time': round(time.time() - start, 3),
+                     'nr_hugepages': nr_hp,
+                     'direct_time': direct,
+                     'kcompactd_time': kcompactd_cpu_time() -
+                     kcompactd_start}
+            for name in counters:
+                point[name] = int(memory.read_from_vmstat(name)) - \
+                    initial[name]
+            curve.append(point)
+            self.log.info("t=%.1fs hugepages=%d direct=%.3fs "
+                          "kcompactd=%.3fs stall=%d success=%d",
+                          point['time'], nr_hp, direct,
+                          point['kcompactd_time'], point['compact_stall'],
+                          point['compact_success'])
+            if time.time() - start >= self.compact_duration:
+                break
+            time.sleep(self.compact_interval)
+        self.results['compaction'] = curve
+        return nr_hp
+
+    def khugepaged_curve(self, hugepage_size):
+        """
+        Let khugepaged collapse khugepaged_target hugepages of the
+        fragmented region and record how AnonHugePages grows over time.
+        """
+        target = self.fragmenter.enable_thp(self.khugepaged_target)
+        target_kb = target * hugepage_size // 1024
+        initial = anon_hugepages_kb()
+        curve = []
+        start = time.time()
+        reached = None
+        while time.time() - start < self.khugepaged_timeout:
+            collapsed = (anon_hugepages_kb() - initial) // \
+                (hugepage_size // 1024)
+            curve.append((round(time.time() - start, 3), collapsed))
+            if collapsed * hugepage_size // 1024 >= target_kb:
+                reached = time.time() - start
+                break
+            time.sleep(self.compact_interval)
+        self.log.info("khugepaged collapsed %d/%d hugepages, target %s",
+                      curve[-1][1] if curve else 0, target,
+                      "reached in %.1f s" % reached if reached is not None
+                      else "not reached in %d s" % self.khugepaged_timeout)
+        self.results['khugepaged'] = {'target': target,
+                                      'time_to_target': reached,
+                                      'curve': curve}
+
     @staticmethod
     def set_max_hugepages(nr_full):
         '''
@@ -129,6 +394,8 @@ class ThpDefrag(Test):
 
         if self.mem_path:
             self.log.info('Cleaning Up!!!')
+            if self.fragmenter:
+                self.fragmenter.release()
             memory.set_thp_value("khugepaged/defrag", "0")
             memory.set_num_huge_pages(0)
             self.device.unmount()
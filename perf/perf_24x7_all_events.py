@@ -15,10 +15,14 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import sys
 import platform
 from avocado import Test
 from avocado.utils import cpu, distro, process, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'generic'))
+from stream_capture.capture import StreamCapture  # noqa: E402
 
 
 class hv_24x7_all_events(Test):
@@ -103,8 +107,30 @@ class hv_24x7_all_events(Test):
         # Clear the dmesg to capture the delta at the end of the test.
         dmesg.clear_dmesg()
 
+    def run_event(self, cmd):
+        """
+        Run one perf stat, appending its verbose output to a single
+        compressed log instead of keeping it in memory
+        """
+        self.unsupported = []
+        res = self.capture.run(cmd)
+        if res.exit_status != 0 or self.unsupported:
+            self.fail_cmd.append(cmd)
+
+    def check_line(self, line, stream):
+        """
+        Collect the "not supported" lines of the running perf stat
+        """
+        if stream == 'stderr' and "not supported" in line:
+            self.unsupported.append(line)
+
     def test_all_events(self):
         perf_args = "-v -e"
+        self.capture = StreamCapture(os.path.join(self.logdir,
+                                                  'perf_stat.log.gz'),
+                                     head_lines=0, tail_lines=20,
+                                     append=True)
+        self.capture.add_parser(self.check_line)
         for line in self.list_of_hv_24x7_events:
             if line.startswith('HP') or line.startswith('CP'):
                 # Running for domain range from 1-6
@@ -117,16 +143,12 @@ class hv_24x7_all_events(Test):
                         events = "hv_24x7/%s,domain=%s,core=%s/" % \
                                  (line, domain, core)
                         cmd = 'perf stat %s %s sleep 1' % (perf_args, events)
-                        res = process.run(cmd, ignore_status=True)
-                        if res.exit_status != 0 or b"not supported" in res.stderr:
-                            self.fail_cmd.append(cmd)
+                        self.run_event(cmd)
             else:
                 for chip_item in range(0, self.chips):
                     events = "hv_24x7/%s,domain=1,chip=%s/" % (line, chip_item)
                     cmd = "perf stat %s %s sleep 1" % (perf_args, events)
-                    res = process.run(cmd, ignore_status=True)
-                    if res.exit_status != 0 or b"not supported" in res.stderr:
-                        self.fail_cmd.append(cmd)
+                    self.run_event(cmd)
 
         if len(self.fail_cmd) > 0:
             for cmd in range(len(self.fail_cmd)):
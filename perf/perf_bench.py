@@ -15,10 +15,76 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import re
+import json
 from avocado import Test
-from avocado.utils import process, dmesg
+from avocado.utils import process, dmesg, cpu
 from avocado.utils.software_manager.distro_packages import ensure_tool
 
+# metric name, regex on a default format output line
+METRIC_PATTERNS = [
+    ('total_sec', re.compile(r'Total time:\s*([\d.]+) \[sec\]')),
+    ('usecs_per_op', re.compile(r'^\s*([\d.]+) usecs/op\s*$')),
+    ('ops_per_sec', re.compile(r'^\s*(\d+) ops/sec\s*$')),
+    ('ops_per_sec', re.compile(r'Averaged (\d+) operations/sec')),
+    ('cycles_per_byte', re.compile(r'^\s*([\d.]+) cycles/byte')),
+    ('usec', re.compile(r'took: ([\d.]+) usec')),
+    ('msec', re.compile(r' in ([\d.]+) ms')),
+]
+BPS_RE = re.compile(r'^\s*([\d.]+) (bytes|KB|MB|GB)/sec')
+# " <name>, <value>, <unit>, <short name>" result lines of numa mem
+NUMA_RE = re.compile(r'^\s*(\S+?),?\s+([\d.]+),\s+(\S+?),\s+(\S+)')
+RUNNING_RE = re.compile(r"^# Running '(\S+)' benchmark")
+SCALE = {'bytes': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+# metric names and unit prefixes where a higher value is better, lower
+# is better for the rest
+HIGHER_IS_BETTER = ('ops_per_sec', 'gb_per_sec', 'GB/sec', 'ops/sec')
+
+
+def higher_is_better(key):
+    """
+    Whether a higher value is better for a metric key, judged on its
+    last field: the metric name, or the unit of numa mem results such
+    as "GB/sec/thread"
+    """
+    return key.rsplit(':', 1)[-1].startswith(HIGHER_IS_BETTER)
+
+
+def parse_bench_output(output, default_bench):
+    """
+    Parse the default format output of perf bench into metrics
+
+    :return: dict of "<collection>/<bench>:<metric>" -> value
+    """
+    metrics = {}
+    bench = default_bench
+    for line in output.splitlines():
+        match = RUNNING_RE.match(line)
+        if match:
+            bench = match.group(1)
+            continue
+        if line.lstrip().startswith('#'):
+            continue
+        match = BPS_RE.match(line)
+        if match:
+            metrics['%s:gb_per_sec' % bench] = round(
+                float(match.group(1)) * SCALE[match.group(2)] / SCALE['GB'],
+                4)
+            continue
+        match = NUMA_RE.match(line)
+        if match and bench.startswith('numa'):
+            metrics['%s:%s:%s:%s' % (bench, match.group(1),
+                                     match.group(4).rstrip(','),
+                                     match.group(3))] = \
+                float(match.group(2))
+            continue
+        for name, pattern in METRIC_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                metrics['%s:%s' % (bench, name)] = float(match.group(1))
+                break
+    return metrics
+
 
 class perf_bench(Test):
 
@@ -74,9 +140,129 @@ class perf_bench(Test):
         output = op.stdout.decode() + op.stderr.decode()
         if err_ln in output:
             self.fail("command %s failed with assertion code" % cmd)
+        return op.stdout.decode()
+
+    def mem_functions(self, bench):
+        """
+        Functions of mem memcpy/memset, "all" expands to every function
+        perf lists as available
+        """
+        functions = self.params.get('mem_functions', default='default')
+        if functions != 'all':
+            return functions.split()
+        result = process.run("%s bench mem %s --function list" %
+                             (self.perf_bin, bench), ignore_status=True)
+        output = result.stdout.decode() + result.stderr.decode()
+        names = [line.split()[0] for line in output.splitlines()
+                 if line.startswith('\t') and line.strip()]
+        return names or ['default']
+
+    def mem_sweep(self, sizes):
+        """
+        mem memcpy/memset bandwidth per function and size, with the
+        simple format printing one bytes/sec value per run
+        """
+        loops = self.params.get('mem_loops', default=10)
+        metrics = {}
+        for function in self.mem_functions(self.option):
+            for size in sizes:
+                output = self.run_cmd(
+                    "%s bench -f simple mem %s --function %s --size %s "
+                    "--nr_loops %s" % (self.perf_bin, self.option, function,
+                                       size, loops))
+                value = float(output.split()[-1])
+                metrics['mem/%s:%s:%s:gb_per_sec' % (
+                    self.option, function, size)] = round(
+                        value / SCALE['GB'], 4)
+        return metrics
+
+    def futex_sweep(self, threads_list):
+        """
+        futex hash operations/sec per thread count
+        """
+        runtime = self.params.get('futex_runtime', default=10)
+        metrics = {}
+        for threads in threads_list:
+            if threads == 'max':
+                threads = cpu.online_count()
+            output = self.run_cmd("%s bench futex hash -s -t %s -r %s" %
+                                  (self.perf_bin, threads, runtime))
+            parsed = parse_bench_output(output, 'futex/hash')
+            if 'futex/hash:ops_per_sec' in parsed:
+                metrics['futex/hash:threads=%s:ops_per_sec' % threads] = \
+                    parsed['futex/hash:ops_per_sec']
+        return metrics
+
+    def compare_baseline(self, metrics, baseline, results_dir):
+        """
+        Compare metrics with a baseline run, given as a kernel release
+        stored in results_dir or as a JSON file
+
+        :return: list of regression descriptions
+        """
+        threshold = float(self.params.get('regression_threshold',
+                                          default=10))
+        if not os.path.isfile(baseline):
+            baseline = os.path.join(results_dir, baseline, '%s_%s.json' % (
+                self.optname, self.option or 'default'))
+        if not os.path.isfile(baseline):
+            self.log.warning("Baseline %s not found", baseline)
+            return []
+        with open(baseline) as base_fd:
+            base = json.load(base_fd)
+        regressions = []
+        for key, value in sorted(metrics.items()):
+            old = base['metrics'].get(key)
+            if not old:
+                continue
+            change = 100.0 * (value - old) / old
+            if not higher_is_better(key):
+                change = -change
+            self.log.info("%-60s %14.4f -> %14.4f (%+.1f%%)", key, old,
+                          value, change)
+            if change < -threshold:
+                regressions.append("%s: %s -> %s" % (key, old, value))
+        for regression in regressions:
+            self.log.warning("Regression against %s: %s", base['kernel'],
+                             regression)
+        return regressions
 
     def test_bench(self):
         # perf bench command
         bench_cmd = "%s bench %s %s" % (self.perf_bin, self.optname, self.option)
-        self.run_cmd(bench_cmd)
+        output = self.run_cmd(bench_cmd)
         self.verify_dmesg()
+
+        bench = "%s/%s" % (self.optname, self.option)
+        metrics = parse_bench_output(output, bench)
+        mem_sizes = self.params.get('mem_sizes', default='')
+        if self.optname == 'mem' and self.option in ['memcpy', 'memset'] \
+                and mem_sizes:
+            metrics.update(self.mem_sweep(mem_sizes.split()))
+        futex_threads = str(self.params.get('futex_threads', default=''))
+        if self.optname == 'futex' and self.option == 'hash' \
+                and futex_threads:
+            metrics.update(self.futex_sweep(futex_threads.split()))
+        for key, value in sorted(metrics.items()):
+            self.log.info("%-60s %14.4f", key, value)
+
+        kernel = os.uname()[2]
+        result = {'kernel': kernel, 'command': bench_cmd,
+                  'metrics': metrics}
+        name = '%s_%s.json' % (self.optname, self.option or 'default')
+        with open(os.path.join(self.logdir, name), 'w') as result_fd:
+            json.dump(result, result_fd, indent=4)
+        results_dir = self.params.get('results_dir',
+                                      default='/var/tmp/perf_bench')
+        os.makedirs(os.path.join(results_dir, kernel), exist_ok=True)
+        with open(os.path.join(results_dir, kernel, name),
+                  'w') as result_fd:
+            json.dump(result, result_fd, indent=4)
+
+        baseline = self.params.get('baseline', default='')
+        if baseline:
+            regressions = self.compare_baseline(metrics, baseline,
+                                                results_dir)
+            if regressions:
+                self.fail("%d metric(s) regressed more than the threshold "
+                          "against %s" % (len(regressions), baseline))
@@ -14,13 +14,23 @@
 # Copyright: 2021 IBM
 # Author: Nageswara R Sastry <rnsastry@linux.ibm.com>
 
+import os
+import json
+import math
+import queue
 import platform
+from concurrent.futures import ThreadPoolExecutor
 from avocado import Test
 from avocado.utils import distro, dmesg, genio, process, cpu
 from avocado.utils.software_manager.manager import SoftwareManager
 
 IS_POWER_NV = 'PowerNV' in genio.read_file('/proc/cpuinfo').rstrip('\t\r\n\0')
 
+PMU_DIR = '/sys/bus/event_source/devices'
+# Core PMUs count per thread on any CPU, every other PMU with a cpumask
+# (hv_24x7, nest IMC, uncore_*) shares its counters system wide
+CORE_PMUS = ['cpu', 'cpu_core', 'cpu_atom']
+
 
 class perf_metric(Test):
 
@@ -72,14 +82,163 @@ class perf_metric(Test):
         if not self.list_of_metric_events:
             self.cancel("perf tool Metric events not found.")
 
+        # Metrics are checked in parallel, one perf stat per CPU at a time
+        self.max_cpus = int(self.params.get('max_cpus', default=0))
+        self.percent_tolerance = float(self.params.get('percent_tolerance',
+                                                       default=1.0))
+        self.cpus = cpu.online_list()
+        if self.max_cpus:
+            self.cpus = self.cpus[:self.max_cpus]
+        self.implausible = []
+        self.hv_limited = False
+        self.uncore_pmus = set(
+            pmu for pmu in (os.listdir(PMU_DIR) if os.path.isdir(PMU_DIR)
+                            else [])
+            if pmu not in CORE_PMUS and
+            os.path.exists(os.path.join(PMU_DIR, pmu, 'cpumask')))
+
         # Clear the dmesg to capture the delta at the end of the test.
         dmesg.clear_dmesg()
 
+    @staticmethod
+    def parse_metric_values(output, metric_only):
+        """
+        Parse the metric values of a "perf stat -x ," run.
+
+        With -M every counter line carries the metric value and unit in
+        the 6th and 7th field, with --metric-only a header line of metric
+        names is followed by a line of values.
+
+        :return: dict of metric name -> value (None if not computed)
+        """
+        values = {}
+        lines = [ln for ln in output.splitlines()
+                 if ln.strip() and ',' in ln and not ln.startswith('#')]
+        if metric_only:
+            if len(lines) >= 2:
+                names = lines[-2].split(',')
+                for name, value in zip(names, lines[-1].split(',')):
+                    if name.strip():
+                        try:
+                            values[name.strip()] = float(value)
+                        except ValueError:
+                            values[name.strip()] = None
+            return values
+        for ln in lines:
+            fields = ln.split(',')
+            if len(fields) < 7 or not fields[6].strip():
+                continue
+            try:
+                values[fields[6].strip()] = float(fields[5])
+            except ValueError:
+                values[fields[6].strip()] = None
+        return values
+
+    def check_metric_values(self, values):
+        """
+        Flag values no correct metric formula can produce.
+
+        :return: list of "name=value: reason" strings
+        """
+        flags = []
+        for name, value in values.items():
+            if value is None:
+                continue
+            if math.isnan(value) or math.isinf(value):
+                flags.append("%s=%s: not a number" % (name, value))
+            elif value < 0:
+                flags.append("%s=%s: negative" % (name, value))
+            elif ('%' in name or 'percent' in name.lower()) and \
+                    value > 100 + self.percent_tolerance:
+                flags.append("%s=%s: ratio above 100%%" % (name, value))
+        return flags
+
+    def _metric_pmus(self, line):
+        """
+        Non-core PMUs a metric counts on, from the event names of a short
+        "perf stat" probe.
+        """
+        cmd = "perf stat -x , -M %s -C %s true" % (line, self.cpus[0])
+        output = process.run(cmd, ignore_status=True,
+                             shell=True).stderr.decode()
+        pmus = set()
+        for ln in output.splitlines():
+            fields = ln.split(',')
+            if len(fields) < 3:
+                continue
+            pmu, sep, _ = fields[2].partition('/')
+            if sep and pmu in self.uncore_pmus:
+                pmus.add(pmu)
+        for pmu in ('hv_24x7', 'imc', 'uncore'):
+            # events that failed to open are not always printed
+            if not pmus and pmu in output:
+                pmus.add(pmu)
+        return pmus
+
+    def _pmu_cpu(self, pmu):
+        """
+        First CPU of a PMU cpumask, the first tested CPU without one.
+        """
+        cpumask = os.path.join(PMU_DIR, pmu, 'cpumask')
+        text = genio.read_file(cpumask).strip() \
+            if os.path.exists(cpumask) else ''
+        if text:
+            return int(text.split(',')[0].split('-')[0])
+        return self.cpus[0]
+
+    def _run_metric(self, option, line, cpus):
+        """
+        Run one metric on a free CPU and give the CPU back when done.
+        """
+        cpu_id = cpus.get()
+        try:
+            cmd = "perf stat -x , %s %s -C %s sleep 1" % (option, line,
+                                                          cpu_id)
+            op = process.run(cmd, ignore_status=True, shell=True,
+                             verbose=True)
+        finally:
+            cpus.put(cpu_id)
+        return cmd, cpu_id, op
+
     def _run_cmd(self, option):
+        cpus = queue.Queue()
+        for cpu_id in self.cpus:
+            cpus.put(cpu_id)
+        metric_only = "--metric-only" in option
+        table = []
+        # Only core PMU metrics run in parallel, metrics on shared
+        # hv_24x7 / nest / uncore counters would multiplex each other
+        shared = {}
         for line in self.list_of_metric_events:
-            cmd = "perf stat %s %s -C 0 sleep 1" % (option, line)
-            op = process.run(cmd, ignore_status=True, shell=True, verbose=True)
+            pmus = self._metric_pmus(line)
+            if pmus:
+                shared[line] = sorted(pmus)
+        self.log.info("%d of %d metrics use non-core PMUs and run serially",
+                      len(shared), len(self.list_of_metric_events))
+        runs = {}
+        with ThreadPoolExecutor(max_workers=len(self.cpus)) as executor:
+            for line in self.list_of_metric_events:
+                if line not in shared:
+                    runs[line] = executor.submit(self._run_metric, option,
+                                                 line, cpus)
+            runs = {line: run.result() for line, run in runs.items()}
+        for line, pmus in shared.items():
+            # on the CPU the PMU counts on, one metric at a time
+            single = queue.Queue()
+            single.put(self._pmu_cpu(pmus[0]))
+            runs[line] = self._run_metric(option, line, single)
+        results = [(line, runs[line]) for line in self.list_of_metric_events]
+        for line, (cmd, cpu_id, op) in results:
             output = (op.stdout + op.stderr).decode()
+            values = self.parse_metric_values(op.stderr.decode(),
+                                              metric_only)
+            flags = self.check_metric_values(values)
+            table.append({'metric': line, 'cpu': cpu_id,
+                          'pmus': shared.get(line, []),
+                          'exit_status': op.exit_status,
+                          'values': values, 'implausible': flags})
+            for flag in flags:
+                self.implausible.append("%s: %s" % (line, flag))
             # When the command failed, checking for expected failure or not.
             if op.exit_status:
                 found_imc = False
@@ -104,10 +263,21 @@ class perf_metric(Test):
             if ("not counted" in output) or ("not supported" in output):
                 self.fail_cmd.append(cmd)
             if "operations is limited" in output:
-                self.cancel("Please enable lpar to allow collecting the"
-                            " hv_24x7 counters info")
+                self.hv_limited = True
+        table_file = "metric_values%s.json" % ("_metric_only" if metric_only
+                                               else "")
+        with open(os.path.join(self.logdir, table_file), 'w') as table_fd:
+            json.dump(table, table_fd, indent=4)
+        if self.hv_limited:
+            self.cancel("Please enable lpar to allow collecting the"
+                        " hv_24x7 counters info")
+        for entry in self.implausible:
+            self.log.info("Implausible metric value: %s", entry)
         if self.fail_cmd:
             self.fail("perf_metric: commands failed are %s" % self.fail_cmd)
+        if self.implausible:
+            self.fail("perf_metric: %d implausible metric values, refer "
+                      "%s" % (len(self.implausible), table_file))
 
     def test_all_metric_events_with_M(self):
         self._run_cmd("-M")
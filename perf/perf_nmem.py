@@ -19,6 +19,8 @@ import platform
 from avocado import Test
 from avocado.utils import cpu, dmesg, distro, genio, linux_modules, process
 from avocado.utils.software_manager.manager import SoftwareManager
+from pmu_validator.validator import EventValidator, UNRESOLVED, \
+    UNSUPPORTED
 
 
 class perfNMEM(Test):
@@ -142,9 +144,22 @@ class perfNMEM(Test):
 
     def test_all_events(self):
         failed_event_list = []
+        validator = None
+        if self.params.get('validator', default='inprocess') == 'inprocess':
+            validator = EventValidator(
+                duration=self.params.get('spin_time', default=0.01))
         # For each pmu available, run events one by one
         for pmu in self.pmu_list:
             for event in self.all_events[pmu]:
+                if validator:
+                    # nmem events are counted on the PMU cpumask CPU, like
+                    # a perf stat exit status only an open failure fails
+                    status, detail = validator.validate(event)
+                    if status != UNRESOLVED:
+                        self.log.info("%s: %s %s", event, status, detail)
+                        if status == UNSUPPORTED:
+                            failed_event_list.append(event)
+                        continue
                 rc, op = process.getstatusoutput('perf stat -e %s sleep 1'
                                                  % event, shell=True,
                                                  ignore_status=True,
@@ -15,11 +15,13 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import json
 import platform
 import shutil
 from avocado import Test
 from avocado.utils import distro, process, genio, cpu, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
+from pmu_validator.validator import EventValidator, OK, UNRESOLVED
 
 
 class PerfRawevents(Test):
@@ -81,18 +83,46 @@ class PerfRawevents(Test):
                     filename = filename.replace('0082', '0080')
                 self.copy_files(filename)
 
+        # "inprocess" opens the events with perf_event_open directly and
+        # only falls back to perf for events it can not resolve, "perf"
+        # runs perf stat for every event
+        self.validator = self.params.get('validator', default='inprocess')
+        self.spin_time = self.params.get('spin_time', default=0.01)
+        self.event_status = {}
+
         os.chdir(self.teststmpdir)
         # Clear the dmesg to capture the delta at the end of the test.
         dmesg.clear_dmesg()
 
     def run_event(self, filename, perf_flags):
+        validator = None
+        if self.validator == 'inprocess':
+            validator = EventValidator(duration=self.spin_time)
         for line in genio.read_all_lines(filename):
             cmd = "%s%s sleep 1" % (perf_flags, line)
+            if validator:
+                event = perf_flags.split('-e ')[-1] + line
+                status, detail = validator.validate(event)
+                if status != UNRESOLVED:
+                    self.event_status[event] = status
+                    if status != OK:
+                        self.log.debug("%s: %s %s", event, status, detail)
+                        self.fail_cmd.append(cmd)
+                    continue
             result = process.run(cmd, shell=True, ignore_status=True)
             output = (result.stdout + result.stderr).decode()
             if result.exit_status != 0 or ("not counted" in output) or\
                     ("not supported" in output):
                 self.fail_cmd.append(cmd)
+        if self.event_status:
+            summary = {}
+            for status in self.event_status.values():
+                summary[status] = summary.get(status, 0) + 1
+            self.log.info("perf_event_open validation of %s: %s", filename,
+                          summary)
+            with open(os.path.join(self.logdir, '%s_status.json' % filename),
+                      'w') as status_fd:
+                json.dump(self.event_status, status_fd, indent=4)
 
     def error_check(self):
         if self.fail_cmd:
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2025 IBM
+
+"""
+In-process perf event validator.
+
+EventValidator opens events directly with the perf_event_open syscall
+through ctypes, enables them around a short busy loop and reads the count
+together with time_enabled / time_running. Each event is classified like
+a "perf stat -e <event> sleep 1" run would be judged by the perf tests:
+
+* UNSUPPORTED: the event could not be opened (perf exits non zero or
+  prints <not supported>)
+* NOT_COUNTED: the event opened but never got on the PMU (perf prints
+  <not counted>)
+* OK: the event was scheduled and counted
+
+Raw codes ("r<hex>") and sysfs named events ("<pmu>/<event>/" or a bare
+event name of the core PMU) are resolved in-process. Events that only
+exist in perf's own event tables cannot be resolved and are returned as
+UNRESOLVED so the caller can fall back to running perf.
+
+Usage::
+
+    from pmu_validator.validator import EventValidator, OK
+
+    validator = EventValidator()
+    status, detail = validator.validate('r1003c')
+"""
+
+import ctypes
+import fcntl
+import os
+import platform
+import struct
+import time
+
+__all__ = ['EventValidator', 'OK', 'NOT_COUNTED', 'UNSUPPORTED',
+           'UNRESOLVED']
+
+OK = 'ok'
+NOT_COUNTED = 'not-counted'
+UNSUPPORTED = 'unsupported'
+UNRESOLVED = 'unresolved'
+
+PMU_DIR = '/sys/bus/event_source/devices'
+
+PERF_TYPE_RAW = 4
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1
+PERF_FORMAT_TOTAL_TIME_RUNNING = 2
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_EVENT_IOC_RESET = 0x2403
+PERF_FLAG_DISABLED = 1
+
+NR_PERF_EVENT_OPEN = {'x86_64': 298, 'ppc64le': 319, 'ppc64': 319,
+                      'aarch64': 241, 's390x': 331, 'i686': 336}
+
+
+class PerfEventAttr(ctypes.Structure):
+
+    """
+    struct perf_event_attr, the bit fields are kept in one flags word.
+    """
+
+    _fields_ = [('type', ctypes.c_uint32),
+                ('size', ctypes.c_uint32),
+                ('config', ctypes.c_uint64),
+                ('sample_period', ctypes.c_uint64),
+                ('sample_type', ctypes.c_uint64),
+                ('read_format', ctypes.c_uint64),
+                ('flags', ctypes.c_uint64),
+                ('wakeup_events', ctypes.c_uint32),
+                ('bp_type', ctypes.c_uint32),
+                ('config1', ctypes.c_uint64),
+                ('config2', ctypes.c_uint64),
+                ('reserved', ctypes.c_uint8 * 56)]
+
+
+def _read(path):
+    with open(path) as sysfs:
+        return sysfs.read().strip()
+
+
+def _parse_cpumask(text):
+    """
+    First CPU of a "0-3,8" style cpumask.
+    """
+    return int(text.split(',')[0].split('-')[0])
+
+
+class EventValidator(object):
+
+    """
+    Validate perf events with perf_event_open.
+
+    :param duration: seconds spent in the busy loop while counting
+    :param core_pmu: PMU used for bare event names, "cpu" by default
+    """
+
+    def __init__(self, duration=0.01, core_pmu='cpu'):
+        self.duration = float(duration)
+        self.core_pmu = core_pmu
+        self.nr_open = NR_PERF_EVENT_OPEN.get(platform.machine())
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._libc.syscall.restype = ctypes.c_long
+        self._formats = {}
+
+    def _pmu_formats(self, pmu):
+        """
+        Map of format term -> (config field, [(low, high) bit ranges]).
+        """
+        if pmu in self._formats:
+            return self._formats[pmu]
+        formats = {}
+        fmt_dir = os.path.join(PMU_DIR, pmu, 'format')
+        terms = os.listdir(fmt_dir) if os.path.isdir(fmt_dir) else []
+        for term in terms:
+            field, _, bits = _read(os.path.join(fmt_dir, term)).partition(':')
+            ranges = []
+            for bit_range in bits.split(','):
+                low, _, high = bit_range.partition('-')
+                ranges.append((int(low), int(high or low)))
+            formats[term] = (field, ranges)
+        self._formats[pmu] = formats
+        return formats
+
+    def _encode(self, pmu, terms):
+        """
+        Encode "event=0x1,umask=0x2" style terms with the PMU sysfs format.
+
+        :return: dict of config, config1 and config2
+        """
+        formats = self._pmu_formats(pmu)
+        config = {'config': 0, 'config1': 0, 'config2': 0}
+        for term in terms.split(','):
+            if not term:
+                continue
+            name, _, value = term.partition('=')
+            value = int(value, 0) if value else 1
+            if name not in formats and name in config:
+                # config, config1 and config2 are built-in terms
+                config[name] = value
+                continue
+            if name not in formats:
+                raise ValueError("unknown format term %s for %s" %
+                                 (name, pmu))
+            field, ranges = formats[name]
+            for low, high in ranges:
+                width = high - low + 1
+                config[field] |= (value & ((1 << width) - 1)) << low
+                value >>= width
+        return config
+
+    def resolve(self, event):
+        """
+        Resolve an event name into its perf_event_attr encoding.
+
+        :return: dict with pmu, type, config, config1, config2 and cpu,
+                 or None when the event is not known to sysfs
+        """
+        event = event.strip()
+        if event.startswith('r') and len(event) > 1:
+            try:
+                config = int(event[1:], 16)
+            except ValueError:
+                config = None
+            if config is not None:
+                return {'pmu': None, 'type': PERF_TYPE_RAW,
+                        'config': config, 'config1': 0, 'config2': 0,
+                        'cpu': -1}
+        if '/' in event:
+            pmu, name = event.strip('/').split('/', 1)
+        else:
+            pmu, name = self.core_pmu, event
+        pmu_path = os.path.join(PMU_DIR, pmu)
+        if not os.path.isdir(pmu_path):
+            return None
+        event_dir = os.path.join(pmu_path, 'events')
+        terms = None
+        if '=' in name:
+            terms = name
+        elif os.path.isdir(event_dir):
+            for entry in os.listdir(event_dir):
+                if entry.lower() == name.lower():
+                    terms = _read(os.path.join(event_dir, entry))
+                    break
+        if terms is None:
+            return None
+        try:
+            resolved = self._encode(pmu, terms)
+        except (OSError, ValueError):
+            return None
+        resolved['pmu'] = pmu
+        resolved['type'] = int(_read(os.path.join(pmu_path, 'type')))
+        cpumask = os.path.join(pmu_path, 'cpumask')
+        resolved['cpu'] = _parse_cpumask(_read(cpumask)) \
+            if os.path.exists(cpumask) else -1
+        return resolved
+
+    def _open(self, resolved):
+        attr = PerfEventAttr()
+        attr.type = resolved['type']
+        attr.size = ctypes.sizeof(PerfEventAttr)
+        attr.config = resolved['config']
+        attr.config1 = resolved['config1']
+        attr.config2 = resolved['config2']
+        attr.read_format = (PERF_FORMAT_TOTAL_TIME_ENABLED |
+                            PERF_FORMAT_TOTAL_TIME_RUNNING)
+        attr.flags = PERF_FLAG_DISABLED
+        # uncore PMUs count per CPU, core events follow this thread
+        pid, cpu = (-1, resolved['cpu']) if resolved['cpu'] >= 0 else (0, -1)
+        fd = self._libc.syscall(self.nr_open, ctypes.byref(attr), pid, cpu,
+                                -1, 0)
+        if fd < 0:
+            return None, os.strerror(ctypes.get_errno())
+        return fd, None
+
+    def _spin(self):
+        end = time.monotonic() + self.duration
+        loops = 0
+        while time.monotonic() < end:
+            loops += 1
+        return loops
+
+    def validate(self, event):
+        """
+        Open, enable, run and read one event.
+
+        :return: (status, detail) where detail is a dict with count,
+                 time_enabled and time_running, or the open error
+        """
+        if self.nr_open is None:
+            return UNRESOLVED, {'error': 'perf_event_open syscall number '
+                                         'unknown for %s' %
+                                         platform.machine()}
+        resolved = self.resolve(event)
+        if resolved is None:
+            return UNRESOLVED, {'error': 'event not found in sysfs'}
+        fd, error = self._open(resolved)
+        if fd is None:
+            return UNSUPPORTED, {'error': error}
+        try:
+            fcntl.ioctl(fd, PERF_EVENT_IOC_RESET, 0)
+            fcntl.ioctl(fd, PERF_EVENT_IOC_ENABLE, 0)
+            self._spin()
+            fcntl.ioctl(fd, PERF_EVENT_IOC_DISABLE, 0)
+            count, enabled, running = struct.unpack('QQQ', os.read(fd, 24))
+        except OSError as details:
+            return UNSUPPORTED, {'error': str(details)}
+        finally:
+            os.close(fd)
+        detail = {'count': count, 'time_enabled': enabled,
+                  'time_running': running}
+        if not running:
+            return NOT_COUNTED, detail
+        return OK, detail
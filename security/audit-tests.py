@@ -15,10 +15,22 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import json
+import shutil
+import platform
+import statistics
 from avocado import Test
 from avocado.utils import archive, build, distro, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# syscalls the benchmark never makes, targets of the rules without filters
+UNUSED_SYSCALLS = ['adjtimex', 'settimeofday', 'sethostname',
+                   'setdomainname', 'init_module', 'delete_module', 'swapon',
+                   'swapoff', 'acct', 'pivot_root', 'mount', 'umount2']
+# syscalls the benchmark makes, targets of the rules with filters
+BENCH_SYSCALLS = ['getpid', 'openat', 'close', 'stat', 'newfstatat',
+                  'statx', 'execve', 'clone']
+
 
 class Audit(Test):
 
@@ -34,6 +46,18 @@ class Audit(Test):
 
         # Check for basic utilities
         smm = SoftwareManager()
+        run_type = self.params.get('type', default='upstream')
+        self.saved_rules = None
+        self.saved_enabled = None
+        if run_type == "system":
+            # installed audit, used by the benchmark mode
+            for package in ['gcc', 'audit']:
+                if not smm.check_installed(package) and \
+                        not smm.install(package):
+                    self.cancel('%s is needed for the test to be run' %
+                                package)
+            self.srcdir = None
+            return
         detected_distro = distro.detect()
         deps = ["gcc", "make", "glibc", "glibc-devel", "perl",
                 "perl-Test-Harness", "perl-File-Which", "perl-Time-HiRes"]
@@ -49,7 +73,6 @@ class Audit(Test):
             if not smm.check_installed(package) and not smm.install(package):
                 self.cancel('%s is needed for the test to be run' % package)
 
-        run_type = self.params.get('type', default='upstream')
         if run_type == "upstream":
             default_url = ("https://github.com/linux-audit/audit-userspace/"
                            "archive/master.zip")
@@ -79,6 +102,8 @@ class Audit(Test):
         '''
         Running tests from audit-testsuite
         '''
+        if not self.srcdir:
+            self.cancel("'make check' needs the upstream or distro sources")
         output = build.run_make(self.srcdir, extra_args="check",
                                 process_kwargs={"ignore_status": True})
         if output.exit_status:
@@ -87,3 +112,135 @@ class Audit(Test):
             if 'Result: FAIL' in line:
                 self.log.info(line)
                 self.fail("Some of the test(s) failed, refer to the log file")
+
+    @staticmethod
+    def audit_status():
+        """
+        Parse "auditctl -s" into a dict of integer fields
+        """
+        status = {}
+        output = process.system_output('auditctl -s', sudo=True).decode()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[1].lstrip('-').isdigit():
+                status[fields[0]] = int(fields[1])
+        return status
+
+    @staticmethod
+    def rules(count, filtered, arch, syscalls):
+        """
+        count distinct audit rules, none of which generates records.
+        Filtered rules hit the benchmarked syscalls but their auid
+        filter never matches, the others only list unused syscalls.
+        """
+        rules = []
+        for index in range(count):
+            if filtered:
+                rules.append('-a always,exit -F arch=%s %s -F auid=%d '
+                             '-k avocado_bench_%d' % (
+                                 arch, ' '.join('-S %s' % name for name in
+                                                syscalls),
+                                 4000000 + index, index))
+            else:
+                rules.append('-a always,exit -F arch=%s -S %s '
+                             '-k avocado_bench_%d' % (
+                                 arch, UNUSED_SYSCALLS[
+                                     index % len(UNUSED_SYSCALLS)], index))
+        return rules
+
+    def load_rules(self, rules):
+        process.run('auditctl -D', sudo=True)
+        if not rules:
+            return
+        rules_file = os.path.join(self.workdir, 'bench.rules')
+        with open(rules_file, 'w') as rules_fd:
+            rules_fd.write('\n'.join(rules) + '\n')
+        process.run('auditctl -R %s' % rules_file, sudo=True)
+
+    def run_bench(self, bench, loops, exec_loops, repeats):
+        """
+        Median per call latency in ns of each benchmarked syscall
+        """
+        samples = {}
+        cmd = '%s %d %d %s %s' % (bench, loops, exec_loops, bench,
+                                  shutil.which('true') or '/bin/true')
+        for _ in range(repeats):
+            output = process.system_output(cmd).decode()
+            for line in output.splitlines():
+                name, value = line.split()
+                samples.setdefault(name, []).append(float(value))
+        return {name: statistics.median(values)
+                for name, values in samples.items()}
+
+    def test_benchmark(self):
+        """
+        Per syscall latency with auditing disabled, enabled without rules
+        and with growing rule sets, with the backlog and lost counters
+        """
+        loops = int(self.params.get('loops', default=1000000))
+        exec_loops = int(self.params.get('exec_loops', default=2000))
+        repeats = int(self.params.get('repeats', default=3))
+        rule_counts = [int(val) for val in str(self.params.get(
+            'rule_counts', default='10 100 1000')).split()]
+        status = self.audit_status()
+        if status.get('enabled') == 2:
+            self.cancel("Audit configuration is locked (enabled 2)")
+        self.saved_enabled = status.get('enabled', 0)
+        self.saved_rules = process.system_output(
+            'auditctl -l', sudo=True).decode()
+        arch = 'b64' if platform.architecture()[0] == '64bit' else 'b32'
+        # stat, newfstatat or statx, depending on the arch and libc
+        syscalls = [name for name in BENCH_SYSCALLS
+                    if not process.run('ausyscall %s' % name,
+                                       ignore_status=True).exit_status]
+
+        bench = os.path.join(self.workdir, 'syscall_bench')
+        shutil.copyfile(self.get_data('syscall_bench.c'), bench + '.c')
+        process.run('gcc -O2 -o %s %s.c' % (bench, bench))
+
+        states = [('disabled', 0, []), ('enabled', 1, [])]
+        for count in rule_counts:
+            states.append(('%d_rules' % count, 1,
+                           self.rules(count, False, arch, syscalls)))
+            states.append(('%d_filter_rules' % count, 1,
+                           self.rules(count, True, arch, syscalls)))
+        report = {'kernel': platform.release(), 'loops': loops,
+                  'exec_loops': exec_loops, 'states': {}}
+        for name, enabled, rules in states:
+            self.load_rules(rules)
+            process.run('auditctl -e %d' % enabled, sudo=True)
+            before = self.audit_status()
+            latency = self.run_bench(bench, loops, exec_loops, repeats)
+            after = self.audit_status()
+            report['states'][name] = {
+                'rules': len(rules), 'latency_ns': latency,
+                'lost': after.get('lost', 0) - before.get('lost', 0),
+                'backlog': after.get('backlog', 0),
+                'backlog_limit': after.get('backlog_limit', 0)}
+            if report['states'][name]['lost']:
+                self.log.warning("%s: %d audit records lost", name,
+                                 report['states'][name]['lost'])
+
+        base = report['states']['disabled']['latency_ns']
+        self.log.info("%-20s %s", 'state', ' '.join(
+            '%16s' % syscall for syscall in sorted(base)))
+        for name, state in report['states'].items():
+            state['overhead_pct'] = {
+                syscall: round(100.0 * (value / base[syscall] - 1), 1)
+                for syscall, value in state['latency_ns'].items()
+                if base.get(syscall)}
+            self.log.info("%-20s %s", name, ' '.join(
+                '%9.1f(%+4.0f%%)' % (state['latency_ns'][syscall],
+                                     state['overhead_pct'][syscall])
+                for syscall in sorted(base)))
+        with open(os.path.join(self.logdir, 'audit_syscall_bench.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+
+    def tearDown(self):
+        if self.saved_rules is None:
+            return
+        self.load_rules([line for line in self.saved_rules.splitlines()
+                         if line.startswith('-')])
+        process.run('auditctl -e %d' % self.saved_enabled, sudo=True,
+                    ignore_status=True)
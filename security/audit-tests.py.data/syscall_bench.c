@@ -0,0 +1,77 @@
+/*
+ * syscall_bench.c
+ * Tight syscall loops timing the per call cost of getpid, open/close,
+ * stat and fork/execve/wait, used to measure the audit overhead.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * Copyright: 2025 IBM
+ *
+ * gcc -O2 -o syscall_bench syscall_bench.c
+ * ./syscall_bench <loops> <exec loops> <file> <program to exec>
+ */
+
+#define _GNU_SOURCE
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+static double now_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec * 1e9 + ts.tv_nsec;
+}
+
+int main(int argc, char **argv)
+{
+	long loops, exec_loops, i;
+	struct stat st;
+	double start;
+	pid_t pid;
+
+	if (argc != 5) {
+		fprintf(stderr, "usage: %s <loops> <exec loops> <file> <prog>\n",
+			argv[0]);
+		return 1;
+	}
+	loops = atol(argv[1]);
+	exec_loops = atol(argv[2]);
+
+	/* glibc may cache getpid(), go through syscall() */
+	start = now_ns();
+	for (i = 0; i < loops; i++)
+		syscall(SYS_getpid);
+	printf("getpid %.1f\n", (now_ns() - start) / loops);
+
+	start = now_ns();
+	for (i = 0; i < loops; i++)
+		close(open(argv[3], O_RDONLY));
+	printf("open_close %.1f\n", (now_ns() - start) / loops);
+
+	start = now_ns();
+	for (i = 0; i < loops; i++)
+		stat(argv[3], &st);
+	printf("stat %.1f\n", (now_ns() - start) / loops);
+
+	start = now_ns();
+	for (i = 0; i < exec_loops; i++) {
+		pid = fork();
+		if (pid == 0) {
+			execl(argv[4], argv[4], (char *)NULL);
+			_exit(127);
+		}
+		waitpid(pid, NULL, 0);
+	}
+	printf("fork_execve %.1f\n", (now_ns() - start) / exec_loops);
+	return 0;
+}
@@ -15,10 +15,44 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import re
+import json
+import shutil
 from avocado import Test
 from avocado.utils import build, distro, git, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# dm-crypt performance flags, as cryptsetup open options
+PERF_FLAGS = {'no_read_workqueue': '--perf-no_read_workqueue',
+              'no_write_workqueue': '--perf-no_write_workqueue',
+              'same_cpu_crypt': '--perf-same_cpu_crypt'}
+
+BENCHMARK_RE = re.compile(r'^\s*(\S+)\s+(\d+)b\s+([\d.]+)\s+MiB/s\s+'
+                          r'([\d.]+)\s+MiB/s')
+
+
+def cpu_busy_seconds():
+    """
+    System wide non idle CPU time, in seconds
+    """
+    with open('/proc/stat') as stat:
+        fields = [int(val) for val in stat.readline().split()[1:]]
+    # idle and iowait are the 4th and 5th fields
+    busy = sum(fields[:8]) - fields[3] - fields[4]
+    return busy / float(os.sysconf('SC_CLK_TCK'))
+
+
+def cpu_hz():
+    """
+    Nominal CPU frequency from /proc/cpuinfo, 0 when not reported
+    """
+    with open('/proc/cpuinfo') as cpuinfo:
+        for line in cpuinfo:
+            match = re.match(r'^(cpu MHz|clock)\s*:\s*([\d.]+)', line)
+            if match:
+                return float(match.group(2)) * 1000000
+    return 0.0
+
 
 class CryptSetup(Test):
 
@@ -33,6 +67,19 @@ class CryptSetup(Test):
         '''
         # Check for basic utilities
         smm = SoftwareManager()
+        run_type = self.params.get('type', default='upstream')
+        self.srcdir = None
+        self.backing = None
+        self.mapping = None
+        if run_type == "system":
+            # installed cryptsetup, used by the performance mode
+            for package in ['cryptsetup', 'fio']:
+                if not smm.check_installed(package) and \
+                        not smm.install(package):
+                    self.cancel('%s is needed for the test to be run' %
+                                package)
+            self.cryptsetup = 'cryptsetup'
+            return
         detected_distro = distro.detect()
         deps = ["gcc", "make", "autoconf", "automake", "gettext",
                 "gettext-devel", "libtool", "device-mapper", "popt-devel",
@@ -47,7 +94,6 @@ class CryptSetup(Test):
         for package in deps:
             if not smm.check_installed(package) and not smm.install(package):
                 self.cancel('%s is needed for the test to be run' % package)
-        run_type = self.params.get('type', default='upstream')
         if run_type == "upstream":
             default_url = "https://gitlab.com/cryptsetup/cryptsetup/"
             url = self.params.get('url', default=default_url)
@@ -71,11 +117,16 @@ class CryptSetup(Test):
             if not self.srcdir:
                 self.fail("cryptsetup source install failed.")
         os.chdir(self.srcdir)
+        self.cryptsetup = os.path.join(self.srcdir, 'cryptsetup')
+        if not os.access(self.cryptsetup, os.X_OK):
+            self.cryptsetup = 'cryptsetup'
 
     def test(self):
         '''
         Running tests from cryptsetup
         '''
+        if not self.srcdir:
+            self.cancel("'make check' needs the upstream or distro sources")
         count = 0
         output = build.run_make(self.srcdir, extra_args="check",
                                 process_kwargs={"ignore_status": True})
@@ -87,3 +138,207 @@ class CryptSetup(Test):
                 self.log.info(line)
         if count:
             self.fail("%s test(s) failed, please refer to the log" % count)
+
+    def create_backing(self, kind, size_mb):
+        """
+        Create the brd ram disk or loop device the mappings sit on
+        """
+        if kind == 'brd':
+            if os.path.exists('/sys/module/brd'):
+                self.cancel("brd is already loaded, can not size it")
+            process.run('modprobe brd rd_nr=1 rd_size=%d' % (size_mb * 1024),
+                        sudo=True)
+            self.backing = ('brd', '/dev/ram0')
+        else:
+            image = os.path.join(self.workdir, 'dm_crypt_backing.img')
+            process.run('dd if=/dev/zero of=%s bs=1M count=%d' %
+                        (image, size_mb))
+            loop = process.system_output('losetup -f --show --direct-io=on '
+                                         '%s' % image, sudo=True).decode()
+            self.backing = ('loop', loop.strip())
+        return self.backing[1]
+
+    def remove_backing(self):
+        if self.backing is None:
+            return
+        kind, device = self.backing
+        if kind == 'brd':
+            process.run('rmmod brd', sudo=True, ignore_status=True)
+        else:
+            process.run('losetup -d %s' % device, sudo=True,
+                        ignore_status=True)
+        self.backing = None
+
+    def close_mapping(self):
+        if self.mapping:
+            process.run('%s close %s' % (self.cryptsetup, self.mapping),
+                        sudo=True, ignore_status=True)
+            self.mapping = None
+
+    def run_fio(self, device, name, job, runtime, iodepth, numjobs):
+        """
+        Run one fio job against device, measuring the CPU time and cycles
+        spent system wide, so the dm-crypt work done in kworkers counts
+
+        :return: dict with bw MiB/s, iops, cpu_seconds and cycles_per_byte
+        """
+        rw, bs = job.split(':')
+        output = os.path.join(self.logdir, 'fio_%s_%s.json' %
+                              (name, rw))
+        cmd = ('fio --name=%s --filename=%s --rw=%s --bs=%s --direct=1 '
+               '--ioengine=libaio --iodepth=%d --numjobs=%d --runtime=%d '
+               '--time_based --group_reporting --output-format=json '
+               '--output=%s' % (name, device, rw, bs, iodepth, numjobs,
+                                runtime, output))
+        cycles = None
+        perf_out = os.path.join(self.workdir, 'perf_cycles.csv')
+        use_perf = shutil.which('perf') and \
+            self.params.get('use_perf', default=True)
+        if use_perf:
+            cmd = 'perf stat -a -x, -e cycles -o %s -- %s' % (perf_out, cmd)
+        busy = cpu_busy_seconds()
+        process.run(cmd, sudo=True)
+        busy = cpu_busy_seconds() - busy
+        if use_perf:
+            with open(perf_out) as perf_fd:
+                for line in perf_fd:
+                    fields = line.split(',')
+                    if len(fields) > 2 and fields[2].startswith('cycles') \
+                            and fields[0].isdigit():
+                        cycles = int(fields[0])
+        if cycles is None:
+            # no usable hardware counter, estimate from the busy time
+            cycles = busy * cpu_hz()
+        with open(output) as fio_fd:
+            result = json.load(fio_fd)['jobs'][0]
+        data = result['read'] if 'read' in rw else result['write']
+        total_bytes = data['io_bytes'] or 1
+        return {'bw_mib_s': round(data['bw_bytes'] / 1048576.0, 2),
+                'iops': round(data['iops'], 1),
+                'cpu_seconds': round(busy, 2),
+                'cycles_per_byte': round(cycles / total_bytes, 3)}
+
+    def cipher_benchmark(self, ciphers):
+        """
+        'cryptsetup benchmark' numbers for every swept cipher, as the
+        in-memory reference of what the cipher can do
+        """
+        reference = {}
+        for cipher, key_size in ciphers:
+            output = process.run('%s benchmark --cipher %s --key-size %s' %
+                                 (self.cryptsetup, cipher, key_size),
+                                 sudo=True, ignore_status=True).stdout_text
+            for line in output.splitlines():
+                match = BENCHMARK_RE.match(line)
+                if match:
+                    reference['%s/%s' % (cipher, key_size)] = {
+                        'encryption_mib_s': float(match.group(3)),
+                        'decryption_mib_s': float(match.group(4))}
+        return reference
+
+    def test_performance(self):
+        """
+        Compare fio on LUKS2 mappings against the raw backing device,
+        sweeping cipher, sector size and the dm-crypt workqueue flags
+        """
+        backing = self.params.get('backing', default='brd')
+        size_mb = int(self.params.get('size_mb', default=2048))
+        ciphers = [entry.rsplit('/', 1) for entry in self.params.get(
+            'ciphers', default='aes-xts-plain64/512').split()]
+        sector_sizes = [int(val) for val in str(self.params.get(
+            'sector_sizes', default='512 4096')).split()]
+        flag_sets = [[] if val == 'none' else val.split(',') for val in
+                     self.params.get('flag_sets', default='none '
+                                     'no_read_workqueue,no_write_workqueue '
+                                     'same_cpu_crypt').split()]
+        jobs = self.params.get('fio_jobs', default='write:1M read:1M '
+                               'randwrite:4k randread:4k').split()
+        runtime = int(self.params.get('runtime', default=20))
+        iodepth = int(self.params.get('iodepth', default=32))
+        numjobs = int(self.params.get('numjobs', default=4))
+        for flags in flag_sets:
+            unknown = [flag for flag in flags if flag not in PERF_FLAGS]
+            if unknown:
+                self.cancel("Unknown dm-crypt flag(s) %s" % unknown)
+
+        report = {'backing': backing, 'size_mb': size_mb,
+                  'reference': self.cipher_benchmark(ciphers), 'raw': {},
+                  'crypt': []}
+        device = self.create_backing(backing, size_mb)
+        # the raw runs overwrite the device, so they go before luksFormat
+        for job in jobs:
+            report['raw'][job] = self.run_fio(device, 'raw', job, runtime,
+                                              iodepth, numjobs)
+            self.log.info("raw %s: %s", job, report['raw'][job])
+
+        key_file = os.path.join(self.workdir, 'dm_crypt.key')
+        with open(key_file, 'wb') as key_fd:
+            key_fd.write(os.urandom(64))
+        for cipher, key_size in ciphers:
+            for sector in sector_sizes:
+                # a cheap PBKDF, the key slot is not what is measured
+                process.run('%s luksFormat -q --type luks2 --cipher %s '
+                            '--key-size %s --sector-size %d --pbkdf pbkdf2 '
+                            '--pbkdf-force-iterations 1000 --key-file %s %s'
+                            % (self.cryptsetup, cipher, key_size, sector,
+                               key_file, device), sudo=True)
+                for flags in flag_sets:
+                    self.mapping = 'avocado_dmcrypt'
+                    process.run('%s open --type luks2 --key-file %s %s %s %s'
+                                % (self.cryptsetup, key_file,
+                                   ' '.join(PERF_FLAGS[flag]
+                                            for flag in flags),
+                                   device, self.mapping), sudo=True)
+                    table = process.system_output(
+                        'dmsetup table %s' % self.mapping,
+                        sudo=True).decode()
+                    missing = [flag for flag in flags if flag not in table]
+                    if missing:
+                        self.log.warning("%s not supported by this kernel, "
+                                         "skipping %s", missing, flags)
+                        self.close_mapping()
+                        continue
+                    name = '%s_%s_%d_%s' % (cipher.replace(':', '_'),
+                                            key_size, sector,
+                                            '+'.join(flags) or 'none')
+                    for job in jobs:
+                        result = self.run_fio('/dev/mapper/%s' %
+                                              self.mapping, name, job,
+                                              runtime, iodepth, numjobs)
+                        raw = report['raw'][job]
+                        result.update({
+                            'cipher': cipher, 'key_size': int(key_size),
+                            'sector_size': sector, 'flags': flags,
+                            'job': job,
+                            'bw_overhead_pct': round(
+                                100.0 * (1 - result['bw_mib_s'] /
+                                         max(raw['bw_mib_s'], 0.01)), 1),
+                            'iops_overhead_pct': round(
+                                100.0 * (1 - result['iops'] /
+                                         max(raw['iops'], 0.01)), 1),
+                            'extra_cycles_per_byte': round(
+                                result['cycles_per_byte'] -
+                                raw['cycles_per_byte'], 3)})
+                        report['crypt'].append(result)
+                    self.close_mapping()
+
+        self.log.info("%-28s %6s %-40s %-12s %10s %8s %8s %8s", 'cipher',
+                      'sector', 'flags', 'job', 'MiB/s', 'bw ovh%',
+                      'iops ovh%', '+cyc/B')
+        for result in report['crypt']:
+            self.log.info("%-28s %6d %-40s %-12s %10.1f %8.1f %8.1f %8.3f",
+                          '%s/%s' % (result['cipher'], result['key_size']),
+                          result['sector_size'],
+                          ','.join(result['flags']) or 'none', result['job'],
+                          result['bw_mib_s'], result['bw_overhead_pct'],
+                          result['iops_overhead_pct'],
+                          result['extra_cycles_per_byte'])
+        with open(os.path.join(self.logdir, 'dm_crypt_perf.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+        if not report['crypt']:
+            self.fail("No dm-crypt configuration could be measured")
+
+    def tearDown(self):
+        self.close_mapping()
+        self.remove_backing()
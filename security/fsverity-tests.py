@@ -15,10 +15,70 @@
 # Author: Nageswara R Sastry <rnsastry@linux.ibm.com>
 
 import os
+import json
+import time
+import fcntl
+import shutil
+import struct
+import platform
 from avocado import Test
-from avocado.utils import build, distro, git, linux_modules
+from avocado.utils import build, distro, git, linux_modules, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+FSCRYPT_KEY_SPEC_TYPE_IDENTIFIER = 2
+FSCRYPT_MODE_AES_256_XTS = 1
+FSCRYPT_MODE_AES_256_CTS = 4
+FSCRYPT_POLICY_FLAGS_PAD_32 = 3
+# struct fscrypt_add_key_arg without the raw key
+ADD_KEY_FMT = '=II32sII32x'
+# struct fscrypt_policy_v2
+POLICY_V2_FMT = '=BBBB4x16s'
+
+
+def ioc(direction, nr, size):
+    """
+    ioctl number of an 'f' ioctl, direction being 'r', 'w' or 'rw'
+    """
+    if platform.machine().startswith(('ppc', 'mips', 'sparc')):
+        # 13 bit size field and 3 bit direction with read=2 and write=4
+        bits = {'r': 2, 'w': 4, 'rw': 6}[direction]
+        return (bits << 29) | (size << 16) | (ord('f') << 8) | nr
+    bits = {'r': 2, 'w': 1, 'rw': 3}[direction]
+    return (bits << 30) | (size << 16) | (ord('f') << 8) | nr
+
+
+def fscrypt_encrypt_dir(mountpoint, directory):
+    """
+    Add a random v2 master key to the filesystem and set an
+    AES-256-XTS/AES-256-CTS policy on the empty directory
+    """
+    key = os.urandom(64)
+    arg = bytearray(struct.pack(ADD_KEY_FMT,
+                                FSCRYPT_KEY_SPEC_TYPE_IDENTIFIER, 0, b'',
+                                len(key), 0) + key)
+    fd = os.open(mountpoint, os.O_RDONLY)
+    try:
+        # FS_IOC_ADD_ENCRYPTION_KEY, the kernel fills the identifier in
+        fcntl.ioctl(fd, ioc('rw', 23, struct.calcsize(ADD_KEY_FMT)), arg)
+    finally:
+        os.close(fd)
+    identifier = bytes(arg[8:24])
+    policy = struct.pack(POLICY_V2_FMT, 2, FSCRYPT_MODE_AES_256_XTS,
+                         FSCRYPT_MODE_AES_256_CTS,
+                         FSCRYPT_POLICY_FLAGS_PAD_32, identifier)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        # FS_IOC_SET_ENCRYPTION_POLICY is declared with the v1 policy size
+        fcntl.ioctl(fd, ioc('r', 19, 12), policy)
+    finally:
+        os.close(fd)
+
+
+def drop_caches():
+    process.run('sync', shell=True)
+    with open('/proc/sys/vm/drop_caches', 'w') as caches:
+        caches.write('3')
+
 
 class fsverity(Test):
 
@@ -54,6 +114,8 @@ class fsverity(Test):
         git.get_repo(url, destination_dir=self.workdir)
         os.chdir(self.workdir)
         build.make(self.workdir)
+        self.loop = None
+        self.mountpoint = None
 
     def test(self):
         '''
@@ -68,3 +130,156 @@ class fsverity(Test):
                 self.log.info(line)
         if count:
             self.fail("%s test(s) failed, please refer to the log" % count)
+
+    def create_fs(self, fstype, size_mb):
+        """
+        Make an fstype filesystem with the encrypt and verity features on
+        a loop device and mount it
+        """
+        image = os.path.join(self.workdir, 'bench.img')
+        process.run('truncate -s %dM %s' % (size_mb, image))
+        self.loop = process.system_output('losetup -f --show %s' % image,
+                                          sudo=True).decode().strip()
+        if fstype == 'f2fs':
+            mkfs = 'mkfs.f2fs -f -O extra_attr,encrypt,verity %s'
+        else:
+            mkfs = 'mkfs.ext4 -F -b 4096 -O encrypt,verity %s'
+        if process.run(mkfs % self.loop, sudo=True,
+                       ignore_status=True).exit_status:
+            self.cancel("%s does not support encrypt and verity here" %
+                        fstype)
+        self.mountpoint = os.path.join(self.workdir, 'mnt')
+        os.makedirs(self.mountpoint, exist_ok=True)
+        process.run('mount -t %s %s %s' % (fstype, self.loop,
+                                           self.mountpoint), sudo=True)
+
+    def fio_file(self, path, job, cache, size_mb, runtime):
+        """
+        Run one buffered fio job on a file
+
+        :return: dict with MiB/s, IOPS and completion latency mean/p99 in us
+        """
+        rw, bs = job.split(':')
+        cmd = ('fio --name=bench --filename=%s --rw=%s --bs=%s --size=%dM '
+               '--ioengine=psync --output-format=json' %
+               (path, rw, bs, size_mb))
+        if 'write' in rw:
+            cmd += ' --end_fsync=1'
+        elif cache == 'cold':
+            # one pass over an uncached file
+            drop_caches()
+            cmd += ' --invalidate=1'
+        else:
+            process.run('cat %s > /dev/null' % path, shell=True)
+            cmd += ' --invalidate=0 --time_based --runtime=%d' % runtime
+        output = process.run(cmd, sudo=True).stdout_text
+        job_result = json.loads(output[output.index('{'):])['jobs'][0]
+        data = job_result['write' if 'write' in rw else 'read']
+        percentiles = data['clat_ns'].get('percentile', {})
+        return {'bw_mib_s': round(data['bw_bytes'] / 1048576.0, 2),
+                'iops': round(data['iops'], 1),
+                'lat_mean_us': round(data['clat_ns']['mean'] / 1000.0, 2),
+                'lat_p99_us': round(percentiles.get('99.000000', 0) /
+                                    1000.0, 2)}
+
+    def time_verity_enable(self, fsverity, path, size_mb):
+        """
+        Write a file and time building its Merkle tree from a cold cache
+        """
+        process.run('dd if=/dev/urandom of=%s bs=1M count=%d' %
+                    (path, size_mb))
+        drop_caches()
+        start = time.monotonic()
+        process.run('%s enable %s' % (fsverity, path), sudo=True)
+        elapsed = time.monotonic() - start
+        return {'size_mb': size_mb, 'seconds': round(elapsed, 3),
+                'mib_s': round(size_mb / elapsed, 2)}
+
+    def test_benchmark(self):
+        """
+        Compare I/O on plain, fscrypt encrypted and fs-verity files of one
+        filesystem, and time fs-verity Merkle tree builds
+        """
+        fstype = self.params.get('fs', default='ext4')
+        image_mb = int(self.params.get('image_mb', default=4096))
+        size_mb = int(self.params.get('bench_size_mb', default=512))
+        jobs = self.params.get('jobs', default='read:1M randread:4k '
+                               'write:1M randwrite:4k').split()
+        runtime = int(self.params.get('runtime', default=10))
+        verity_sizes = [int(val) for val in str(self.params.get(
+            'verity_sizes_mb', default='16 128 1024')).split()]
+        fsverity = os.path.join(self.workdir, 'fsverity')
+        if not os.access(fsverity, os.X_OK):
+            fsverity = shutil.which('fsverity')
+        if not fsverity:
+            self.cancel("fsverity tool not available")
+        if linux_modules.check_kernel_config("CONFIG_FS_ENCRYPTION") == \
+                linux_modules.ModuleConfig.NOT_SET:
+            self.cancel("CONFIG_FS_ENCRYPTION not set.")
+        self.create_fs(fstype, image_mb)
+
+        variants = {}
+        for name in ['plain', 'fscrypt', 'verity']:
+            variants[name] = os.path.join(self.mountpoint, name)
+            os.makedirs(variants[name])
+        try:
+            fscrypt_encrypt_dir(self.mountpoint, variants['fscrypt'])
+        except OSError as details:
+            self.cancel("Can not set up fscrypt: %s" % details)
+        # the same content in each variant, verity files are read only
+        data = os.path.join(variants['plain'], 'data')
+        process.run('dd if=/dev/urandom of=%s bs=1M count=%d' %
+                    (data, size_mb))
+        for name in ['fscrypt', 'verity']:
+            shutil.copyfile(data, os.path.join(variants[name], 'data'))
+        process.run('%s enable %s' % (fsverity, os.path.join(
+            variants['verity'], 'data')), sudo=True)
+
+        report = {'fs': fstype, 'kernel': platform.release(),
+                  'size_mb': size_mb, 'results': [], 'verity_enable': []}
+        for job in jobs:
+            writes = 'write' in job.split(':')[0]
+            for cache in (['-'] if writes else ['cold', 'warm']):
+                plain = None
+                for name in ['plain', 'fscrypt', 'verity']:
+                    if writes and name == 'verity':
+                        continue
+                    target = os.path.join(variants[name],
+                                          'wdata' if writes else 'data')
+                    result = self.fio_file(target, job, cache, size_mb,
+                                           runtime)
+                    result.update({'variant': name, 'job': job,
+                                   'cache': cache})
+                    if plain is None:
+                        plain = result
+                    result['bw_overhead_pct'] = round(100.0 * (
+                        1 - result['bw_mib_s'] /
+                        max(plain['bw_mib_s'], 0.01)), 1)
+                    result['lat_overhead_pct'] = round(100.0 * (
+                        result['lat_mean_us'] /
+                        max(plain['lat_mean_us'], 0.01) - 1), 1)
+                    report['results'].append(result)
+                    self.log.info("%-8s %-14s %-5s %10.1f MiB/s %10.1f us "
+                                  "bw %+6.1f%% lat %+6.1f%%", name, job,
+                                  cache, result['bw_mib_s'],
+                                  result['lat_mean_us'],
+                                  -result['bw_overhead_pct'],
+                                  result['lat_overhead_pct'])
+
+        for verity_mb in verity_sizes:
+            result = self.time_verity_enable(fsverity, os.path.join(
+                self.mountpoint, 'verity_%dM' % verity_mb), verity_mb)
+            report['verity_enable'].append(result)
+            self.log.info("fsverity enable %6d MiB: %.3f s (%.1f MiB/s)",
+                          verity_mb, result['seconds'], result['mib_s'])
+        with open(os.path.join(self.logdir, 'fs_crypt_verity_bench.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+
+    def tearDown(self):
+        if getattr(self, 'mountpoint', None):
+            process.run('umount %s' % self.mountpoint, sudo=True,
+                        ignore_status=True)
+        if getattr(self, 'loop', None):
+            process.run('losetup -d %s' % self.loop, sudo=True,
+                        ignore_status=True)
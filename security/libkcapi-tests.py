@@ -15,10 +15,113 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import re
+import json
+import glob
+import shutil
+import socket
+import platform
+import subprocess
+import threading
+import time
 from avocado import Test
 from avocado.utils import archive, build, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# AF_ALG socket type, key size and IV size per compared algorithm
+KCAPI_ALGS = {'gcm(aes)': ('aead', 16, 12),
+              'cbc(aes)': ('skcipher', 16, 16),
+              'ctr(aes)': ('skcipher', 16, 16),
+              'xts(aes)': ('skcipher', 32, 16),
+              'sha1': ('hash', 0, 0),
+              'sha256': ('hash', 0, 0),
+              'sha512': ('hash', 0, 0)}
+
+# generic C implementations, used when /proc/crypto has none registered
+GENERIC_DRIVERS = {'gcm(aes)': 'gcm_base(ctr(aes-generic),ghash-generic)',
+                   'cbc(aes)': 'cbc(aes-generic)',
+                   'ctr(aes)': 'ctr(aes-generic)',
+                   'xts(aes)': 'xts(ecb(aes-generic))',
+                   'sha1': 'sha1-generic',
+                   'sha256': 'sha256-generic',
+                   'sha512': 'sha512-generic'}
+
+AEAD_TAG = 16
+
+
+def read_proc_crypto():
+    """
+    Parse /proc/crypto into a list of dicts, one per registered driver
+    """
+    entries = []
+    entry = {}
+    with open('/proc/crypto') as crypto:
+        for line in crypto:
+            key, sep, value = line.partition(':')
+            if not sep:
+                if entry:
+                    entries.append(entry)
+                entry = {}
+                continue
+            entry[key.strip()] = value.strip()
+    if entry:
+        entries.append(entry)
+    return entries
+
+
+def afalg_worker(alg_type, driver, key_len, iv_len, size, seconds, result):
+    """
+    Encrypt or hash size byte buffers through AF_ALG for seconds and
+    append the number of operations done to result, or the OSError that
+    stopped the worker
+    """
+    try:
+        result.append(afalg_ops(alg_type, driver, key_len, iv_len, size,
+                                seconds))
+    except OSError as details:
+        result.append(details)
+
+
+def afalg_ops(alg_type, driver, key_len, iv_len, size, seconds):
+    """
+    Number of size byte AF_ALG operations done on driver in seconds
+    """
+    sock = socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET, 0)
+    try:
+        sock.bind((alg_type, driver))
+        if key_len:
+            sock.setsockopt(socket.SOL_ALG, socket.ALG_SET_KEY,
+                            os.urandom(key_len))
+        if alg_type == 'aead':
+            sock.setsockopt(socket.SOL_ALG, socket.ALG_SET_AEAD_AUTHSIZE,
+                            None, AEAD_TAG)
+        op_sock, _ = sock.accept()
+    except OSError:
+        sock.close()
+        raise
+    data = bytes(size)
+    iv = bytes(iv_len)
+    ops = 0
+    end = time.monotonic() + seconds
+    try:
+        while time.monotonic() < end:
+            if alg_type == 'hash':
+                op_sock.sendall(data)
+                op_sock.recv(64)
+            elif alg_type == 'aead':
+                op_sock.sendmsg_afalg([data], op=socket.ALG_OP_ENCRYPT,
+                                      iv=iv, assoclen=0)
+                op_sock.recv(size + AEAD_TAG)
+            else:
+                op_sock.sendmsg_afalg([data], op=socket.ALG_OP_ENCRYPT,
+                                      iv=iv)
+                op_sock.recv(size)
+            ops += 1
+    finally:
+        op_sock.close()
+        sock.close()
+    return ops
+
 
 class LibKCAPI(Test):
     """
@@ -72,3 +175,220 @@ class LibKCAPI(Test):
                 self.log.info(line)
         if count:
             self.fail("%s test(s) failed, please refer to the log" % count)
+
+    def find_kcapi_speed(self):
+        """
+        Path of the kcapi-speed binary, built or installed
+        """
+        for path in glob.glob(os.path.join(self.srcdir, '**', 'kcapi-speed'),
+                              recursive=True):
+            if os.access(path, os.X_OK) and os.path.isfile(path):
+                return path
+        return shutil.which('kcapi-speed')
+
+    @staticmethod
+    def parse_speed_line(line):
+        """
+        Parse one kcapi-speed result line, like
+        "AES(G) CBC(G) 128  |e|  4096 bytes|  180.35 MB/s|  46170 ops/s"
+
+        :return: dict with test, direction, bytes, mb_s and ops_s or None
+        """
+        ops = re.search(r'(\d+)\s*ops/s', line)
+        rate = re.search(r'([\d.]+)\s*([KMG]?)B/s', line)
+        size = re.search(r'(\d+)\s*bytes', line)
+        if not (ops and rate and size):
+            return None
+        scale = {'': 1.0 / 1024 / 1024, 'K': 1.0 / 1024, 'M': 1.0,
+                 'G': 1024.0}[rate.group(2)]
+        fields = [field.strip() for field in line.split('|')]
+        return {'test': fields[0],
+                'direction': fields[1] if len(fields) > 4 else '',
+                'bytes': int(size.group(1)),
+                'mb_s': float(rate.group(1)) * scale,
+                'ops_s': int(ops.group(1))}
+
+    def run_kcapi_speed(self, speed, name, blocks, threads, seconds):
+        """
+        Run threads concurrent kcapi-speed instances of one test and sum
+        their results per direction
+        """
+        cmd = [speed, '-c', name, '-t', str(seconds), '-b', str(blocks)]
+        procs = [subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT)
+                 for _ in range(threads)]
+        total = {}
+        for proc in procs:
+            output = proc.communicate()[0].decode('utf-8', 'replace')
+            for line in output.splitlines():
+                res = self.parse_speed_line(line)
+                if res is None:
+                    continue
+                entry = total.setdefault(res['direction'], {
+                    'test': name, 'direction': res['direction'],
+                    'blocks': blocks, 'threads': threads,
+                    'bytes': res['bytes'], 'mb_s': 0.0, 'ops_s': 0})
+                entry['mb_s'] += res['mb_s']
+                entry['ops_s'] += res['ops_s']
+        return list(total.values())
+
+    def chosen_driver(self, alg):
+        """
+        Driver the kernel uses for alg: highest priority, self test
+        passed and not internal
+        """
+        alg_type = KCAPI_ALGS[alg][0]
+        try:
+            # instantiate templates so they show up in /proc/crypto
+            sock = socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET, 0)
+            sock.bind((alg_type, alg))
+            sock.close()
+        except OSError as details:
+            self.log.warning("%s not available: %s", alg, details)
+            return None, None
+        candidates = [entry for entry in read_proc_crypto()
+                      if entry.get('name') == alg and
+                      entry.get('internal', 'no') == 'no' and
+                      entry.get('selftest', 'passed') == 'passed']
+        if not candidates:
+            return None, None
+        best = max(candidates, key=lambda entry: int(entry['priority']))
+        generic = [entry['driver'] for entry in candidates
+                   if 'generic' in entry['driver']]
+        return best['driver'], generic[0] if generic else \
+            GENERIC_DRIVERS.get(alg)
+
+    def afalg_throughput(self, alg, driver, size, threads, seconds):
+        """
+        Aggregate ops/s and MB/s of threads AF_ALG workers on a driver
+        """
+        alg_type, key_len, iv_len = KCAPI_ALGS[alg]
+        result = []
+        workers = [threading.Thread(target=afalg_worker,
+                                    args=(alg_type, driver, key_len,
+                                          iv_len, size, seconds, result))
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        errors = [res for res in result if isinstance(res, OSError)]
+        if errors or len(result) != threads:
+            self.log.warning("%s through %s failed: %s", alg, driver,
+                             errors[0] if errors else "worker lost")
+            return None
+        ops_s = sum(result) / float(seconds)
+        return {'ops_s': round(ops_s, 1),
+                'mb_s': round(ops_s * size / 1024 / 1024, 2)}
+
+    def test_speed(self):
+        """
+        Benchmark the kernel crypto API: kcapi-speed over its tests,
+        buffer sizes and threads, and the driver the kernel chose against
+        the generic implementation for the compared algorithms
+        """
+        seconds = int(self.params.get('speed_time', default=2))
+        threads_list = [int(val) for val in str(self.params.get(
+            'speed_threads', default="1 4")).split()]
+        blocks_list = [int(val) for val in str(self.params.get(
+            'speed_blocks', default="1 64 1024")).split()]
+        sizes = [int(val) for val in str(self.params.get(
+            'compare_sizes', default="64 1024 16384 65536")).split()]
+        algs = self.params.get('compare_algs', default=' '.join(
+            sorted(KCAPI_ALGS))).split()
+        test_filter = re.compile(self.params.get(
+            'speed_filter', default=r'AES|SHA|GCM'))
+        min_speedup = float(self.params.get('min_speedup', default=0.9))
+        results_dir = self.params.get('results_dir',
+                                      default='/var/tmp/libkcapi-speed')
+        baseline = self.params.get('baseline', default=None)
+        threshold = float(self.params.get('regression_threshold',
+                                          default=10))
+        report = {'kernel': platform.release(), 'kcapi_speed': [],
+                  'drivers': []}
+
+        speed = self.find_kcapi_speed()
+        if speed:
+            listing = process.run('%s -l' % speed, ignore_status=True)
+            # listing lines may carry a test index in front of the name
+            names = [re.sub(r'^\s*\d+[:.)]?\s+', '', line).strip()
+                     for line in listing.stdout_text.splitlines()
+                     if line.strip() and test_filter.search(line)]
+            for name in names:
+                for blocks in blocks_list:
+                    for threads in threads_list:
+                        report['kcapi_speed'].extend(self.run_kcapi_speed(
+                            speed, name, blocks, threads, seconds))
+        else:
+            self.log.warning("kcapi-speed not found, only comparing drivers")
+
+        fallbacks = []
+        for alg in algs:
+            if alg not in KCAPI_ALGS:
+                self.log.warning("Unknown algorithm %s, skipped", alg)
+                continue
+            chosen, generic = self.chosen_driver(alg)
+            if chosen is None:
+                continue
+            if generic is None or chosen == generic:
+                self.log.warning("%s: the kernel uses the generic "
+                                 "implementation %s", alg, chosen)
+                fallbacks.append(alg)
+            for size in sizes:
+                for threads in threads_list:
+                    entry = {'alg': alg, 'size': size, 'threads': threads,
+                             'chosen': chosen, 'generic': generic}
+                    entry['chosen_result'] = self.afalg_throughput(
+                        alg, chosen, size, threads, seconds)
+                    entry['generic_result'] = None
+                    if generic and generic != chosen:
+                        entry['generic_result'] = self.afalg_throughput(
+                            alg, generic, size, threads, seconds)
+                    if entry['chosen_result'] and entry['generic_result']:
+                        entry['speedup'] = round(
+                            entry['chosen_result']['mb_s'] /
+                            max(entry['generic_result']['mb_s'], 0.01), 2)
+                        if entry['speedup'] < min_speedup:
+                            fallbacks.append("%s/%s" % (alg, size))
+                    self.log.info("%-10s %6d bytes %3d thr: %s %s MB/s, %s "
+                                  "%s MB/s, speedup %s", alg, size, threads,
+                                  chosen, (entry['chosen_result'] or
+                                           {}).get('mb_s'),
+                                  generic, (entry['generic_result'] or
+                                            {}).get('mb_s'),
+                                  entry.get('speedup'))
+                    report['drivers'].append(entry)
+
+        with open(os.path.join(self.logdir, 'kcapi_speed.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        with open(os.path.join(results_dir, '%s.json' % report['kernel']),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+
+        regressions = []
+        if baseline:
+            if not os.path.isfile(baseline):
+                baseline = os.path.join(results_dir, '%s.json' % baseline)
+            with open(baseline) as base_fd:
+                base = json.load(base_fd)
+            old = {(entry['alg'], entry['size'], entry['threads']):
+                   entry['chosen_result'] for entry in base['drivers']}
+            for entry in report['drivers']:
+                before = old.get((entry['alg'], entry['size'],
+                                  entry['threads']))
+                now = entry['chosen_result']
+                if before and now and now['mb_s'] < \
+                        before['mb_s'] * (1 - threshold / 100.0):
+                    regressions.append("%s/%s/%s: %s -> %s MB/s" % (
+                        entry['alg'], entry['size'], entry['threads'],
+                        before['mb_s'], now['mb_s']))
+            for regression in regressions:
+                self.log.warning("Regression against %s: %s",
+                                 base['kernel'], regression)
+        if fallbacks or regressions:
+            self.fail("%d generic fallback(s) or slower than generic and "
+                      "%d regression(s), see kcapi_speed.json" %
+                      (len(fallbacks), len(regressions)))
@@ -15,10 +15,46 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import json
+import platform
 from avocado import Test
-from avocado.utils import archive, build, distro, process
+from avocado.utils import archive, build, cpu, distro, process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+# Environment variable and value masking the accelerated crypto paths
+CAP_MASKS = {'ppc64le': ('OPENSSL_ppccap', '0'),
+             'ppc64': ('OPENSSL_ppccap', '0'),
+             'aarch64': ('OPENSSL_armcap', '0'),
+             # CPUID.1:ECX PCLMULQDQ, SSSE3, AES-NI and AVX, then
+             # CPUID.7:EBX BMI1, AVX2, BMI2, AVX512F/DQ/IFMA, ADX, SHA,
+             # AVX512BW/VL and CPUID.7:ECX VAES and VPCLMULQDQ, so that
+             # chacha20-poly1305 and sha512 lose their SIMD paths too
+             'x86_64': ('OPENSSL_ia32cap',
+                        '~0x1200020200000000:~0x600e02b0128'),
+             's390x': ('OPENSSL_s390xcap', 'stfle:0:0:0')}
+
+
+def parse_speed(output):
+    """
+    Parse "openssl speed -mr" output
+
+    :return: dict of algorithm -> {block size: bytes per second}
+    """
+    sizes = []
+    results = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('Got: +H:'):
+            # with -multi only the children report the block sizes
+            line = line[len('Got: '):].split()[0]
+        fields = line.split(':')
+        if fields[0] == '+H':
+            sizes = [int(val) for val in fields[1:]]
+        elif fields[0] == '+F' and len(fields) > 3:
+            results[fields[2]] = {size: float(val) for size, val in
+                                  zip(sizes, fields[3:])}
+    return results
+
 
 class OpenSSL(Test):
     """
@@ -33,6 +69,15 @@ class OpenSSL(Test):
         # Check for basic utilities
         run_type = self.params.get('type', default='upstream')
         smm = SoftwareManager()
+        self.srcdir = None
+        self.openssl = 'openssl'
+        self.openssl_env = {}
+        if run_type == "system":
+            # installed openssl, used by the speed mode
+            if not smm.check_installed('openssl') and \
+                    not smm.install('openssl'):
+                self.cancel('openssl is needed for the test to be run')
+            return
         detected_distro = distro.detect()
         deps = ['gcc', 'make']
         if detected_distro.name in ['rhel', 'redhat'] and\
@@ -55,6 +100,8 @@ class OpenSSL(Test):
             process.run('./Configure', ignore_status=True)
             if build.make(self.srcdir, process_kwargs={"ignore_status": True}):
                 self.fail("openssl-tests.py: 'make' command failed.")
+            self.openssl = os.path.join(self.srcdir, 'apps', 'openssl')
+            self.openssl_env = {'LD_LIBRARY_PATH': self.srcdir}
         elif run_type == "distro":
             self.srcdir = os.path.join(self.workdir, "openssl-distro")
             if not os.path.exists(self.srcdir):
@@ -70,6 +117,8 @@ class OpenSSL(Test):
         '''
         Running tests from openssl
         '''
+        if not self.srcdir:
+            self.cancel("'make test' needs the upstream or distro sources")
         count = 0
         output = build.run_make(self.srcdir, extra_args="test",
                                 process_kwargs={"ignore_status": True})
@@ -81,3 +130,114 @@ class OpenSSL(Test):
                 self.log.info(line)
         if count:
             self.fail("%s test(s) failed, please refer to the log" % count)
+
+    def run_speed(self, alg, threads, seconds, env):
+        """
+        Run "openssl speed -evp" for one algorithm on threads processes
+
+        :return: dict of block size -> MB/s, or None on failure
+        """
+        cmd = '%s speed -mr -evp %s -multi %d -seconds %d' % (
+            self.openssl, alg, threads, seconds)
+        result = process.run(cmd, env=env, ignore_status=True)
+        if result.exit_status:
+            self.log.warning("%s failed: %s", cmd, result.stderr_text)
+            return None
+        parsed = parse_speed(result.stdout_text)
+        if not parsed:
+            self.log.warning("No results in the output of %s", cmd)
+            return None
+        # one EVP algorithm per run
+        rates = list(parsed.values())[0]
+        return {size: round(rate / 1000000.0, 2)
+                for size, rate in rates.items()}
+
+    def test_speed(self):
+        """
+        Measure EVP throughput over thread counts, with the default CPU
+        capabilities and with the accelerated code paths masked
+        """
+        algs = self.params.get('algs', default='aes-128-gcm aes-256-gcm '
+                               'aes-256-ctr chacha20-poly1305 sha256 '
+                               'sha512').split()
+        online = cpu.online_count()
+        threads_list = sorted(set(
+            online if val == 'max' else min(int(val), online)
+            for val in str(self.params.get('threads',
+                                           default='1 max')).split()))
+        seconds = int(self.params.get('seconds', default=3))
+        min_speedup = float(self.params.get('min_speedup', default=1.2))
+        no_accel = self.params.get('no_accel_algs', default='').split()
+        arch = platform.machine()
+        cap_var, cap_mask = CAP_MASKS.get(arch, (None, None))
+        cap_mask = self.params.get('cap_mask', default=cap_mask)
+        runs = {'default': dict(self.openssl_env)}
+        if cap_var:
+            runs['masked'] = dict(self.openssl_env, **{cap_var: cap_mask})
+        else:
+            self.log.warning("No capability mask known for %s, only the "
+                             "default run is done", arch)
+
+        version = process.run('%s version' % self.openssl,
+                              env=self.openssl_env,
+                              ignore_status=True).stdout_text.strip()
+        report = {'version': version, 'arch': arch,
+                  'cap_mask': {cap_var: cap_mask} if cap_var else {},
+                  'results': {}, 'speedup': {}, 'scaling': {}}
+        for run, env in runs.items():
+            report['results'][run] = {}
+            for alg in algs:
+                report['results'][run][alg] = {}
+                for threads in threads_list:
+                    rates = self.run_speed(alg, threads, seconds, env)
+                    if rates:
+                        report['results'][run][alg][threads] = rates
+
+        lost = []
+        default = report['results']['default']
+        for alg in algs:
+            base = default[alg].get(1)
+            if base:
+                # efficiency of N processes against N times one process
+                report['scaling'][alg] = {
+                    threads: {size: round(rate / (threads * base[size]), 2)
+                              for size, rate in rates.items()
+                              if base.get(size)}
+                    for threads, rates in default[alg].items()}
+            if 'masked' not in report['results']:
+                continue
+            masked = report['results']['masked'][alg]
+            report['speedup'][alg] = {
+                threads: {size: round(rate / masked[threads][size], 2)
+                          for size, rate in rates.items()
+                          if masked[threads].get(size)}
+                for threads, rates in default[alg].items()
+                if threads in masked}
+            if alg in no_accel or not report['speedup'][alg]:
+                continue
+            # the largest block, on the smallest thread count
+            speedup = report['speedup'][alg][min(report['speedup'][alg])]
+            largest = speedup[max(speedup)] if speedup else None
+            if largest is not None and largest < min_speedup:
+                lost.append("%s (%sx)" % (alg, largest))
+
+        for run, algs_result in report['results'].items():
+            for alg, by_threads in algs_result.items():
+                for threads, rates in by_threads.items():
+                    self.log.info("%-8s %-20s %4d thr: %s", run, alg,
+                                  threads, ' '.join(
+                                      '%d:%.1f' % (size, rates[size])
+                                      for size in sorted(rates)))
+        for alg, by_threads in report['scaling'].items():
+            for threads, eff in by_threads.items():
+                if eff:
+                    self.log.info("scaling %-20s %4d thr: %s", alg, threads,
+                                  eff[max(eff)])
+        with open(os.path.join(self.logdir, 'openssl_speed.json'),
+                  'w') as result_fd:
+            json.dump(report, result_fd, indent=4)
+        if not any(report['results']['default'].values()):
+            self.fail("openssl speed produced no results")
+        if lost:
+            self.fail("Accelerated paths not faster than the masked ones "
+                      "(min %sx): %s" % (min_speedup, ', '.join(lost)))
@@ -15,7 +15,9 @@
 # Author: Ramya BS <ramya@linux.vnet.ibm.com>
 # Author: Harish S <harish@linux.vnet.ibm.com>
 
+import multiprocessing
 import os
+import sys
 
 from avocado import Test
 from avocado.utils import archive
@@ -23,6 +25,9 @@ from avocado.utils import build
 from avocado.utils import distro
 from avocado.utils import process
 from avocado.utils.software_manager.manager import SoftwareManager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'generic'))
+from stream_capture.capture import StreamCapture  # noqa: E402
 
 
 class GCC(Test):
@@ -94,27 +99,46 @@ class GCC(Test):
         process.run('./configure', ignore_status=True, sudo=True)
         build.make(self.sourcedir, ignore_status=True)
 
-    def get_summary(self, index):
+    def get_summary(self, line, stream):
         """
-        subroutine to print test result summary.
+        subroutine to print test result summary, fed line by line.
         """
+        if stream != 'stdout':
+            return
+        if "=== gcc Summary ===" in line:
+            # the summary lines start after the blank line under the marker
+            self.summary_skip = 1
+            return
+        if self.summary_skip is None:
+            return
+        if self.summary_skip:
+            self.summary_skip -= 1
+            return
         with open(os.path.join(self.outputdir, 'gcc_summary'), 'a') as f_obj:
-            while self.summary[index].startswith('#'):
-                f_obj.write('%s\n' % self.summary[index])
-                index += 1
-            f_obj.write('\n')
+            if line.startswith('#'):
+                f_obj.write('%s\n' % line)
+            else:
+                f_obj.write('\n')
+                self.summary_skip = None
 
     def test(self):
         """
         Runs the gcc `make check`
         """
-        ret = build.run_make(
-            self.sourcedir, extra_args='check',
-            process_kwargs={'ignore_status': True})
-        self.summary = ret.stdout.decode("utf-8").splitlines()
-        for index, line in enumerate(self.summary):
-            if "=== gcc Summary ===" in line:
-                self.get_summary(index + 2)
-
+        # make check prints hundreds of MB, stream it to a compressed file
+        # and only pick the summaries while it runs
+        self.summary_skip = None
+        capture = StreamCapture(os.path.join(self.outputdir,
+                                             'make_check.log.gz'))
+        capture.add_parser(self.get_summary)
+        # same options build.run_make() would pass
+        env = dict(os.environ)
+        if '-j' not in env.get('MAKEFLAGS', ''):
+            env['MAKEFLAGS'] = '%s -j%d' % (env.get('MAKEFLAGS', ''),
+                                            multiprocessing.cpu_count() + 1)
+        ret = capture.run('make %s -C %s check' %
+                          (env.get('MAKEOPTS', ''), self.sourcedir),
+                          env=env)
         if ret.exit_status:
+            self.log.info("make check output:\n%s", ret.excerpt())
             self.fail("Few gcc tests failed,refer the log file")